@@ -10,6 +10,7 @@
 from pylons.i18n import _, ungettext
 from pylons import g, c, request, session, response
 import simplejson as json
+import ckan.lib.json_codec as json_codec
 
 try:
     from collections import OrderedDict  # from python 2.7
@@ -19,6 +19,8 @@ import ckan.lib.helpers as h
 import ckan.lib.app_globals as app_globals
 import ckan.lib.render as render
 import ckan.lib.search as search
+import ckan.lib.instrumentation as instrumentation
+import ckan.lib.identity_cache as identity_cache
 import ckan.logic as logic
 import ckan.new_authz as new_authz
 import ckan.lib.jinja_extensions as jinja_extensions
@@ -357,6 +359,9 @@ def update_config():
     if not model.meta.engine:
         model.init_model(engine)
 
+    instrumentation.configure(config, model.meta.engine)
+    identity_cache.configure(config)
+
     for plugin in p.PluginImplementations(p.IConfigurable):
         plugin.configure(config)
 
@@ -24,6 +24,8 @@ from ckan.plugins import PluginImplementations
 from ckan.plugins.interfaces import IMiddleware
 from ckan.lib.i18n import get_locales_from_config
 import ckan.lib.uploader as uploader
+import ckan.lib.page_cache as page_cache
+import ckan.lib.tracking_buffer as tracking_buffer
 
 from ckan.config.environment import load_environment
 import ckan.lib.app_globals as app_globals
@@ -228,27 +230,22 @@ class I18nMiddleware(object):
 
 class PageCacheMiddleware(object):
     ''' A simple page cache that can store and serve pages. It uses
-    Redis as storage. It caches pages that have a http status code of
-    200, use the GET method. Only non-logged in users receive cached
-    pages.
+    one of the backends in :py:mod:`ckan.lib.page_cache` as storage. It
+    caches pages that have a http status code of 200, use the GET method.
+    Only non-logged in users receive cached pages.
     Cachable pages are indicated by a environ CKAN_PAGE_CACHABLE
-    variable.'''
+    variable.
+
+    Pages are stored gzip-compressed and served with an ETag, so clients
+    that accept gzip get the stored page as is and clients that already
+    have it get a 304 response.'''
 
     def __init__(self, app, config):
         self.app = app
-        import redis    # only import if used
-        self.redis = redis  # we need to reference this within the class
-        self.redis_exception = redis.exceptions.ConnectionError
-        self.redis_connection = None
+        self.cache = page_cache.get_backend(config)
 
     def __call__(self, environ, start_response):
 
-        def _start_response(status, response_headers, exc_info=None):
-            # This wrapper allows us to get the status and headers.
-            environ['CKAN_PAGE_STATUS'] = status
-            environ['CKAN_PAGE_HEADERS'] = response_headers
-            return start_response(status, response_headers, exc_info)
-
         # Only use cache for GET requests
         # REMOTE_USER is used by some tests.
         if environ['REQUEST_METHOD'] != 'GET' or environ.get('REMOTE_USER'):
@@ -259,70 +256,91 @@ class PageCacheMiddleware(object):
         cookie_string = environ.get('HTTP_COOKIE')
         if cookie_string:
             for cookie in cookie_string.split(';'):
+                cookie = cookie.strip()
                 if cookie.startswith('ckan') or cookie.startswith('auth_tkt'):
                     return self.app(environ, start_response)
 
         # Make our cache key
         key = 'page:%s?%s' % (environ['PATH_INFO'], environ['QUERY_STRING'])
 
-        # Try to connect if we don't have a connection. Doing this here
-        # allows the redis server to be unavailable at times.
-        if self.redis_connection is None:
-            try:
-                self.redis_connection = self.redis.StrictRedis()
-                self.redis_connection.flushdb()
-            except self.redis_exception:
-                # Connection may have failed at flush so clear it.
-                self.redis_connection = None
-                return self.app(environ, start_response)
-
         # If cached return cached result
-        try:
-            result = self.redis_connection.lrange(key, 0, 2)
-        except self.redis_exception:
-            # Connection failed so clear it and return the page as normal.
-            self.redis_connection = None
-            return self.app(environ, start_response)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return self._serve(cached, environ, start_response)
 
-        if result:
-            headers = json.loads(result[1])
-            # Convert headers from list to tuples.
-            headers = [(str(key), str(value)) for key, value in headers]
-            start_response(str(result[0]), headers)
-            # Returning a huge string slows down the server. Therefore we
-            # cut it up into more usable chunks.
-            page = result[2]
-            out = []
-            total = len(page)
-            position = 0
-            size = 4096
-            while position < total:
-                out.append(page[position:position + size])
-                position += size
-            return out
+        def _start_response(status, response_headers, exc_info=None):
+            # This wrapper allows us to get the status and headers, and to
+            # hold them back until we know if the page will be cached.
+            environ['CKAN_PAGE_STATUS'] = status
+            environ['CKAN_PAGE_HEADERS'] = response_headers
+            if exc_info:
+                passthrough.append(True)
+            if passthrough:
+                return start_response(status, response_headers, exc_info)
+            return written.append
 
         # Generate the response from our application.
+        written = []
+        passthrough = []
         page = self.app(environ, _start_response)
-
-        # Only cache http status 200 pages
-        if not environ['CKAN_PAGE_STATUS'].startswith('200'):
+        status = environ.get('CKAN_PAGE_STATUS')
+        headers = environ.get('CKAN_PAGE_HEADERS') or []
+        if status is None or passthrough:
+            # The application has already started the response with an error
+            # or will start it when it is iterated
+            passthrough.append(True)
             return page
 
-        cachable = False
-        if environ.get('CKAN_PAGE_CACHABLE'):
-            cachable = True
-
-        # Cache things if cachable.
+        # Only cache http status 200 pages that set no cookies and that
+        # aren't encoded already.
+        cachable = (status.startswith('200')
+                    and environ.get('CKAN_PAGE_CACHABLE'))
         if cachable:
-            # Make sure we consume any file handles etc.
-            page_string = ''.join(list(page))
-            # Use a pipe to add page in a transaction.
-            pipe = self.redis_connection.pipeline()
-            pipe.rpush(key, environ['CKAN_PAGE_STATUS'])
-            pipe.rpush(key, json.dumps(environ['CKAN_PAGE_HEADERS']))
-            pipe.rpush(key, page_string)
-            pipe.execute()
-        return page
+            header_names = set(name.lower() for name, value in headers)
+            cachable = not header_names & set(['set-cookie',
+                                               'content-encoding'])
+
+        if not cachable:
+            start_response(status, headers)
+            if written:
+                return written + list(page)
+            return page
+
+        # Make sure we consume any file handles etc.
+        try:
+            page_string = ''.join(written + list(page))
+        finally:
+            if hasattr(page, 'close'):
+                page.close()
+        cached = page_cache.make_page(status, headers, page_string)
+        # Pages that don't say what they show are purged on any change
+        dependencies = (environ.get('CKAN_PAGE_DEPENDENCIES') or
+                        [page_cache.ANY_CHANGE])
+        self.cache.set(key, cached, dependencies)
+        return self._serve(cached, environ, start_response)
+
+    def _serve(self, cached, environ, start_response):
+        headers = list(cached.headers)
+        headers.append(('ETag', cached.etag))
+        headers.append(('Vary', 'Accept-Encoding'))
+
+        if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+        if if_none_match:
+            etags = [etag.strip() for etag in if_none_match.split(',')]
+            if cached.etag in etags or '*' in etags:
+                headers = [(name, value) for name, value in headers
+                           if name.lower() != 'content-type']
+                start_response('304 Not Modified', headers)
+                return []
+
+        if 'gzip' in environ.get('HTTP_ACCEPT_ENCODING', ''):
+            body = cached.body
+            headers.append(('Content-Encoding', 'gzip'))
+        else:
+            body = cached.uncompressed_body()
+        headers.append(('Content-Length', str(len(body))))
+        start_response(cached.status, headers)
+        return [body]
 
 
 class TrackingMiddleware(object):
@@ -330,6 +348,17 @@ class TrackingMiddleware(object):
     def __init__(self, app, config):
         self.app = app
         self.engine = sa.create_engine(config.get('sqlalchemy.url'))
+        self.buffer = None
+        if asbool(config.get('ckan.tracking.buffered', False)):
+            self.buffer = tracking_buffer.TrackingBuffer(
+                self.engine,
+                max_events=int(config.get('ckan.tracking.buffer_size',
+                                          10000)),
+                flush_events=int(config.get('ckan.tracking.flush_events',
+                                            500)),
+                flush_interval=int(config.get('ckan.tracking.flush_interval',
+                                              1000)),
+                spool_file=config.get('ckan.tracking.spool_file'))
 
     def __call__(self, environ, start_response):
         path = environ['PATH_INFO']
@@ -354,6 +383,9 @@ class TrackingMiddleware(object):
             ])
             key = hashlib.md5(key).hexdigest()
             # store key/data here
+            if self.buffer is not None:
+                self.buffer.add(key, data.get('url'), data.get('type'))
+                return []
             sql = '''INSERT INTO tracking_raw
                      (user_key, url, tracking_type)
                      VALUES (%s, %s, %s)'''
@@ -119,6 +119,7 @@ def make_map():
     # /api ver 3 or none
     with SubMapper(map, controller='api', path_prefix='/api{ver:/3|}',
                    ver='/3') as m:
+        m.connect('/action/batch', action='batch', conditions=POST)
         m.connect('/action/{logic_function}', action='action',
                   conditions=GET_POST)
 
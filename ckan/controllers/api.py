@@ -3,10 +3,15 @@ import logging
 import cgi
 import datetime
 import glob
+import hashlib
+import multiprocessing.pool
 import urllib
 
+import pylons
+from pylons import config
 from webob.multidict import UnicodeMultiDict
 from paste.util.multidict import MultiDict
+from paste.deploy.converters import asbool
 
 import ckan.model as model
 import ckan.logic as logic
@@ -16,8 +21,9 @@ import ckan.lib.search as search
 import ckan.lib.navl.dictization_functions
 import ckan.lib.jsonp as jsonp
 import ckan.lib.munge as munge
+import ckan.lib.streaming as streaming
 
-from ckan.common import _, c, request, response
+from ckan.common import _, c, request, response, OrderedDict, json_codec
 
 
 log = logging.getLogger(__name__)
@@ -70,9 +76,12 @@ class ApiController(base.BaseController):
         return base.BaseController.__call__(self, environ, start_response)
 
     def _finish(self, status_int, response_data=None,
-                content_type='text'):
+                content_type='text', stream=False):
         '''When a controller method has completed, call this method
         to prepare the response.
+        @param stream - if True, JSON responses are returned as a
+           streaming.JSONStream that is encoded as it is sent, instead of
+           as a string.
         @return response message - return this value from the controller
                                    method
                  e.g. return self._finish(404, 'Package not found')
@@ -82,22 +91,28 @@ class ApiController(base.BaseController):
         response_msg = ''
         if response_data is not None:
             response.headers['Content-Type'] = CONTENT_TYPES[content_type]
-            if content_type == 'json':
-                response_msg = h.json.dumps(response_data)
-            else:
-                response_msg = response_data
             # Support "JSONP" callback.
+            callback = None
             if status_int == 200 and 'callback' in request.params and \
                 (request.method == 'GET' or
                  c.logic_function and request.method == 'POST'):
                 # escape callback to remove '<', '&', '>' chars
                 callback = cgi.escape(request.params['callback'])
+            if content_type == 'json' and stream:
+                if callback:
+                    callback = callback.encode('utf-8')
+                return streaming.JSONStream(response_data, callback)
+            if content_type == 'json':
+                response_msg = json_codec.dumps(response_data)
+            else:
+                response_msg = response_data
+            if callback:
                 response_msg = self._wrap_jsonp(callback, response_msg)
         return response_msg
 
     def _finish_ok(self, response_data=None,
                    content_type='json',
-                   resource_location=None):
+                   resource_location=None, stream=False):
         '''If a controller method has completed successfully then
         calling this method will prepare the response.
         @param resource_location - specify this if a new
@@ -112,7 +127,8 @@ class ApiController(base.BaseController):
         else:
             status_int = 200
 
-        return self._finish(status_int, response_data, content_type)
+        return self._finish(status_int, response_data, content_type,
+                            stream=stream)
 
     def _finish_not_authz(self, extra_msg=None):
         response_data = _('Access denied')
@@ -193,33 +209,141 @@ class ApiController(base.BaseController):
         # if callback is specified we do not want to send that to the search
         if 'callback' in request_data:
             del request_data['callback']
+
+        status_int, call_dict = self._call_action(function, context,
+                                                  request_data)
+        return_dict.update(call_dict)
+        if status_int != 200:
+            return self._compress(
+                self._finish(status_int, return_dict, content_type='json'))
+        stream = asbool(config.get('ckan.api.stream_responses', False))
+        response_msg = self._finish_ok(return_dict, stream=stream)
+        if side_effect_free and request.method == 'GET':
+            response_msg = self._finish_cacheable(response_msg)
+        return self._compress(response_msg)
+
+    def _accepts_gzip(self):
+        '''Whether the response should be gzipped, see
+        :ref:`ckan.api.gzip_responses`.'''
+        return (asbool(config.get('ckan.api.gzip_responses', False)) and
+                'gzip' in request.headers.get('Accept-Encoding', ''))
+
+    def _compress(self, response_msg):
+        '''Gzip the response message if the client accepts it.
+
+        @return response message - return this value from the controller
+                                   method
+        '''
+        if not self._accepts_gzip():
+            return response_msg
+        self._add_vary('Accept-Encoding')
+        if not response_msg:
+            return response_msg
+        self._set_response_header('Content-Encoding', 'gzip')
+        if isinstance(response_msg, unicode):
+            response_msg = response_msg.encode('utf-8')
+        if isinstance(response_msg, str):
+            return streaming.gzip(response_msg)
+        return streaming.GzipStream(response_msg)
+
+    def _add_vary(self, *names):
+        vary = [name.strip() for name in
+                response.headers.get('Vary', '').split(',') if name.strip()]
+        vary.extend(name for name in names if name not in vary)
+        self._set_response_header('Vary', ', '.join(vary))
+
+    def _finish_cacheable(self, response_msg):
+        '''Set the ETag and Cache-Control headers of the response to a GET
+        request for a side-effect-free action, and turn it into a 304 Not
+        Modified response if the client already has it.
+
+        The ETag is a hash of the response. There is no Last-Modified
+        header: even results with a ``metadata_modified`` date, like the
+        ones of ``package_show``, include data that changes without it, such
+        as tracking summaries or the titles of groups.
+
+        @return response message - return this value from the controller
+                                   method
+        '''
+        if isinstance(response_msg, basestring):
+            body = response_msg
+            if isinstance(body, unicode):
+                body = body.encode('utf-8')
+            etag = hashlib.md5(body).hexdigest()
+        else:
+            # Hash a streamed response by encoding it an extra time rather
+            # than holding it in memory.
+            md5 = hashlib.md5()
+            for chunk in response_msg:
+                md5.update(chunk)
+            etag = md5.hexdigest()
+        # The gzipped response is a different representation
+        if self._accepts_gzip():
+            etag += '-gzip'
+        etag = '"%s"' % etag
+        self._set_response_header('ETag', etag)
+
+        # Responses to anonymous requests can be shared by proxies, but
+        # never with requests that identify a user.
+        try:
+            max_age = int(config.get('ckan.api.cache_expires', 0))
+        except ValueError:
+            max_age = 0
+        self._set_response_header(
+            'Cache-Control', '%s, max-age=%i, must-revalidate' %
+            ('private' if c.user else 'public', max_age))
+        if 'Pragma' in response.headers:
+            del response.headers['Pragma']
+        self._add_vary('Cookie', 'Authorization',
+                       config.get(base.APIKEY_HEADER_NAME_KEY,
+                                  base.APIKEY_HEADER_NAME_DEFAULT))
+
+        if_none_match = request.headers.get('If-None-Match', '')
+        etags = [tag.strip() for tag in if_none_match.split(',')]
+        if etag in etags or '*' in etags:
+            response.status_int = 304
+            if 'Content-Type' in response.headers:
+                del response.headers['Content-Type']
+            return ''
+        return response_msg
+
+    def _call_action(self, function, context, request_data):
+        '''Call an action function and turn its result or the exception it
+        raised into the ``success``, ``result`` and ``error`` keys of an
+        Action API response.
+
+        Returns a tuple of the HTTP status code and the response dict.
+
+        '''
+        return_dict = {}
         try:
             result = function(context, request_data)
             return_dict['success'] = True
             return_dict['result'] = result
+            return 200, return_dict
         except DataError, e:
             log.error('Format incorrect: %s - %s' % (e.error, request_data))
             return_dict['error'] = {'__type': 'Integrity Error',
                                     'message': e.error,
                                     'data': request_data}
             return_dict['success'] = False
-            return self._finish(400, return_dict, content_type='json')
+            return 400, return_dict
         except NotAuthorized, e:
             return_dict['error'] = {'__type': 'Authorization Error',
                                     'message': _('Access denied')}
             return_dict['success'] = False
-            
+
             if unicode(e):
                 return_dict['error']['message'] += u': %s' % e
 
-            return self._finish(403, return_dict, content_type='json')
+            return 403, return_dict
         except NotFound, e:
             return_dict['error'] = {'__type': 'Not Found Error',
                                     'message': _('Not found')}
             if unicode(e):
                 return_dict['error']['message'] += u': %s' % e
             return_dict['success'] = False
-            return self._finish(404, return_dict, content_type='json')
+            return 404, return_dict
         except ValidationError, e:
             error_dict = e.error_dict
             error_dict['__type'] = 'Validation Error'
@@ -227,26 +351,151 @@ class ApiController(base.BaseController):
             return_dict['success'] = False
             # CS nasty_string ignore
             log.error('Validation error: %r' % str(e.error_dict))
-            return self._finish(409, return_dict, content_type='json')
+            return 409, return_dict
         except search.SearchQueryError, e:
             return_dict['error'] = {'__type': 'Search Query Error',
                                     'message': 'Search Query is invalid: %r' %
                                     e.args}
             return_dict['success'] = False
-            return self._finish(400, return_dict, content_type='json')
+            return 400, return_dict
         except search.SearchError, e:
             return_dict['error'] = {'__type': 'Search Error',
                                     'message': 'Search error: %r' % e.args}
             return_dict['success'] = False
-            return self._finish(409, return_dict, content_type='json')
+            return 409, return_dict
         except search.SearchIndexError, e:
             return_dict['error'] = {'__type': 'Search Index Error',
                     'message': 'Unable to add package to search index: %s' %
                     str(e)}
             return_dict['success'] = False
-            return self._finish(500, return_dict, content_type='json')
+            return 500, return_dict
+
+    def batch(self, ver=None):
+        '''Call several action functions in a single request.
+
+        The request body is a JSON dict with a ``calls`` list, where each
+        call is a dict with an ``action`` name and an optional ``data_dict``.
+        All the calls share one authenticated context, and identical
+        side-effect-free calls are only made once. If ``parallel`` is true
+        and every call is side-effect-free, the calls are made concurrently.
+
+        The result is a list with one ``success``/``result``/``error`` dict
+        per call, in the order of the calls.
+
+        '''
+        return_dict = {}
+        try:
+            request_data = self._get_request_data()
+        except ValueError, inst:
+            log.error('Bad request data: %s' % inst)
+            return self._finish_bad_request(
+                _('JSON Error: %s') % inst)
+
+        calls = request_data.get('calls')
+        if not isinstance(calls, list) or not all(
+                isinstance(call, dict) and
+                isinstance(call.get('action'), basestring) and
+                isinstance(call.get('data_dict', {}), dict)
+                for call in calls):
+            return self._finish_bad_request(
+                _('Bad request data: %s') %
+                '"calls" must be a list of dictionaries with an "action" '
+                'name and an optional "data_dict"')
+        max_calls = int(config.get('ckan.api.batch.max_calls', 100))
+        if len(calls) > max_calls:
+            return self._finish_bad_request(
+                _('Too many calls in batch, the maximum is %i') % max_calls)
+
+        # Resolve the user once for the whole batch, the auth checks of the
+        # individual calls all reuse it.
+        context = {'model': model, 'session': model.Session, 'user': c.user,
+                   'api_version': ver, 'auth_user_obj': c.userobj,
+                   '__auth_user_obj_checked': True}
+        model.Session()._context = context
+        user_id = c.userobj.id if c.userobj else None
+
+        functions = []
+        for call in calls:
+            try:
+                functions.append(get_action(call['action']))
+            except KeyError:
+                functions.append(None)
+
+        # Identical side-effect-free calls are only made once
+        unique_calls = OrderedDict()
+        call_keys = []
+        for index, (call, function) in enumerate(zip(calls, functions)):
+            if function and getattr(function, 'side_effect_free', False):
+                key = (call['action'],
+                       h.json.dumps(call.get('data_dict', {}),
+                                    sort_keys=True))
+            else:
+                key = index
+            call_keys.append(key)
+            unique_calls.setdefault(key, (call, function))
+
+        def make_call(call_and_function, context=context):
+            call, function = call_and_function
+            if function is None:
+                return {'success': False,
+                        'error': {'__type': 'Not Found Error',
+                                  'message': _('Action name not known: %s')
+                                  % call['action']}}
+            data_dict = dict(call.get('data_dict', {}))
+            data_dict.pop('callback', None)
+            status_int, call_dict = self._call_action(
+                function, dict(context), data_dict)
+            if status_int != 200:
+                # leave the session usable for the rest of the batch
+                model.Session.rollback()
+            return call_dict
+
+        def make_worker_call(call_and_function):
+            # c.userobj belongs to this thread's session, so each worker
+            # looks the user up again in its own session
+            worker_context = dict(context, auth_user_obj=(
+                model.User.get(user_id) if user_id else None))
+            return make_call(call_and_function, worker_context)
+
+        parallel = (asbool(request_data.get('parallel', False)) and
+                    all(getattr(function, 'side_effect_free', False)
+                        for function in functions))
+        max_workers = int(config.get('ckan.api.batch.max_workers', 4))
+        if parallel and max_workers > 1 and len(unique_calls) > 1:
+            results = self._batch_map_parallel(
+                make_worker_call, unique_calls.values(), max_workers)
+        else:
+            results = map(make_call, unique_calls.values())
+        results = dict(zip(unique_calls.keys(), results))
+
+        return_dict['success'] = True
+        return_dict['result'] = [results[key] for key in call_keys]
         return self._finish_ok(return_dict)
 
+    def _batch_map_parallel(self, function, items, max_workers):
+        '''Call ``function`` on each item using a pool of threads, each with
+        its own database session and the current request's globals.'''
+        thread_objects = [(proxy, proxy._current_obj()) for proxy in
+                          (pylons.request, pylons.tmpl_context,
+                           pylons.translator)]
+
+        def run(item):
+            for proxy, obj in thread_objects:
+                proxy._push_object(obj)
+            try:
+                return function(item)
+            finally:
+                model.Session.remove()
+                for proxy, obj in thread_objects:
+                    proxy._pop_object(obj)
+
+        pool = multiprocessing.pool.ThreadPool(
+            min(max_workers, len(items)))
+        try:
+            return pool.map(run, items)
+        finally:
+            pool.close()
+
     def _get_action_from_map(self, action_map, register, subregister):
         ''' Helper function to get the action function specified in
             the action map'''
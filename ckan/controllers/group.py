@@ -14,6 +14,7 @@ import ckan.lib.maintain as maintain
 import ckan.lib.navl.dictization_functions as dict_fns
 import ckan.logic as logic
 import ckan.lib.search as search
+import ckan.lib.page_cache as page_cache
 import ckan.model as model
 import ckan.new_authz as new_authz
 import ckan.lib.plugins
@@ -191,6 +192,8 @@ class GroupController(base.BaseController):
         except NotAuthorized:
             abort(401, _('Unauthorized to read group %s') % id)
 
+        page_cache.depends_on('group', c.group_dict['id'],
+                              c.group_dict['name'])
         self._read(id, limit)
         return render(self._read_template(c.group_dict['type']))
 
@@ -864,6 +867,8 @@ class GroupController(base.BaseController):
                    'user': c.user or c.author}
         c.group_dict = self._get_group_dict(id)
         group_type = c.group_dict['type']
+        page_cache.depends_on('group', c.group_dict['id'],
+                              c.group_dict['name'])
         self._setup_template_variables(context, {'id': id},
                                        group_type=group_type)
         return render(self._about_template(group_type))
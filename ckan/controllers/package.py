@@ -21,6 +21,7 @@ import ckan.model as model
 import ckan.lib.datapreview as datapreview
 import ckan.lib.plugins
 import ckan.lib.uploader as uploader
+import ckan.lib.page_cache as page_cache
 import ckan.plugins as p
 import ckan.lib.render
 
@@ -398,6 +399,11 @@ class PackageController(base.BaseController):
         except NotAuthorized:
             abort(401, _('Unauthorized to read package %s') % id)
 
+        page_cache.depends_on('package', c.pkg.id, c.pkg.name)
+        page_cache.depends_on('group', c.pkg.owner_org,
+                              *[group['id'] for group in
+                                c.pkg_dict.get('groups', [])])
+
         # used by disqus plugin
         c.current_package_id = c.pkg.id
         c.related_count = c.pkg.related_count
@@ -1119,6 +1125,9 @@ class PackageController(base.BaseController):
         c.pkg_dict = c.package
         dataset_type = c.pkg.type or 'dataset'
 
+        page_cache.depends_on('package', c.pkg.id, c.pkg.name)
+        page_cache.depends_on('group', c.pkg.owner_org)
+
         # get package license info
         license_id = c.package.get('license_id')
         try:
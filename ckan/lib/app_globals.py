@@ -87,13 +87,19 @@ def set_global(key, value):
     ''' helper function for getting value from database or config file '''
     model.set_system_info(key, value)
     setattr(app_globals, get_globals_key(key), value)
-    model.set_system_info('ckan.config_update', str(time.time()))
+    config_update = str(time.time())
+    model.set_system_info('ckan.config_update', config_update)
+    # this process is already up to date
+    app_globals._config_update = config_update
     # update the config
     config[key] = value
     log.info('config `%s` set to `%s`' % (key, value))
 
 def delete_global(key):
     model.delete_system_info(key)
+    config_update = str(time.time())
+    model.set_system_info('ckan.config_update', config_update)
+    app_globals._config_update = config_update
     log.info('config `%s` deleted' % (key))
 
 def get_globals_key(key):
@@ -171,11 +177,21 @@ class _Globals(object):
         '''
         self._init()
         self._config_update = None
+        self._last_uptodate_check = 0
         self._mutex = Lock()
 
     def _check_uptodate(self):
         ''' check the config is uptodate needed when several instances are
-        running '''
+        running
+
+        The database is checked at most once every
+        ckan.config_update_interval seconds, so changes made by other
+        instances are picked up within that delay. '''
+        now = time.time()
+        interval = float(config.get('ckan.config_update_interval', 5))
+        if now - self._last_uptodate_check < interval:
+            return
+        self._last_uptodate_check = now
         value = model.get_system_info('ckan.config_update')
         if self._config_update != value:
             if self._mutex.acquire(False):
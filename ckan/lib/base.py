@@ -23,6 +23,7 @@ import ckan.lib.i18n as i18n
 import ckan.lib.render as render_
 import ckan.lib.helpers as h
 import ckan.lib.app_globals as app_globals
+import ckan.lib.identity_cache as identity_cache
 import ckan.plugins as p
 import ckan.model as model
 import ckan.lib.maintain as maintain
@@ -280,7 +281,7 @@ class BaseController(WSGIController):
         # means that IAuthenticator extensions do not need to access the user
         # model directly.
         if c.user and not c.userobj:
-            c.userobj = model.User.by_name(c.user)
+            c.userobj = self._get_user_by_name(c.user)
 
         # general settings
         if c.user:
@@ -306,7 +307,7 @@ class BaseController(WSGIController):
         c.user = request.environ.get('REMOTE_USER', '')
         if c.user:
             c.user = c.user.decode('utf8')
-            c.userobj = model.User.by_name(c.user)
+            c.userobj = self._get_user_by_name(c.user)
             if c.userobj is None or not c.userobj.is_active():
                 # This occurs when a user that was still logged in is deleted,
                 # or when you are logged in, clean db
@@ -415,8 +416,18 @@ class BaseController(WSGIController):
             return None
         self.log.debug("Received API Key: %s" % apikey)
         apikey = unicode(apikey)
-        query = model.Session.query(model.User)
-        user = query.filter_by(apikey=apikey).first()
+        user = identity_cache.get_user(identity_cache.APIKEY, apikey)
+        if user is None:
+            query = model.Session.query(model.User)
+            user = query.filter_by(apikey=apikey).first()
+            identity_cache.set_user(identity_cache.APIKEY, apikey, user)
+        return user
+
+    def _get_user_by_name(self, name):
+        user = identity_cache.get_user(identity_cache.NAME, name)
+        if user is None:
+            user = model.User.by_name(name)
+            identity_cache.set_user(identity_cache.NAME, name, user)
         return user
 
     def _get_page_number(self, params, key='page', default=1):
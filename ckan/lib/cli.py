@@ -1152,14 +1152,14 @@ class Tracking(CkanCommand):
             else:
                 start_date = datetime.datetime(2011, 1, 1)
         start_date_solrsync = start_date
-        end_date = datetime.datetime.now()
+        end_date = datetime.datetime.combine(
+            datetime.date.today() + datetime.timedelta(1), datetime.time(0))
 
-        while start_date < end_date:
-            stop_date = start_date + datetime.timedelta(1)
-            self.update_tracking(engine, start_date)
-            print 'tracking updated for %s' % start_date
-            start_date = stop_date
+        if start_date < end_date:
+            self.update_tracking(engine, start_date, end_date)
+            print 'tracking updated from %s to %s' % (start_date, end_date)
 
+        self.update_tracking_latest(engine, start_date_solrsync)
         self.update_tracking_solr(engine, start_date_solrsync)
 
     def _total_views(self, engine):
@@ -1212,102 +1212,236 @@ class Tracking(CkanCommand):
                               recent_views_for_id.get(r.id, 0))
                               for r in total_views])
 
-    def update_tracking(self, engine, summary_date):
+    def update_tracking(self, engine, start_date, end_date=None):
+        '''Summarise the raw tracking data from start_date up to, but not
+        including, end_date (by default the day after start_date).
+
+        All the days in the range are summarised in one set-based pass, so
+        catching up on a long period costs about as much as a single day.
+        '''
         PACKAGE_URL = '/dataset/'
+        if end_date is None:
+            end_date = start_date + datetime.timedelta(1)
+        params = {'start_date': start_date, 'end_date': end_date,
+                  'package_url_re': '^(/\\w{2}){0,1}' + PACKAGE_URL}
+
         # clear out existing data before adding new
         sql = '''DELETE FROM tracking_summary
-                 WHERE tracking_date='%s'; ''' % summary_date
-        engine.execute(sql)
-
-        sql = '''SELECT DISTINCT url, user_key,
-                     CAST(access_timestamp AS Date) AS tracking_date,
-                     tracking_type INTO tracking_tmp
-                 FROM tracking_raw
-                 WHERE CAST(access_timestamp as Date)='%s';
+                 WHERE tracking_date >= %(start_date)s
+                 AND tracking_date < %(end_date)s;
 
                  INSERT INTO tracking_summary
                    (url, count, tracking_date, tracking_type)
-                 SELECT url, count(user_key), tracking_date, tracking_type
-                 FROM tracking_tmp
-                 GROUP BY url, tracking_date, tracking_type;
+                 SELECT url, count(DISTINCT user_key),
+                     CAST(access_timestamp AS Date), tracking_type
+                 FROM tracking_raw
+                 WHERE access_timestamp >= %(start_date)s
+                 AND access_timestamp < %(end_date)s
+                 GROUP BY url, CAST(access_timestamp AS Date), tracking_type;
 
-                 DROP TABLE tracking_tmp;
-                 COMMIT;''' % summary_date
-        engine.execute(sql)
+                 COMMIT;'''
+        engine.execute(sql, **params)
 
-        # get ids for dataset urls
+        # get ids for dataset urls, stripping the locale and /dataset/ from
+        # the url and joining on the package name
         sql = '''UPDATE tracking_summary t
-                 SET package_id = COALESCE(
-                        (SELECT id FROM package p
-                        WHERE p.name = regexp_replace(' ' || t.url, '^[ ]{1}(/\w{2}){0,1}' || %s, ''))
-                     ,'~~not~found~~')
-                 WHERE t.package_id IS NULL
-                 AND tracking_type = 'page';'''
-        engine.execute(sql, PACKAGE_URL)
-
-        # update summary totals for resources
-        sql = '''UPDATE tracking_summary t1
-                 SET running_total = (
-                    SELECT sum(count)
-                    FROM tracking_summary t2
-                    WHERE t1.url = t2.url
-                    AND t2.tracking_date <= t1.tracking_date
-                 )
-                 ,recent_views = (
-                    SELECT sum(count)
-                    FROM tracking_summary t2
-                    WHERE t1.url = t2.url
-                    AND t2.tracking_date <= t1.tracking_date AND t2.tracking_date >= t1.tracking_date - 14
-                 )
-                 WHERE t1.running_total = 0 AND tracking_type = 'resource';'''
-        engine.execute(sql)
-
-        # update summary totals for pages
-        sql = '''UPDATE tracking_summary t1
-                 SET running_total = (
-                    SELECT sum(count)
-                    FROM tracking_summary t2
-                    WHERE t1.package_id = t2.package_id
-                    AND t2.tracking_date <= t1.tracking_date
-                 )
-                 ,recent_views = (
-                    SELECT sum(count)
-                    FROM tracking_summary t2
-                    WHERE t1.package_id = t2.package_id
-                    AND t2.tracking_date <= t1.tracking_date AND t2.tracking_date >= t1.tracking_date - 14
-                 )
-                 WHERE t1.running_total = 0 AND tracking_type = 'page'
-                 AND t1.package_id IS NOT NULL
-                 AND t1.package_id != '~~not~found~~';'''
-        engine.execute(sql)
-
-    def update_tracking_solr(self, engine, start_date):
-        sql = '''SELECT package_id FROM tracking_summary
-                where package_id!='~~not~found~~'
-                and tracking_date >= %s;'''
-        results = engine.execute(sql, start_date)
+                 SET package_id = p.id
+                 FROM package p
+                 WHERE p.name = regexp_replace(t.url, %(package_url_re)s, '')
+                 AND t.url ~ %(package_url_re)s
+                 AND t.package_id IS NULL
+                 AND t.tracking_type = 'page'
+                 AND t.tracking_date >= %(start_date)s
+                 AND t.tracking_date < %(end_date)s;
+
+                 UPDATE tracking_summary
+                 SET package_id = '~~not~found~~'
+                 WHERE package_id IS NULL
+                 AND tracking_type = 'page'
+                 AND tracking_date >= %(start_date)s
+                 AND tracking_date < %(end_date)s;
+
+                 COMMIT;'''
+        engine.execute(sql, **params)
+
+        # update summary totals for resources, which are counted by url, and
+        # for pages, which are counted by dataset
+        self._update_tracking_totals(engine, 'resource', 'url', params)
+        self._update_tracking_totals(engine, 'page', 'package_id', params)
+
+    def _update_tracking_totals(self, engine, tracking_type, partition,
+                                params):
+        '''Set the running_total and recent_views of the tracking_summary
+        rows of tracking_type in the date range.
+
+        running_total is a window sum over the history of each url (or
+        dataset) and recent_views sums the last 14 days of it, so each row
+        only joins to a bounded number of others.
+        '''
+        sql = '''UPDATE tracking_summary t
+                 SET running_total = totals.running_total,
+                     recent_views = totals.recent_views
+                 FROM (
+                     SELECT w.url, w.tracking_date, w.running_total,
+                         sum(r.count) AS recent_views
+                     FROM (
+                         SELECT url, {partition}, tracking_date,
+                             sum(count) OVER (
+                                 PARTITION BY {partition}
+                                 ORDER BY tracking_date
+                             ) AS running_total
+                         FROM tracking_summary
+                         WHERE tracking_type = %(tracking_type)s
+                         AND {partition} IN (
+                             SELECT {partition} FROM tracking_summary
+                             WHERE tracking_type = %(tracking_type)s
+                             AND tracking_date >= %(start_date)s
+                             AND tracking_date < %(end_date)s
+                             AND {partition} != '~~not~found~~')
+                     ) w
+                     JOIN tracking_summary r
+                         ON r.{partition} = w.{partition}
+                         AND r.tracking_type = %(tracking_type)s
+                         AND r.tracking_date <= w.tracking_date
+                         AND r.tracking_date >= w.tracking_date - 14
+                     WHERE w.tracking_date >= %(start_date)s
+                     AND w.tracking_date < %(end_date)s
+                     GROUP BY w.url, w.tracking_date, w.running_total
+                 ) totals
+                 WHERE t.url = totals.url
+                 AND t.tracking_date = totals.tracking_date
+                 AND t.tracking_type = %(tracking_type)s;
+
+                 COMMIT;'''.format(partition=partition)
+        engine.execute(sql, tracking_type=tracking_type, **params)
+
+    def update_tracking_latest(self, engine, start_date):
+        '''Refresh the tracking_latest rows of the urls whose tracking
+        summaries were updated since start_date.'''
+        sql = '''CREATE TEMPORARY TABLE tracking_latest_urls AS
+                     SELECT url FROM tracking_summary
+                     WHERE tracking_date >= %(start_date)s
+                     UNION
+                     SELECT url FROM tracking_latest
+                     WHERE tracking_date >= %(start_date)s;
+
+                 DELETE FROM tracking_latest
+                 WHERE url IN (SELECT url FROM tracking_latest_urls);
+
+                 INSERT INTO tracking_latest
+                     (url, package_id, tracking_type, running_total,
+                      recent_views, tracking_date)
+                 SELECT DISTINCT ON (s.url)
+                     s.url, s.package_id, s.tracking_type, s.running_total,
+                     s.recent_views, s.tracking_date
+                 FROM tracking_summary s
+                 JOIN tracking_latest_urls u ON u.url = s.url
+                 ORDER BY s.url, s.tracking_date DESC;
+
+                 DROP TABLE tracking_latest_urls;
+                 COMMIT;'''
+        engine.execute(sql, start_date=start_date)
+
+    def update_tracking_solr(self, engine, start_date, batch_size=500):
+        from pylons import config
+        from paste.deploy.converters import asbool
+        import ckan.lib.search as search
 
-        package_ids = set()
-        for row in results:
-            package_ids.add(row['package_id'])
+        # only active datasets are in the search index
+        sql = '''SELECT DISTINCT s.package_id FROM tracking_summary s
+                 JOIN package p ON p.id = s.package_id
+                 WHERE p.state = 'active'
+                 AND s.tracking_date >= %s;'''
+        results = engine.execute(sql, start_date)
+        package_ids = [row['package_id'] for row in results]
 
         total = len(package_ids)
         not_found = 0
-        print '%i package index%s to be rebuilt starting from %s' % (total, '' if total < 2 else 'es', start_date)
-
-        from ckan.lib.search import rebuild
-        for package_id in package_ids:
+        print '%i package index%s to be updated starting from %s' % (total, '' if total < 2 else 'es', start_date)
+
+        package_index = search.index_for(model.Package)
+        atomic = asbool(config.get(
+            'ckan.search.tracking_atomic_updates',
+            config.get('ckan.search.atomic_updates', False)))
+        for start in range(0, total, batch_size):
+            batch = package_ids[start:start + batch_size]
             try:
-                rebuild(package_id)
-            except logic.NotFound:
-                print "Error: package %s not found." % (package_id)
-                not_found += 1
+                if atomic:
+                    package_index.update_tracking(
+                        model.TrackingSummary.get_for_packages(batch),
+                        defer_commit=True)
+                    continue
+                for package_id in batch:
+                    try:
+                        search.rebuild(package_ids=[package_id],
+                                       defer_commit=True)
+                    except logic.NotFound:
+                        print "Error: package %s not found." % (package_id)
+                        not_found += 1
             except KeyboardInterrupt:
                 print "Stopped."
-                return
-            except:
-                raise
-        print 'search index rebuilding done.' + (' %i not found.' % (not_found) if not_found else "")
+                break
+        package_index.commit()
+        print 'search index updating done.' + (' %i not found.' % (not_found) if not_found else "")
+
+class ActivityCmd(CkanCommand):
+    '''Manage activity streams
+
+    Usage:
+      activity backfill-dashboards [LIMIT]
+            - copy each user's latest LIMIT (default 1000) dashboard
+              activities to the dashboard_activity table, for
+              ckan.activity_streams_dashboard_feed
+      activity compact-data [BATCH_SIZE]
+            - cut down the datasets and resources stored in the existing
+              package activities, for ckan.activity_streams_compact_data,
+              committing every BATCH_SIZE (default 1000) rows
+    '''
+
+    summary = __doc__.split('\n')[0]
+    usage = __doc__
+    max_args = 2
+    min_args = 1
+
+    def command(self):
+        self._load_config()
+
+        cmd = self.args[0]
+        if cmd == 'backfill-dashboards':
+            limit = int(self.args[1]) if len(self.args) > 1 else 1000
+            self.backfill_dashboards(limit)
+        elif cmd == 'compact-data':
+            batch_size = int(self.args[1]) if len(self.args) > 1 else 1000
+            self.compact_data(batch_size)
+        else:
+            print self.__class__.__doc__
+            sys.exit(1)
+
+    def backfill_dashboards(self, limit):
+        import ckan.model as model
+        user_ids = [row[0] for row in
+                    model.Session.query(model.User.id).filter(
+                        model.User.state != model.State.DELETED)]
+        total = 0
+        for i, user_id in enumerate(user_ids):
+            total += model.activity.backfill_dashboard_activity(user_id,
+                                                               limit)
+            # Commit as we go so that a long backfill doesn't hold one huge
+            # transaction
+            model.Session.commit()
+            if self.verbose and (i + 1) % 100 == 0:
+                print '%i/%i users' % (i + 1, len(user_ids))
+        model.Session.remove()
+        print 'Added %i activities to the dashboards of %i users' % (
+            total, len(user_ids))
+
+    def compact_data(self, batch_size):
+        import ckan.model as model
+        changed = model.activity.compact_activity_data(batch_size)
+        model.Session.remove()
+        print 'Compacted the data of %i activities and activity details' % (
+            changed)
+
 
 class PluginInfo(CkanCommand):
     '''Provide info on installed plugins.
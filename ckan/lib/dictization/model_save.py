@@ -27,6 +27,12 @@ def resource_dict_save(res_dict, context):
     table = class_mapper(model.Resource).mapped_table
     fields = [field.name for field in table.c]
 
+    # Resource extras not submitted are removed from the extras dict. The
+    # dict is replaced rather than changed in place, so that it is only
+    # written when it really changes.
+    extras = dict((key, value) for key, value in (obj.extras or {}).items()
+                  if key in res_dict)
+
     for key, value in res_dict.iteritems():
         if isinstance(value, list):
             continue
@@ -36,24 +42,26 @@ def resource_dict_save(res_dict, context):
             if isinstance(getattr(obj, key), datetime.datetime):
                 if getattr(obj, key).isoformat() == value:
                     continue
+            if getattr(obj, key) == value:
+                continue
             if key == 'url' and not new and obj.url <> value:
                 obj.url_changed = True
             setattr(obj, key, value)
         else:
             # resources save extras directly onto the object, instead
             # of in a separate extras field like packages and groups
-            obj.extras[key] = value
+            extras[key] = value
 
-    # Resource extras not submitted should be removed from the extras dict
-    extras_to_delete = set(obj.extras.keys()) - set(res_dict.keys())
-    for delete_me in extras_to_delete:
-        del obj.extras[delete_me]
+    if extras != (obj.extras or {}):
+        obj.extras = extras
 
-    obj.state = u'active'
+    if obj.state != u'active':
+        obj.state = u'active'
 
     session.add(obj)
     return obj
 
+
 def package_resource_list_save(res_dicts, package, context):
     allow_partial_update = context.get("allow_partial_update", False)
     if res_dicts is None and allow_partial_update:
@@ -69,21 +77,29 @@ def package_resource_list_save(res_dicts, package, context):
         obj = resource_dict_save(res_dict, context)
         obj_list.append(obj)
 
-    # Set the package's resources. resource_list is an ORM relation - the
-    # package's resources. If we didn't have the slice operator "[:]" then it
-    # would reassign the variable "resource_list" to be the obj_list. But with
-    # the slice operator it changes the contents of the relation, setting the
+    # Mark any left-over resources as deleted. They are kept after the
+    # submitted ones, in their old order.
+    obj_set = set(obj_list)
+    left_over = [resource for resource in old_list
+                 if resource not in obj_set]
+    for resource in left_over:
+        if resource.state != 'deleted':
+            resource.state = 'deleted'
+
+    # Set the package's resources, only if they or their order changed.
+    # resource_list is an ORM relation - the package's resources. If we
+    # didn't have the slice operator "[:]" then it would reassign the
+    # variable "resource_list" to be the new list. But with the slice
+    # operator it changes the contents of the relation, setting the
     # package's resources.
-    # At the table level, for each resource in the obj_list, its
+    # At the table level, for each resource in the new list, its
     # resource.package_id is changed to this package (which is needed for new
     # resources), and every resource.position is set to ascending integers,
-    # according to their ordering in the obj_list.
-    resource_list[:] = obj_list
-
-    # Mark any left-over resources as deleted
-    for resource in set(old_list) - set(obj_list):
-        resource.state = 'deleted'
-        resource_list.append(resource)
+    # according to their ordering in the list. Resources that keep their
+    # position aren't changed.
+    new_list = obj_list + left_over
+    if new_list != old_list:
+        resource_list[:] = new_list
 
 
 def package_extras_save(extra_dicts, obj, context):
@@ -154,16 +170,18 @@ def package_tag_list_save(tag_dicts, package, context):
                             for package_tag in
                             package.package_tag_all)
 
-    tag_package_tag_inactive = dict(
-        [ (tag,pt) for tag,pt in tag_package_tag.items() if
-            pt.state in ['deleted'] ]
-        )
+    # The tags the package already has don't need to be looked up again
+    current_tags = dict(((tag.name, tag.vocabulary_id), tag)
+                        for tag in tag_package_tag)
 
     tag_name_vocab = set()
     tags = set()
     for tag_dict in tag_dicts or []:
-        if (tag_dict.get('name'), tag_dict.get('vocabulary_id')) not in tag_name_vocab:
-            tag_obj = d.table_dict_save(tag_dict, model.Tag, context)
+        name_vocab = (tag_dict.get('name'), tag_dict.get('vocabulary_id'))
+        if name_vocab not in tag_name_vocab:
+            tag_obj = current_tags.get(name_vocab)
+            if not tag_obj or tag_dict.get('id', tag_obj.id) != tag_obj.id:
+                tag_obj = d.table_dict_save(tag_dict, model.Tag, context)
             tags.add(tag_obj)
             tag_name_vocab.add((tag_obj.name, tag_obj.vocabulary_id))
 
@@ -171,22 +189,22 @@ def package_tag_list_save(tag_dicts, package, context):
     # case 1: currently active but not in new list
     for tag in set(tag_package_tag.keys()) - tags:
         package_tag = tag_package_tag[tag]
-        package_tag.state = 'deleted'
+        if package_tag.state != 'deleted':
+            package_tag.state = 'deleted'
 
     # case 2: in new list but never used before
     for tag in tags - set(tag_package_tag.keys()):
         state = 'active'
         package_tag_obj = model.PackageTag(package, tag, state)
         session.add(package_tag_obj)
-        tag_package_tag[tag] = package_tag_obj
+        if package_tag_obj not in package.package_tag_all:
+            package.package_tag_all.append(package_tag_obj)
 
     # case 3: in new list and already used but in deleted state
-    for tag in tags.intersection(set(tag_package_tag_inactive.keys())):
-        state = 'active'
+    for tag in tags.intersection(set(tag_package_tag.keys())):
         package_tag = tag_package_tag[tag]
-        package_tag.state = state
-
-    package.package_tag_all[:] = tag_package_tag.values()
+        if package_tag.state != 'active':
+            package_tag.state = 'active'
 
 def package_membership_list_save(group_dicts, package, context):
 
@@ -206,6 +224,9 @@ def package_membership_list_save(group_dicts, package, context):
     group_member = dict((member.group, member)
                          for member in
                          members)
+    # The groups the package is already in don't need to be looked up again
+    group_names = dict((group.name, group) for group in group_member
+                       if group)
     groups = set()
     for group_dict in group_dicts or []:
         id = group_dict.get("id")
@@ -216,7 +237,8 @@ def package_membership_list_save(group_dicts, package, context):
         if id:
             group = session.query(model.Group).get(id)
         else:
-            group = session.query(model.Group).filter_by(name=name).first()
+            group = group_names.get(name) or session.query(model.Group) \
+                .filter_by(name=name).first()
         if group:
             groups.add(group)
 
@@ -5,7 +5,11 @@ users.
 
 '''
 import datetime
+import logging
+import multiprocessing.pool
 import re
+import smtplib
+import socket
 
 import pylons
 
@@ -15,6 +19,13 @@ import ckan.lib.base as base
 
 from ckan.common import ungettext
 
+log = logging.getLogger(__name__)
+
+# The per-request pylons objects that rendering the notifications uses, which
+# are made available to the threads that render them.
+_PYLONS_OBJECTS = ('request', 'response', 'session', 'tmpl_context',
+                   'app_globals', 'translator', 'url')
+
 
 def string_to_timedelta(s):
     '''Parse a string s and return a standard datetime.timedelta object.
@@ -169,8 +180,8 @@ def get_notifications(user_dict, since):
     return notifications
 
 
-def send_notification(user, email_dict):
-    '''Email `email_dict` to `user`.'''
+def send_notification(user, email_dict, smtp_connection=None):
+    '''Email `email_dict` to `user`, over `smtp_connection` if given.'''
     import ckan.lib.mailer
 
     if not user.get('email'):
@@ -179,21 +190,26 @@ def send_notification(user, email_dict):
 
     try:
         ckan.lib.mailer.mail_recipient(user['display_name'], user['email'],
-                email_dict['subject'], email_dict['body'])
+                email_dict['subject'], email_dict['body'],
+                smtp_connection=smtp_connection)
     except ckan.lib.mailer.MailerException:
         raise
 
 
-def get_and_send_notifications_for_user(user):
-
-    # Parse the email_notifications_since config setting, email notifications
-    # from longer ago than this time will not be sent.
+def _email_notifications_since():
+    '''Return the time before which email notifications will not be sent,
+    from the ckan.email_notifications_since config setting.'''
     email_notifications_since = pylons.config.get(
             'ckan.email_notifications_since', '2 days')
     email_notifications_since = string_to_timedelta(
             email_notifications_since)
-    email_notifications_since = (datetime.datetime.now()
-            - email_notifications_since)
+    return datetime.datetime.now() - email_notifications_since
+
+
+def get_and_send_notifications_for_user(user):
+
+    # Email notifications from longer ago than this time will not be sent.
+    email_notifications_since = _email_notifications_since()
 
     # FIXME: We are accessing model from lib here but I'm not sure what
     # else to do unless we add a get_email_last_sent() logic function which
@@ -219,9 +235,165 @@ def get_and_send_notifications_for_user(user):
     model.repo.commit()
 
 
+def _user_dict(user):
+    return {'id': user.id, 'name': user.name, 'email': user.email,
+            'display_name': user.display_name,
+            'activity_streams_email_notifications':
+                user.activity_streams_email_notifications}
+
+
+def _get_notifications_for_job(job):
+    user_dict, since = job
+    # The time is taken before the activities are read, so that activities
+    # created meanwhile are notified the next time rather than never.
+    high_water_mark = datetime.datetime.now()
+    return user_dict, get_notifications(user_dict, since), high_water_mark
+
+
+def _get_notifications_in_worker(job):
+    try:
+        return _get_notifications_for_job(job)
+    finally:
+        # Each worker thread has its own database session
+        model.Session.remove()
+
+
+def _current_pylons_objects():
+    objects = {}
+    for name in _PYLONS_OBJECTS:
+        try:
+            objects[name] = getattr(pylons, name)._current_obj()
+        except TypeError:
+            # Not registered for this thread, e.g. outside a request
+            pass
+    return objects
+
+
+def _push_pylons_objects(objects):
+    for name, obj in objects.items():
+        getattr(pylons, name)._push_object(obj)
+
+
+def _connection_lost(smtp_connection):
+    try:
+        smtp_connection.noop()
+    except (smtplib.SMTPException, socket.error):
+        return True
+    return False
+
+
+def _quit(smtp_connection):
+    try:
+        smtp_connection.quit()
+    except (smtplib.SMTPException, socket.error), e:
+        log.warning('Could not close the SMTP connection: %s', e)
+
+
+def _send_notifications_batch(results):
+    '''Send the notifications in `results` over one SMTP connection, then
+    record how far each user's notifications went.
+
+    If the SMTP server drops the connection it is reopened once; if that
+    one is dropped too the rest of the batch is left for the next run.
+
+    '''
+    import ckan.lib.mailer
+
+    high_water_marks = {}
+    smtp_connection = None
+    reconnected = False
+    try:
+        for user_dict, notifications, high_water_mark in results:
+            try:
+                for notification in notifications:
+                    if smtp_connection is None:
+                        smtp_connection = (
+                            ckan.lib.mailer.open_smtp_connection())
+                    try:
+                        send_notification(user_dict, notification,
+                                          smtp_connection)
+                    except ckan.lib.mailer.MailerException:
+                        if not _connection_lost(smtp_connection):
+                            raise
+                        _quit(smtp_connection)
+                        smtp_connection = None
+                        if reconnected:
+                            raise
+                        log.warning('The SMTP server closed the connection, '
+                                    'reconnecting')
+                        reconnected = True
+                        smtp_connection = (
+                            ckan.lib.mailer.open_smtp_connection())
+                        send_notification(user_dict, notification,
+                                          smtp_connection)
+            except ckan.lib.mailer.MailerException:
+                # The user's notifications will be sent again next time
+                log.exception('Sending email notifications to %s failed',
+                              user_dict['name'])
+                if smtp_connection is None and reconnected:
+                    break
+                continue
+            high_water_marks[user_dict['id']] = high_water_mark
+    finally:
+        # Record who was emailed before anything else can go wrong
+        if high_water_marks:
+            dashboards = model.Session.query(model.Dashboard).filter(
+                model.Dashboard.user_id.in_(high_water_marks.keys()))
+            for dashboard in dashboards:
+                dashboard.email_last_sent = (
+                    high_water_marks[dashboard.user_id])
+            model.repo.commit()
+        if smtp_connection is not None:
+            _quit(smtp_connection)
+
+
 def get_and_send_notifications_for_all_users():
-    context = {'model': model, 'session': model.Session, 'ignore_auth': True,
-            'keep_email': True}
-    users = logic.get_action('user_list')(context, {})
-    for user in users:
-        get_and_send_notifications_for_user(user)
+    '''Send any pending email notifications to all users.
+
+    The users are worked through in batches of
+    ``ckan.email_notifications_batch_size``. For each batch one query picks
+    out the users who have new activities on their dashboards, skipping
+    everyone else. Their notifications are rendered by a pool of
+    ``ckan.email_notifications_workers`` threads and sent over a single SMTP
+    connection. Then each user's ``email_last_sent`` high-water mark is
+    committed, so a run that is interrupted can be run again without
+    starting over.
+
+    '''
+    from ckan.logic.action.get import _activity_stream_get_filtered_users
+
+    batch_size = int(pylons.config.get(
+        'ckan.email_notifications_batch_size', 100))
+    workers = int(pylons.config.get('ckan.email_notifications_workers', 1))
+    cutoff = _email_notifications_since()
+    hidden_user_ids = _activity_stream_get_filtered_users()
+
+    # Users are only notified of activities newer than their dashboards
+    model.Dashboard.create_missing()
+
+    pool = None
+    if workers > 1:
+        pool = multiprocessing.pool.ThreadPool(
+            workers, _push_pylons_objects, (_current_pylons_objects(),))
+    try:
+        after = u''
+        while True:
+            rows = model.activity.users_with_new_dashboard_activities(
+                after, batch_size, cutoff, hidden_user_ids)
+            if not rows:
+                break
+            after = rows[-1][0]
+            users = dict((user.id, user) for user in
+                         model.Session.query(model.User).filter(
+                             model.User.id.in_([row[0] for row in rows])))
+            jobs = [(_user_dict(users[user_id]), since)
+                    for user_id, since in rows]
+            if pool is not None:
+                results = pool.map(_get_notifications_in_worker, jobs)
+            else:
+                results = [_get_notifications_for_job(job) for job in jobs]
+            _send_notifications_batch(results)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
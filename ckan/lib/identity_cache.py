@@ -0,0 +1,118 @@
+'''A short-lived, in-process cache of identified users.
+
+:py:meth:`~ckan.lib.base.BaseController._identify_user` looks up the logged
+in user by name, or the API user by API key, on every request. When
+:ref:`ckan.identity_cache.expires` is set the user's column values are kept
+here for that many seconds, keyed by the name or API key they were found by,
+and later requests rebuild the user object from them without querying the
+``user`` table.
+
+Entries are dropped by :py:func:`invalidate_user` when a user is updated or
+deleted or their API key is regenerated. Other worker processes only see
+those changes once their own entries expire, which is why the cache is off
+by default and the expiry time should be kept short.
+
+'''
+import collections
+import logging
+import threading
+import time
+
+import sqlalchemy.exc
+import sqlalchemy.orm
+import sqlalchemy.orm.attributes
+
+import ckan.model as model
+
+log = logging.getLogger(__name__)
+
+NAME = 'name'
+APIKEY = 'apikey'
+
+_expires = 0
+_max_size = 1000
+
+_lock = threading.Lock()
+_entries = collections.OrderedDict()
+
+
+def configure(config):
+    '''Read the identity cache settings from the config and empty the
+    cache.'''
+    global _expires, _max_size
+    _expires = int(config.get('ckan.identity_cache.expires', 0))
+    _max_size = int(config.get('ckan.identity_cache.max_size', 1000))
+    clear()
+
+
+def is_enabled():
+    return _expires > 0 and _max_size > 0
+
+
+def get_user(kind, value):
+    '''Return the cached user found by ``kind`` (``NAME`` or ``APIKEY``)
+    ``value``, attached to the current session, or None if there isn't a
+    fresh entry for it.
+
+    '''
+    if not is_enabled():
+        return None
+    key = (kind, value)
+    with _lock:
+        entry = _entries.get(key)
+        if entry is None:
+            return None
+        values, expires = entry
+        if expires < time.time():
+            del _entries[key]
+            return None
+        # Mark it as the most recently used
+        del _entries[key]
+        _entries[key] = entry
+    return _attach(values)
+
+
+def set_user(kind, value, user):
+    '''Cache the values of ``user``, found by ``kind`` ``value``.'''
+    if not is_enabled() or user is None:
+        return
+    state = sqlalchemy.orm.attributes.instance_state(user)
+    if state.key is None or state.modified:
+        # Only cache what is in the database
+        return
+    values = dict((column.key, getattr(user, column.key))
+                  for column in model.user_table.columns)
+    with _lock:
+        _entries.pop((kind, value), None)
+        _entries[(kind, value)] = (values, time.time() + _expires)
+        while len(_entries) > _max_size:
+            _entries.popitem(last=False)
+
+
+def invalidate_user(user_id):
+    '''Drop all the cached entries for the user with id ``user_id``.'''
+    with _lock:
+        for key, (values, expires) in _entries.items():
+            if values['id'] == user_id:
+                del _entries[key]
+
+
+def clear():
+    with _lock:
+        _entries.clear()
+
+
+def _attach(values):
+    # Build a detached User with the cached values and merge it into the
+    # session without loading it, so that no query is issued.
+    mapper = sqlalchemy.orm.class_mapper(model.User)
+    user = mapper.class_manager.new_instance()
+    for name, value in values.items():
+        sqlalchemy.orm.attributes.set_committed_value(user, name, value)
+    state = sqlalchemy.orm.attributes.instance_state(user)
+    state.key = mapper.identity_key_from_instance(user)
+    try:
+        return model.Session.merge(user, load=False)
+    except sqlalchemy.exc.InvalidRequestError, e:
+        log.debug('Could not use the cached user %s: %s', values['id'], e)
+        return None
@@ -0,0 +1,286 @@
+'''Optional profiling of action functions.
+
+When :ref:`ckan.instrumentation.enabled` is set, every action function called
+through :py:func:`ckan.logic.get_action` is timed and the number of SQL
+statements and Solr requests it issues is counted. Actions called from inside
+other actions are recorded as children of their caller, so both the
+per-action totals and the shape of slow call trees are available.
+
+The collected numbers can be read with the
+:py:func:`~ckan.logic.action.get.action_instrumentation_show` action and are
+periodically written to the log.
+
+'''
+import collections
+import logging
+import threading
+import time
+
+import sqlalchemy
+from paste.deploy.converters import asbool
+
+log = logging.getLogger(__name__)
+
+# Upper bounds, in milliseconds, of the latency histogram buckets. Calls
+# slower than the last bound are counted in an extra overflow bucket.
+LATENCY_BUCKETS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+# How many slow call trees are kept for inspection.
+SLOW_CALLS_KEPT = 20
+
+_enabled = False
+_log_interval = 300
+_slow_threshold = 1000
+
+_lock = threading.Lock()
+_local = threading.local()
+_stats = {}
+_slow_calls = collections.deque(maxlen=SLOW_CALLS_KEPT)
+_started = time.time()
+_last_dump = time.time()
+_instrumented_engines = set()
+
+
+def configure(config, engine=None):
+    '''Read the instrumentation settings from the config and, if enabled,
+    start counting the SQL statements sent through ``engine``.
+
+    '''
+    global _enabled, _log_interval, _slow_threshold
+    _enabled = asbool(config.get('ckan.instrumentation.enabled', False))
+    _log_interval = int(config.get('ckan.instrumentation.log_interval', 300))
+    _slow_threshold = int(
+        config.get('ckan.instrumentation.slow_threshold', 1000))
+    if _enabled and engine is not None:
+        instrument_engine(engine)
+
+
+def is_enabled():
+    return _enabled
+
+
+def instrument_engine(engine):
+    '''Count the statements executed by ``engine`` against the action that
+    is currently running.'''
+    if id(engine) in _instrumented_engines:
+        return
+    sqlalchemy.event.listen(engine, 'before_cursor_execute', _count_sql)
+    _instrumented_engines.add(id(engine))
+
+
+def _count_sql(conn, cursor, statement, parameters, context, executemany):
+    frame = _current_frame()
+    if frame is not None:
+        frame.sql_queries += 1
+
+
+def record_solr_call():
+    '''Count a request to Solr against the action that is currently
+    running.'''
+    if not _enabled:
+        return
+    frame = _current_frame()
+    if frame is not None:
+        frame.solr_calls += 1
+
+
+def _current_frame():
+    stack = getattr(_local, 'stack', None)
+    if stack:
+        return stack[-1]
+    return None
+
+
+class _Frame(object):
+    '''A single call of an action function.'''
+
+    __slots__ = ['name', 'start', 'duration', 'sql_queries', 'solr_calls',
+                 'children']
+
+    def __init__(self, name):
+        self.name = name
+        self.start = time.time()
+        self.duration = None
+        self.sql_queries = 0
+        self.solr_calls = 0
+        self.children = []
+
+    def as_dict(self):
+        return {
+            'action': self.name,
+            'duration': round(self.duration * 1000, 3),
+            'sql_queries': self.sql_queries,
+            'solr_calls': self.solr_calls,
+            'children': [child.as_dict() for child in self.children],
+        }
+
+
+class _ActionTimer(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.frame = None
+
+    def __enter__(self):
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        self.frame = _Frame(self.name)
+        stack.append(self.frame)
+        return self.frame
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        frame = self.frame
+        frame.duration = time.time() - frame.start
+        stack = _local.stack
+        stack.pop()
+        if stack:
+            # Counts are inclusive, so the parent also gets the queries and
+            # Solr calls made by the actions it called.
+            parent = stack[-1]
+            parent.children.append(frame)
+            parent.sql_queries += frame.sql_queries
+            parent.solr_calls += frame.solr_calls
+            _record(frame, parent.name)
+        else:
+            _record(frame, None)
+            if frame.duration * 1000 >= _slow_threshold:
+                _slow_calls.append(frame.as_dict())
+            _maybe_dump()
+        return False
+
+
+class _NoopTimer(object):
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+_noop_timer = _NoopTimer()
+
+
+def record_action(name):
+    '''Return a context manager that records a call of the action ``name``.
+
+    If instrumentation is disabled the returned context manager does
+    nothing.
+
+    '''
+    if not _enabled:
+        return _noop_timer
+    return _ActionTimer(name)
+
+
+def _empty_stats():
+    return {
+        'count': 0,
+        'nested_count': 0,
+        'total_time': 0.0,
+        'max_time': 0.0,
+        'sql_queries': 0,
+        'solr_calls': 0,
+        'histogram': [0] * (len(LATENCY_BUCKETS) + 1),
+        'callers': collections.defaultdict(int),
+        'children': collections.defaultdict(int),
+    }
+
+
+def _bucket_index(duration_ms):
+    for index, bound in enumerate(LATENCY_BUCKETS):
+        if duration_ms <= bound:
+            return index
+    return len(LATENCY_BUCKETS)
+
+
+def _record(frame, caller):
+    duration_ms = frame.duration * 1000
+    with _lock:
+        stats = _stats.get(frame.name)
+        if stats is None:
+            stats = _stats[frame.name] = _empty_stats()
+        stats['count'] += 1
+        if caller:
+            stats['nested_count'] += 1
+            stats['callers'][caller] += 1
+        stats['total_time'] += duration_ms
+        stats['max_time'] = max(stats['max_time'], duration_ms)
+        stats['sql_queries'] += frame.sql_queries
+        stats['solr_calls'] += frame.solr_calls
+        stats['histogram'][_bucket_index(duration_ms)] += 1
+        for child in frame.children:
+            stats['children'][child.name] += 1
+
+
+def get_stats():
+    '''Return a snapshot of the collected statistics as a JSON serializable
+    dictionary.'''
+    labels = ['<=%i' % bound for bound in LATENCY_BUCKETS]
+    labels.append('>%i' % LATENCY_BUCKETS[-1])
+    actions = {}
+    with _lock:
+        for name, stats in _stats.iteritems():
+            count = stats['count']
+            actions[name] = {
+                'count': count,
+                'nested_count': stats['nested_count'],
+                'total_time': round(stats['total_time'], 3),
+                'mean_time': round(stats['total_time'] / count, 3),
+                'max_time': round(stats['max_time'], 3),
+                'sql_queries': stats['sql_queries'],
+                'mean_sql_queries': round(
+                    float(stats['sql_queries']) / count, 2),
+                'solr_calls': stats['solr_calls'],
+                'histogram': dict(zip(labels, stats['histogram'])),
+                'callers': dict(stats['callers']),
+                'children': dict(stats['children']),
+            }
+        slow_calls = list(_slow_calls)
+    return {
+        'enabled': _enabled,
+        'since': _started,
+        'actions': actions,
+        'slow_calls': slow_calls,
+    }
+
+
+def reset():
+    '''Throw away all the collected statistics.'''
+    global _started
+    with _lock:
+        _stats.clear()
+        _slow_calls.clear()
+        _started = time.time()
+
+
+def _maybe_dump():
+    global _last_dump
+    now = time.time()
+    if not _log_interval or now - _last_dump < _log_interval:
+        return
+    if not _lock.acquire(False):
+        # another thread is already dumping
+        return
+    try:
+        _last_dump = now
+    finally:
+        _lock.release()
+    dump_to_log()
+
+
+def dump_to_log(limit=20):
+    '''Write the actions that took the most time in total to the log.'''
+    actions = get_stats()['actions']
+    hottest = sorted(actions.items(), key=lambda item: item[1]['total_time'],
+                     reverse=True)[:limit]
+    if not hottest:
+        return
+    lines = ['Action instrumentation (top %i by total time):' % len(hottest)]
+    for name, stats in hottest:
+        lines.append(
+            '  %s: calls=%i total=%.1fms mean=%.1fms max=%.1fms '
+            'sql=%i solr=%i' % (name, stats['count'], stats['total_time'],
+                                stats['mean_time'], stats['max_time'],
+                                stats['sql_queries'], stats['solr_calls']))
+    log.info('\n'.join(lines))
@@ -0,0 +1,36 @@
+'''JSON encoding and decoding for the heavy JSON users.
+
+The action API responses, the ``data_dict`` and ``validated_data_dict``
+fields sent to Solr, the Solr responses and the JSON columns like the
+activity data are encoded and decoded with :py:func:`dumps` and
+:py:func:`loads`, so that they share one implementation.
+
+They use ``simplejson``. ``ujson`` 1.x was tried, but it rounds floats to 15
+significant digits and encodes values that JSON can't represent, like dates,
+instead of rejecting them. With the checks needed to keep the data the same
+it was no faster than ``simplejson``'s C extension.
+
+'''
+import simplejson
+
+
+def dumps(obj, ensure_ascii=True, cls=None):
+    '''Return the JSON encoding of ``obj``.
+
+    :param ensure_ascii: escape non-ASCII characters; if False a unicode
+        string may be returned
+    :param cls: a ``JSONEncoder`` subclass to encode objects JSON doesn't know
+        about, e.g.
+        :py:class:`~ckan.lib.navl.dictization_functions.MissingNullEncoder`
+
+    '''
+    if cls is not None:
+        # cls may be a subclass of the standard library's JSONEncoder,
+        # which doesn't take all of simplejson's arguments
+        return cls(ensure_ascii=ensure_ascii).encode(obj)
+    return simplejson.dumps(obj, ensure_ascii=ensure_ascii)
+
+
+def loads(s):
+    '''Return the object decoded from the JSON string ``s``.'''
+    return simplejson.loads(s)
@@ -26,22 +26,14 @@ def add_msg_niceties(recipient_name, body, sender_name, sender_url):
            + u"\r\n\r\n%s\r\n\r\n" % body \
            + u"--\r\n%s (%s)" % (sender_name, sender_url)
 
-def _mail_recipient(recipient_name, recipient_email,
-        sender_name, sender_url, subject,
-        body, headers={}):
-    mail_from = config.get('smtp.mail_from')
-    body = add_msg_niceties(recipient_name, body, sender_name, sender_url)
-    msg = MIMEText(body.encode('utf-8'), 'plain', 'utf-8')
-    for k, v in headers.items(): msg[k] = v
-    subject = Header(subject.encode('utf-8'), 'utf-8')
-    msg['Subject'] = subject
-    msg['From'] = _("%s <%s>") % (sender_name, mail_from)
-    recipient = u"%s <%s>" % (recipient_name, recipient_email)
-    msg['To'] = Header(recipient, 'utf-8')
-    msg['Date'] = Utils.formatdate(time())
-    msg['X-Mailer'] = "CKAN %s" % ckan.__version__
 
-    # Send the email using Python's smtplib.
+def open_smtp_connection():
+    '''Return a connection to the configured SMTP server, to send several
+    emails over with :py:func:`mail_recipient`.
+
+    Close it with its ``quit()`` method when done.
+
+    '''
     smtp_connection = smtplib.SMTP()
     if 'smtp.test_server' in config:
         # If 'smtp.test_server' is configured we assume we're running tests,
@@ -79,6 +71,39 @@ def _mail_recipient(recipient_name, recipient_email,
                     "smtp.password must be configured as well.")
             smtp_connection.login(smtp_user, smtp_password)
 
+    except smtplib.SMTPException, e:
+        smtp_connection.quit()
+        msg = '%r' % e
+        log.exception(msg)
+        raise MailerException(msg)
+    except:
+        smtp_connection.quit()
+        raise
+    return smtp_connection
+
+
+def _mail_recipient(recipient_name, recipient_email,
+                    sender_name, sender_url, subject,
+                    body, headers={}, smtp_connection=None):
+    mail_from = config.get('smtp.mail_from')
+    body = add_msg_niceties(recipient_name, body, sender_name, sender_url)
+    msg = MIMEText(body.encode('utf-8'), 'plain', 'utf-8')
+    for k, v in headers.items():
+        msg[k] = v
+    subject = Header(subject.encode('utf-8'), 'utf-8')
+    msg['Subject'] = subject
+    msg['From'] = _("%s <%s>") % (sender_name, mail_from)
+    recipient = u"%s <%s>" % (recipient_name, recipient_email)
+    msg['To'] = Header(recipient, 'utf-8')
+    msg['Date'] = Utils.formatdate(time())
+    msg['X-Mailer'] = "CKAN %s" % ckan.__version__
+
+    # Send the email using Python's smtplib, over a connection of its own
+    # unless we've been given one.
+    own_connection = smtp_connection is None
+    if own_connection:
+        smtp_connection = open_smtp_connection()
+    try:
         smtp_connection.sendmail(mail_from, [recipient_email], msg.as_string())
         log.info("Sent email to {0}".format(recipient_email))
 
@@ -87,12 +112,15 @@ def _mail_recipient(recipient_name, recipient_email,
         log.exception(msg)
         raise MailerException(msg)
     finally:
-        smtp_connection.quit()
+        if own_connection:
+            smtp_connection.quit()
+
 
 def mail_recipient(recipient_name, recipient_email, subject,
-        body, headers={}):
+                   body, headers={}, smtp_connection=None):
     return _mail_recipient(recipient_name, recipient_email,
-            g.site_title, g.site_url, subject, body, headers=headers)
+                           g.site_title, g.site_url, subject, body,
+                           headers=headers, smtp_connection=smtp_connection)
 
 def mail_user(recipient, subject, body, headers={}):
     if (recipient.email is None) or not len(recipient.email):
@@ -0,0 +1,596 @@
+'''Storage backends for the pages cached by
+:py:class:`~ckan.config.middleware.PageCacheMiddleware`.
+
+Pages are stored gzip-compressed, together with their status, headers and an
+ETag, so that a cache hit can be served as is to clients that accept gzip.
+The backend is chosen with :ref:`ckan.page_cache.backend`:
+
+``memory``
+    An LRU cache in the memory of each CKAN process, holding at most
+    :ref:`ckan.page_cache.max_size` bytes of compressed pages.
+
+``file``
+    One file per page in :ref:`ckan.page_cache.directory`, shared by all the
+    CKAN processes on the server. Pointing it to a memory backed file system
+    such as ``/dev/shm`` gives a shared memory cache.
+
+``redis``
+    A Redis server, given by :ref:`ckan.page_cache.redis_url`. The default.
+
+Pages expire after :ref:`ckan.page_cache.expires` seconds. They are also
+purged when the datasets or groups they show change: controllers call
+:py:func:`depends_on` while rendering a page to record what it shows, and
+pages that record nothing are purged whenever anything changes.
+
+'''
+import collections
+import errno
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import zlib
+
+import ckan.model as model
+import ckan.plugins as p
+from ckan.common import OrderedDict, request
+
+log = logging.getLogger(__name__)
+
+# Headers that are set when a cached page is served, rather than stored.
+_UNSTORED_HEADERS = ('content-length', 'content-encoding', 'etag')
+
+# zlib window size that makes it read and write gzip streams.
+_GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+# The dependency of pages that didn't record any, which is purged on every
+# change.
+ANY_CHANGE = '*'
+
+
+class CachedPage(collections.namedtuple(
+        'CachedPage', ['status', 'headers', 'body', 'etag', 'created'])):
+    '''A cached page. ``body`` is gzip-compressed.'''
+
+    __slots__ = ()
+
+    def uncompressed_body(self):
+        return zlib.decompress(self.body, _GZIP_WBITS)
+
+    def dumps(self):
+        '''Return the page as a string, which :py:meth:`loads` reads back.
+
+        The status, headers, ETag and time are stored as a line of JSON,
+        followed by the compressed body. Pages are never pickled, as anyone
+        who can write to the cache could then run code in CKAN.
+
+        '''
+        header = json.dumps([self.status, self.headers, self.etag,
+                             self.created])
+        return '%s\n%s' % (header, self.body)
+
+    @classmethod
+    def loads(cls, data):
+        '''Return the page stored by :py:meth:`dumps` in ``data``.
+
+        Raises ValueError if ``data`` isn't a stored page.
+
+        '''
+        header, sep, body = data.partition('\n')
+        try:
+            status, headers, etag, created = json.loads(header)
+            headers = [(str(name), str(value)) for name, value in headers]
+            return cls(str(status), headers, body, str(etag), float(created))
+        except (TypeError, ValueError, UnicodeError), e:
+            raise ValueError('Not a cached page: %s' % e)
+
+
+def make_page(status, headers, body):
+    '''Return a :py:class:`CachedPage` for the given response.'''
+    compressor = zlib.compressobj(6, zlib.DEFLATED, _GZIP_WBITS)
+    compressed = compressor.compress(body) + compressor.flush()
+    etag = '"%s"' % hashlib.md5(body).hexdigest()
+    headers = [(str(name), str(value)) for name, value in headers
+               if name.lower() not in _UNSTORED_HEADERS]
+    return CachedPage(str(status), headers, compressed, etag, time.time())
+
+
+class PageCacheBackend(object):
+    '''The interface of the page cache backends.'''
+
+    def __init__(self, expires=0):
+        self.expires = expires
+
+    def get(self, key):
+        '''Return the :py:class:`CachedPage` stored under key, or ``None``.'''
+        raise NotImplementedError
+
+    def set(self, key, page, dependencies=()):
+        '''Store a :py:class:`CachedPage` under key.
+
+        The page will be removed when any of the given dependencies is
+        purged.
+
+        '''
+        raise NotImplementedError
+
+    def delete(self, keys):
+        '''Remove the pages stored under any of the given keys.'''
+        raise NotImplementedError
+
+    def purge(self, dependencies):
+        '''Remove the pages that depend on any of the given
+        dependencies.'''
+        raise NotImplementedError
+
+    def clear(self):
+        '''Remove all the cached pages.'''
+        raise NotImplementedError
+
+    def _expired(self, page):
+        return bool(self.expires) and page.created + self.expires < time.time()
+
+
+class MemoryBackend(PageCacheBackend):
+    '''Keeps pages in the memory of the current process, dropping the least
+    recently used ones when they take up more than ``max_size`` bytes.'''
+
+    def __init__(self, max_size=50 * 1024 * 1024, expires=0):
+        super(MemoryBackend, self).__init__(expires)
+        self.max_size = max_size
+        self.size = 0
+        self._pages = OrderedDict()
+        # dependency -> keys of the pages that depend on it, and the reverse
+        self._dependents = {}
+        self._dependencies = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            page = self._pages.pop(key, None)
+            if page is None:
+                return None
+            if self._expired(page):
+                self._pages[key] = page
+                self._remove(key)
+                return None
+            # Move it to the most recently used end
+            self._pages[key] = page
+            return page
+
+    def set(self, key, page, dependencies=()):
+        if len(page.body) > self.max_size:
+            return
+        with self._lock:
+            self._remove(key)
+            self._pages[key] = page
+            self.size += len(page.body)
+            self._dependencies[key] = set(dependencies)
+            for dependency in dependencies:
+                self._dependents.setdefault(dependency, set()).add(key)
+            while self.size > self.max_size:
+                self._remove(next(iter(self._pages)))
+
+    def delete(self, keys):
+        with self._lock:
+            for key in keys:
+                self._remove(key)
+
+    def purge(self, dependencies):
+        with self._lock:
+            for dependency in dependencies:
+                for key in self._dependents.pop(dependency, ()):
+                    self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
+            self._dependents.clear()
+            self._dependencies.clear()
+            self.size = 0
+
+    def _remove(self, key):
+        page = self._pages.pop(key, None)
+        if page is None:
+            return
+        self.size -= len(page.body)
+        for dependency in self._dependencies.pop(key, ()):
+            keys = self._dependents.get(dependency)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._dependents[dependency]
+
+
+class FileBackend(PageCacheBackend):
+    '''Keeps each page in a file in ``directory``, so that all the processes
+    on a server share the cache.
+
+    The keys of the pages that depend on each dependency are appended to a
+    ``.deps`` file for the dependency.
+
+    The directory must belong to the user CKAN runs as and must not be
+    writable by anyone else; it is created with mode 0700 if it doesn't
+    exist. At most every ``prune_interval`` seconds, storing a page also
+    removes the expired files and the oldest pages above ``max_size`` bytes
+    (see :py:meth:`prune`).
+
+    '''
+
+    # .deps files larger than this are rewritten without the keys of pages
+    # that are gone
+    max_dependencies_size = 64 * 1024
+    # temporary files left behind for longer than this are removed
+    max_temporary_age = 3600
+
+    def __init__(self, directory, expires=0, max_size=0, prune_interval=300):
+        super(FileBackend, self).__init__(expires)
+        self.directory = directory
+        self.max_size = max_size
+        self.prune_interval = prune_interval
+        self._last_prune = time.time()
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory, 0700)
+            except OSError, e:
+                # another process may have just created it
+                if e.errno != errno.EEXIST:
+                    raise
+        stat = os.stat(directory)
+        if stat.st_uid != os.getuid() or stat.st_mode & 022:
+            raise ValueError(
+                'The page cache directory %s must belong to the user CKAN '
+                'runs as and must not be writable by anyone else'
+                % directory)
+
+    def _path(self, key):
+        return os.path.join(self.directory,
+                            hashlib.sha1(key).hexdigest() + '.page')
+
+    def _dependency_path(self, dependency):
+        return os.path.join(self.directory,
+                            hashlib.sha1(dependency).hexdigest() + '.deps')
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                page = CachedPage.loads(f.read())
+        except IOError:
+            return None
+        except Exception, e:
+            log.warning('Could not read cached page %s: %s', path, e)
+            self._remove(path)
+            return None
+        if self._expired(page):
+            self._remove(path)
+            return None
+        return page
+
+    def set(self, key, page, dependencies=()):
+        # Write to a temporary file and rename it, so that readers never see
+        # a partially written page.
+        try:
+            for dependency in dependencies:
+                with open(self._dependency_path(dependency), 'a') as f:
+                    f.write(key + '\n')
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory,
+                                            suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(page.dumps())
+            os.rename(tmp_path, self._path(key))
+        except (IOError, OSError), e:
+            log.warning('Could not write cached page for %s: %s', key, e)
+        if time.time() - self._last_prune > self.prune_interval:
+            self._last_prune = time.time()
+            try:
+                self.prune()
+            except (IOError, OSError), e:
+                log.warning('Could not prune the page cache: %s', e)
+
+    def delete(self, keys):
+        for key in keys:
+            self._remove(self._path(key))
+
+    def purge(self, dependencies):
+        for dependency in dependencies:
+            path = self._dependency_path(dependency)
+            # Move the file aside first, so that keys added from now on go
+            # to a new one.
+            purging_path = '%s.%i.purging' % (path, os.getpid())
+            try:
+                os.rename(path, purging_path)
+            except OSError, e:
+                if e.errno != errno.ENOENT:
+                    raise
+                continue
+            with open(purging_path) as f:
+                keys = set(line.rstrip('\n') for line in f)
+            self.delete(keys)
+            self._remove(purging_path)
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.endswith('.page') or name.endswith('.deps'):
+                self._remove(os.path.join(self.directory, name))
+
+    def prune(self):
+        '''Remove the expired pages, the oldest pages above ``max_size``
+        bytes, the ``.deps`` files that only list expired pages and any
+        temporary files left behind, and shrink large ``.deps`` files.'''
+        now = time.time()
+        pages = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            age = now - stat.st_mtime
+            expired = bool(self.expires) and age > self.expires
+            if name.endswith('.page'):
+                if expired:
+                    self._remove(path)
+                else:
+                    pages.append((stat.st_mtime, stat.st_size, path))
+            elif name.endswith('.deps'):
+                # A key is appended every time a page is stored, so the
+                # pages of a .deps file that hasn't changed have expired
+                if expired:
+                    self._remove(path)
+                elif stat.st_size > self.max_dependencies_size:
+                    self._compact(path)
+            elif age > self.max_temporary_age:
+                self._remove(path)
+
+        size = sum(page_size for mtime, page_size, path in pages)
+        if self.max_size and size > self.max_size:
+            for mtime, page_size, path in sorted(pages):
+                self._remove(path)
+                size -= page_size
+                if size <= self.max_size:
+                    break
+
+    def _compact(self, path):
+        # Move the file aside, like purge() does, and add the keys of the
+        # pages that still exist back to the file that new keys go to.
+        compacting_path = '%s.%i.compacting' % (path, os.getpid())
+        try:
+            os.rename(path, compacting_path)
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                raise
+            return
+        with open(compacting_path) as f:
+            keys = set(line.rstrip('\n') for line in f)
+        keys = [key for key in keys if os.path.exists(self._path(key))]
+        if keys:
+            with open(path, 'a') as f:
+                f.write(''.join(key + '\n' for key in keys))
+        self._remove(compacting_path)
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                raise
+
+
+class RedisBackend(PageCacheBackend):
+    '''Keeps pages in a Redis server, using Redis' own expiry.
+
+    If the server can't be reached pages are neither served from nor
+    stored in the cache.
+
+    '''
+
+    prefix = 'ckan:page:'
+    dependency_prefix = 'ckan:page-deps:'
+
+    def __init__(self, url='redis://localhost:6379/0', expires=0):
+        super(RedisBackend, self).__init__(expires)
+        import redis    # only import if used
+        self.connection_error = redis.exceptions.ConnectionError
+        self.connection = redis.StrictRedis.from_url(url)
+
+    def get(self, key):
+        try:
+            data = self.connection.get(self.prefix + key)
+        except self.connection_error, e:
+            log.warning('Could not read from the page cache: %s', e)
+            return None
+        if data is None:
+            return None
+        try:
+            return CachedPage.loads(data)
+        except ValueError, e:
+            log.warning('Could not read cached page %s: %s', key, e)
+            return None
+
+    def set(self, key, page, dependencies=()):
+        data = page.dumps()
+        pipe = self.connection.pipeline()
+        for dependency in dependencies:
+            dependency_key = self.dependency_prefix + dependency
+            pipe.sadd(dependency_key, key)
+            if self.expires:
+                pipe.expire(dependency_key, self.expires)
+        if self.expires:
+            pipe.setex(self.prefix + key, self.expires, data)
+        else:
+            pipe.set(self.prefix + key, data)
+        try:
+            pipe.execute()
+        except self.connection_error, e:
+            log.warning('Could not write to the page cache: %s', e)
+
+    def delete(self, keys):
+        keys = [self.prefix + key for key in keys]
+        if not keys:
+            return
+        try:
+            self.connection.delete(*keys)
+        except self.connection_error, e:
+            log.warning('Could not delete from the page cache: %s', e)
+
+    def purge(self, dependencies):
+        dependency_keys = [self.dependency_prefix + dependency
+                           for dependency in dependencies]
+        if not dependency_keys:
+            return
+        try:
+            pipe = self.connection.pipeline()
+            for dependency_key in dependency_keys:
+                pipe.smembers(dependency_key)
+            pipe.delete(*dependency_keys)
+            results = pipe.execute()
+            keys = set()
+            for members in results[:-1]:
+                keys.update(members)
+            self.delete(keys)
+        except self.connection_error, e:
+            log.warning('Could not purge the page cache: %s', e)
+
+    def clear(self):
+        try:
+            keys = list(self.connection.scan_iter(self.prefix + '*'))
+            keys.extend(self.connection.scan_iter(
+                self.dependency_prefix + '*'))
+            if keys:
+                self.connection.delete(*keys)
+        except self.connection_error, e:
+            log.warning('Could not clear the page cache: %s', e)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend(config=None):
+    '''Return the configured page cache backend, creating it the first time
+    this is called in a process.'''
+    global _backend
+    if _backend is not None:
+        return _backend
+    if config is None:
+        from pylons import config
+    with _backend_lock:
+        if _backend is None:
+            _backend = make_backend(config)
+    return _backend
+
+
+def make_backend(config):
+    '''Return a new page cache backend, as set in the config.'''
+    # redis, the only storage before there were backends, is the default so
+    # that existing sites keep a cache shared by all their processes
+    name = config.get('ckan.page_cache.backend', 'redis')
+    expires = int(config.get('ckan.page_cache.expires', 3600))
+    max_size = int(config.get('ckan.page_cache.max_size', 50 * 1024 * 1024))
+    if name == 'memory':
+        return MemoryBackend(max_size=max_size, expires=expires)
+    elif name == 'file':
+        directory = config.get('ckan.page_cache.directory')
+        if not directory:
+            directory = os.path.join(tempfile.gettempdir(), 'ckan_page_cache')
+        return FileBackend(directory, expires=expires, max_size=max_size)
+    elif name == 'redis':
+        url = config.get('ckan.page_cache.redis_url',
+                         'redis://localhost:6379/0')
+        return RedisBackend(url, expires=expires)
+    raise ValueError('Unknown page cache backend: %s' % name)
+
+
+def reset_backend():
+    '''Forget the current backend, so that the next call to
+    :py:func:`get_backend` creates a new one.'''
+    global _backend
+    _backend = None
+
+
+def dependency(entity_type, identifier):
+    '''Return the name of the dependency on an entity.'''
+    return u'%s:%s' % (entity_type, identifier)
+
+
+def depends_on(entity_type, *identifiers):
+    '''Record that the page being rendered shows the ``'package'`` or
+    ``'group'`` with the given ids or names.
+
+    If the page is cached it will be purged when any of those entities
+    change.
+
+    '''
+    dependencies = request.environ.setdefault('CKAN_PAGE_DEPENDENCIES', set())
+    dependencies.update(dependency(entity_type, identifier)
+                        for identifier in identifiers if identifier)
+
+
+def package_dependencies(package):
+    '''Return the dependencies of the pages that show a dataset: the
+    dataset itself and the organization and groups that list it.'''
+    dependencies = set([dependency('package', package.id),
+                        dependency('package', package.name)])
+    if package.owner_org:
+        dependencies.add(dependency('group', package.owner_org))
+    for group in package.get_groups():
+        dependencies.add(dependency('group', group.id))
+    return dependencies
+
+
+_pending = threading.local()
+
+
+def purge_after_commit(dependencies):
+    '''Purge the given dependencies once the current transaction has been
+    committed.'''
+    pending = getattr(_pending, 'dependencies', None)
+    if pending is None:
+        pending = _pending.dependencies = set()
+    pending.update(dependencies)
+
+
+def discard_pending_purges():
+    _pending.dependencies = None
+
+
+def purge_changes(objects):
+    '''Purge the pages that depend on the given changed objects, the ones
+    that were waiting for the commit and the ones that depend on any
+    change.'''
+    dependencies = set([ANY_CHANGE])
+    dependencies.update(getattr(_pending, 'dependencies', None) or ())
+    discard_pending_purges()
+    for obj in objects:
+        # Groups and memberships aren't reported to
+        # IDomainObjectModification observers
+        if isinstance(obj, model.Group):
+            dependencies.add(dependency('group', obj.id))
+            dependencies.add(dependency('group', obj.name))
+        elif isinstance(obj, model.Member):
+            dependencies.add(dependency('group', obj.group_id))
+    get_backend().purge(dependencies)
+
+
+class PageCachePlugin(p.SingletonPlugin):
+    '''Purges the cached pages that show a dataset when the dataset or
+    one of its resources changes.
+
+    This is loaded automatically when :ref:`ckan.page_cache_enabled` is
+    set.
+
+    '''
+    p.implements(p.IDomainObjectModification, inherit=True)
+
+    def notify(self, entity, operation):
+        if isinstance(entity, model.Resource):
+            entity = entity.package
+        if not isinstance(entity, model.Package):
+            return
+        # Pages are only purged once the change is committed, so that they
+        # can't be cached again with the old data in between.
+        purge_after_commit(package_dependencies(entity))
@@ -1,6 +1,7 @@
 import logging
 import sys
 import cgitb
+import threading
 import warnings
 import xml.dom.minidom
 import urllib2
@@ -112,6 +113,43 @@ def dispatch_by_operation(entity_type, entity, operation):
         raise
 
 
+_deferred = threading.local()
+
+
+def defer_indexing():
+    '''Make :py:class:`SynchronousSearchPlugin` collect the datasets that
+    change in this thread, instead of indexing each of them as it is
+    committed, until :py:func:`index_deferred` is called.'''
+    if getattr(_deferred, 'packages', None) is None:
+        _deferred.packages = {}
+
+
+def index_deferred():
+    '''Index the datasets collected since :py:func:`defer_indexing` was
+    called, in a single request to the search index followed by a single
+    commit, and go back to indexing datasets as they are committed.'''
+    packages = getattr(_deferred, 'packages', None)
+    _deferred.packages = None
+    if not packages:
+        return
+
+    package_index = index_for(model.Package)
+    context = {'model': model, 'ignore_auth': True, 'validate': False,
+               'use_cache': False}
+    pkg_dicts = []
+    for package_id, operation in packages.iteritems():
+        if operation == model.domain_object.DomainObjectOperation.deleted:
+            package_index.remove_dict({'id': package_id})
+            continue
+        try:
+            pkg_dicts.append(logic.get_action('package_show')(
+                context.copy(), {'id': package_id}))
+        except logic.NotFound:
+            # e.g. the transaction that created it was rolled back
+            log.warn('Not indexing missing dataset %s' % package_id)
+    package_index.update_dicts(pkg_dicts)
+
+
 class SynchronousSearchPlugin(p.SingletonPlugin):
     """Update the search index automatically."""
     p.implements(p.IDomainObjectModification, inherit=True)
@@ -119,6 +157,10 @@ class SynchronousSearchPlugin(p.SingletonPlugin):
     def notify(self, entity, operation):
         if not isinstance(entity, model.Package):
             return
+        packages = getattr(_deferred, 'packages', None)
+        if packages is not None:
+            packages[entity.id] = operation
+            return
         if operation != model.domain_object.DomainObjectOperation.deleted:
             dispatch_by_operation(
                 entity.__class__.__name__,
@@ -1,5 +1,8 @@
 from pylons import config
 import logging
+
+import ckan.lib.instrumentation as instrumentation
+
 log = logging.getLogger(__name__)
 
 
@@ -61,6 +64,7 @@ def is_available():
 
 def make_connection():
     from solr import SolrConnection
+    instrumentation.record_solr_call()
     solr_url, solr_user, solr_password = SolrSettings.get()
     assert solr_url is not None
     if solr_user is not None and solr_password is not None:
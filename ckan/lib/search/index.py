@@ -2,11 +2,11 @@ import socket
 import string
 import logging
 import collections
-import json
 import datetime
 from dateutil.parser import parse
 
 import re
+from xml.sax.saxutils import escape as xml_escape
 
 import solr
 
@@ -20,6 +20,7 @@ from ckan.plugins import (PluginImplementations,
                           IPackageController)
 import ckan.logic as logic
 import ckan.lib.plugins as lib_plugins
+import ckan.lib.json_codec as json_codec
 import ckan.lib.navl.dictization_functions
 
 log = logging.getLogger(__name__)
@@ -85,6 +86,14 @@ class SearchIndex(object):
         """ Delete an index entry uniquely identified by ``data``. """
         log.debug("NOOP Delete: %s" % ",".join(data.keys()))
 
+    def update_dicts(self, data_dicts, defer_commit=False):
+        """ Update the entries of all the given dictionaries at once. """
+        for data in data_dicts:
+            self.update_dict(data)
+
+    def commit(self):
+        """ Commit pending changes to the index. """
+
     def clear(self):
         """ Delete the complete index. """
         clear_index()
@@ -102,11 +111,66 @@ class PackageSearchIndex(SearchIndex):
     def update_dict(self, pkg_dict, defer_commit=False):
         self.index_package(pkg_dict, defer_commit)
 
+    def update_dicts(self, pkg_dicts, defer_commit=False):
+        self.index_packages(pkg_dicts, defer_commit)
+
     def index_package(self, pkg_dict, defer_commit=False):
         if pkg_dict is None:
             return
+        self.index_packages([pkg_dict], defer_commit)
+
+    def index_packages(self, pkg_dicts, defer_commit=False):
+        '''Index the given datasets, sending all of them to Solr in a single
+        request followed by a single commit.
+
+        Datasets that aren't active are removed from the index instead.
+
+        '''
+        commit = not defer_commit
+        if not asbool(config.get('ckan.search.solr_commit', 'true')):
+            commit = False
+
+        docs = []
+        deleted = False
+        for pkg_dict in pkg_dicts:
+            doc = self._package_doc(pkg_dict)
+            if doc is None:
+                self.delete_package(pkg_dict, defer_commit=True)
+                deleted = True
+            else:
+                docs.append(doc)
 
-        data_dict_json = json.dumps(pkg_dict)
+        if not docs:
+            if deleted and commit:
+                self.commit()
+            return
+
+        # send to solr:
+        try:
+            conn = make_connection()
+            conn.add_many(docs, _commit=commit)
+        except solr.core.SolrException, e:
+            msg = 'Solr returned an error: {0} {1} - {2}'.format(
+                e.httpcode, e.reason, e.body[:1000]  # limit huge responses
+            )
+            raise SearchIndexError(msg)
+        except socket.error, e:
+            err = 'Could not connect to Solr using {0}: {1}'.format(
+                conn.url, str(e))
+            log.error(err)
+            raise SearchIndexError(err)
+        finally:
+            conn.close()
+
+        commit_debug_msg = 'Commited' if commit else 'Not commited yet'
+        for doc in docs:
+            log.debug('Updated index for %s [%s]' % (doc.get('name'),
+                                                     commit_debug_msg))
+
+    def _package_doc(self, pkg_dict):
+        '''Return the Solr document for ``pkg_dict``, or None if the dataset
+        shouldn't be indexed.'''
+        data_dict_json = json_codec.dumps(pkg_dict)
 
         if config.get('ckan.cache_validated_datasets', True):
             package_plugin = lib_plugins.lookup_package_plugin(
@@ -116,7 +180,8 @@ class PackageSearchIndex(SearchIndex):
             validated_pkg_dict, errors = lib_plugins.plugin_validate(
                 package_plugin, {'model': model, 'session': model.Session},
                 pkg_dict, schema, 'package_show')
-            pkg_dict['validated_data_dict'] = json.dumps(validated_pkg_dict,
+            pkg_dict['validated_data_dict'] = json_codec.dumps(
+                validated_pkg_dict,
                 cls=ckan.lib.navl.dictization_functions.MissingNullEncoder)
 
         pkg_dict['data_dict'] = data_dict_json
@@ -127,7 +192,7 @@ class PackageSearchIndex(SearchIndex):
             pkg_dict['title_string'] = title
 
         if (not pkg_dict.get('state')) or ('active' not in pkg_dict.get('state')):
-            return self.delete_package(pkg_dict)
+            return None
 
         index_fields = RESERVED_FIELDS + pkg_dict.keys()
 
@@ -274,27 +339,155 @@ class PackageSearchIndex(SearchIndex):
 
         assert pkg_dict, 'Plugin must return non empty package dict on index'
 
-        # send to solr:
+        return pkg_dict
+
+    def update_tracking(self, summaries, defer_commit=False):
+        '''Set the views_total and views_recent fields of datasets that are
+        already indexed, with a Solr atomic update instead of reindexing them.
+
+        ``summaries`` maps dataset ids to tracking summaries, as returned by
+        :py:meth:`ckan.model.TrackingSummary.get_for_packages`. All of them
+        are sent in a single request.
+
+        Atomic updates need Solr 4 or later, and a schema in which every
+        field that isn't a ``copyField`` destination is stored, otherwise
+        Solr drops the fields that aren't stored from the updated documents.
+
+        '''
+        if not summaries:
+            return
+
+        import hashlib
+        site_id = config.get('ckan.site_id')
+        request = [u'<add>']
+        for package_id, summary in summaries.iteritems():
+            index_id = hashlib.md5('%s%s' % (package_id, site_id)).hexdigest()
+            request.append(
+                u'<doc><field name="index_id">%s</field>'
+                u'<field name="views_total" update="set">%i</field>'
+                u'<field name="views_recent" update="set">%i</field></doc>'
+                % (index_id, summary['total'], summary['recent']))
+        request.append(u'</add>')
+        self._update(u''.join(request), defer_commit)
+
+    def update_fields(self, package_ids, fields, defer_commit=False):
+        '''Set ``fields``, e.g. ``{'private': True}``, to the same values in
+        all the given indexed datasets, without reindexing them from the
+        database.
+
+        The ``data_dict`` and ``validated_data_dict`` stored with each dataset
+        are read back from Solr and changed too. If
+        :ref:`ckan.search.atomic_updates` is enabled, only the changed fields
+        are sent back, with Solr atomic updates, otherwise the datasets are
+        reindexed from their changed ``data_dict``. Either way all of them are
+        sent in a single request.
+
+        '''
+        if not package_ids:
+            return
+        docs = self._stored_docs(package_ids)
+
+        if not asbool(config.get('ckan.search.atomic_updates', False)):
+            pkg_dicts = []
+            for doc in docs:
+                pkg_dict = json_codec.loads(doc['data_dict'])
+                pkg_dict.update(fields)
+                pkg_dicts.append(pkg_dict)
+            self.index_packages(pkg_dicts, defer_commit)
+            return
+
+        solr_fields = {}
+        if 'private' in fields:
+            # we use the capacity to make things private in the search index
+            solr_fields['capacity'] = \
+                'private' if fields['private'] else 'public'
+        if 'state' in fields:
+            solr_fields['state'] = fields['state']
+
+        request = [u'<add>']
+        for doc in docs:
+            request.append(u'<doc><field name="index_id">%s</field>'
+                           % doc['index_id'])
+            for name, value in solr_fields.items():
+                request.append(u'<field name="%s" update="set">%s</field>'
+                               % (name, xml_escape(value)))
+            for name in ('data_dict', 'validated_data_dict'):
+                if name not in doc:
+                    continue
+                stored_dict = json_codec.loads(doc[name])
+                stored_dict.update(fields)
+                request.append(u'<field name="%s" update="set">%s</field>'
+                               % (name, xml_escape(
+                                   json_codec.dumps(stored_dict))))
+            request.append(u'</doc>')
+        request.append(u'</add>')
+        self._update(u''.join(request), defer_commit)
+
+    def _stored_docs(self, package_ids):
+        '''Return the index_id, data_dict and validated_data_dict stored in
+        Solr for the given datasets.'''
+        # stay well below Solr's default maxBooleanClauses
+        batch_size = 500
+        docs = []
+        conn = make_connection()
         try:
-            conn = make_connection()
-            commit = not defer_commit
-            if not asbool(config.get('ckan.search.solr_commit', 'true')):
-                commit = False
-            conn.add_many([pkg_dict], _commit=commit)
+            for start in range(0, len(package_ids), batch_size):
+                batch = package_ids[start:start + batch_size]
+                response = conn.raw_query(
+                    q='id:(%s)' % ' OR '.join('"%s"' % package_id
+                                              for package_id in batch),
+                    fq='+site_id:"%s"' % config.get('ckan.site_id'),
+                    fl='index_id,data_dict,validated_data_dict',
+                    rows=len(batch), wt='json')
+                docs.extend(json_codec.loads(response)['response']['docs'])
         except solr.core.SolrException, e:
             msg = 'Solr returned an error: {0} {1} - {2}'.format(
-                e.httpcode, e.reason, e.body[:1000] # limit huge responses
+                e.httpcode, e.reason, e.body[:1000]  # limit huge responses
             )
             raise SearchIndexError(msg)
         except socket.error, e:
-            err = 'Could not connect to Solr using {0}: {1}'.format(conn.url, str(e))
+            err = 'Could not connect to Solr using {0}: {1}'.format(
+                conn.url, str(e))
             log.error(err)
             raise SearchIndexError(err)
         finally:
             conn.close()
+        return docs
 
-        commit_debug_msg = 'Not commited yet' if defer_commit else 'Commited'
-        log.debug('Updated index for %s [%s]' % (pkg_dict.get('name'), commit_debug_msg))
+    def delete_packages(self, package_ids, defer_commit=False):
+        '''Remove the given datasets from the index, in a single request.'''
+        if not package_ids:
+            return
+        import hashlib
+        site_id = config.get('ckan.site_id')
+        request = [u'<delete>']
+        for package_id in package_ids:
+            index_id = hashlib.md5('%s%s' % (package_id, site_id)).hexdigest()
+            request.append(u'<id>%s</id>' % index_id)
+        request.append(u'</delete>')
+        self._update(u''.join(request), defer_commit)
+
+    def _update(self, request, defer_commit=False):
+        '''Send the XML update ``request`` to Solr.'''
+        query = None
+        if (not defer_commit and
+                asbool(config.get('ckan.search.solr_commit', 'true'))):
+            query = {'commit': 'true'}
+        try:
+            conn = make_connection()
+            conn._update(request, query)
+        except solr.core.SolrException, e:
+            msg = 'Solr returned an error: {0} {1} - {2}'.format(
+                e.httpcode, e.reason, e.body[:1000]  # limit huge responses
+            )
+            raise SearchIndexError(msg)
+        except socket.error, e:
+            err = 'Could not connect to Solr using {0}: {1}'.format(
+                conn.url, str(e))
+            log.error(err)
+            raise SearchIndexError(err)
+        finally:
+            conn.close()
 
     def commit(self):
         try:
@@ -306,15 +499,15 @@ class PackageSearchIndex(SearchIndex):
         finally:
             conn.close()
 
-
-    def delete_package(self, pkg_dict):
+    def delete_package(self, pkg_dict, defer_commit=False):
         conn = make_connection()
         query = "+%s:%s (+id:\"%s\" OR +name:\"%s\") +site_id:\"%s\"" % (TYPE_FIELD, PACKAGE_TYPE,
                                                        pkg_dict.get('id'), pkg_dict.get('id'),
                                                        config.get('ckan.site_id'))
         try:
             conn.delete_query(query)
-            if asbool(config.get('ckan.search.solr_commit', 'true')):
+            if (not defer_commit and
+                    asbool(config.get('ckan.search.solr_commit', 'true'))):
                 conn.commit()
         except Exception, e:
             log.exception(e)
@@ -6,7 +6,7 @@ from solr import SolrException
 from paste.deploy.converters import asbool
 from paste.util.multidict import MultiDict
 
-from ckan.common import json
+from ckan.common import json_codec
 from ckan.lib.search.common import make_connection, SearchError, SearchQueryError
 import ckan.logic as logic
 import ckan.model as model
@@ -276,7 +276,7 @@ class PackageSearchQuery(SearchQuery):
             raise SearchError('SOLR returned an error running query: %r Error: %r' %
                               (query, e.reason))
         try:
-            data = json.loads(solr_response)
+            data = json_codec.loads(solr_response)
 
             if data['response']['numFound'] == 0:
                 raise SearchError('Dataset not found in the search index: %s' % reference)
@@ -363,7 +363,7 @@ class PackageSearchQuery(SearchQuery):
             raise SearchError('SOLR returned an error running query: %r Error: %r' %
                               (query, e.reason))
         try:
-            data = json.loads(solr_response)
+            data = json_codec.loads(solr_response)
             response = data['response']
             self.count = response.get('numFound', 0)
             self.results = response.get('docs', [])
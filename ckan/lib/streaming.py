@@ -0,0 +1,78 @@
+'''Incremental JSON and gzip encoding of API responses.
+
+The action API normally builds its response as one JSON string, which is
+copied again to wrap it in a JSONP callback and again into the response
+body. When :ref:`ckan.api.stream_responses` is set the controller returns a
+:py:class:`JSONStream` instead, which the WSGI server iterates over to send
+the response out in chunks as they are encoded, so the whole encoded response
+is never held in memory.
+
+'''
+import zlib
+
+from ckan.common import json
+
+# Encoded fragments are joined into chunks of about this many bytes before
+# they are handed to the WSGI server.
+CHUNK_SIZE = 64 * 1024
+
+
+class JSONStream(object):
+    '''An iterable over the JSON encoding of ``data``, optionally wrapped in
+    a JSONP ``callback``.
+
+    The data is encoded afresh every time the stream is iterated over, so it
+    can be iterated more than once, e.g. to hash it before it is sent.
+
+    '''
+
+    def __init__(self, data, callback=None, chunk_size=CHUNK_SIZE):
+        self.data = data
+        self.callback = callback
+        self.chunk_size = chunk_size
+
+    def __iter__(self):
+        chunk = []
+        size = 0
+        for fragment in self._fragments():
+            if isinstance(fragment, unicode):
+                fragment = fragment.encode('utf-8')
+            chunk.append(fragment)
+            size += len(fragment)
+            if size >= self.chunk_size:
+                yield ''.join(chunk)
+                chunk = []
+                size = 0
+        if chunk:
+            yield ''.join(chunk)
+
+    def _fragments(self):
+        if self.callback:
+            yield '%s(' % self.callback
+        for fragment in json.JSONEncoder().iterencode(self.data):
+            yield fragment
+        if self.callback:
+            yield ');'
+
+
+class GzipStream(object):
+    '''An iterable over the gzip compression of the chunks of ``stream``.'''
+
+    def __init__(self, stream, compresslevel=6):
+        self.stream = stream
+        self.compresslevel = compresslevel
+
+    def __iter__(self):
+        # 16 + MAX_WBITS makes zlib write a gzip header and trailer
+        compressor = zlib.compressobj(self.compresslevel, zlib.DEFLATED,
+                                      16 + zlib.MAX_WBITS)
+        for chunk in self.stream:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+
+
+def gzip(body, compresslevel=6):
+    '''Return the gzip compression of the string ``body``.'''
+    return ''.join(GzipStream([body], compresslevel))
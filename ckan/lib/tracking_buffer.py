@@ -0,0 +1,233 @@
+'''Buffered writing of page view tracking events.
+
+:py:class:`~ckan.config.middleware.TrackingMiddleware` normally inserts a row
+into ``tracking_raw`` for every tracking beacon it receives. When
+:ref:`ckan.tracking.buffered` is set it adds the events to a
+:py:class:`TrackingBuffer` instead, which a background thread writes to the
+database in batches, with one multi-row ``INSERT`` per batch.
+
+'''
+import atexit
+import collections
+import datetime
+import json
+import logging
+import os
+import threading
+
+import sqlalchemy.exc
+
+log = logging.getLogger(__name__)
+
+INSERT_SQL = '''INSERT INTO tracking_raw
+                (user_key, url, tracking_type, access_timestamp)
+                VALUES '''
+
+# The length of the tracking_raw.tracking_type column
+MAX_TRACKING_TYPE_LENGTH = 10
+
+
+class TrackingBuffer(object):
+    '''An in-process buffer of tracking events that is flushed to the
+    database every ``flush_events`` events or every ``flush_interval``
+    milliseconds, whichever comes first.
+
+    At most ``max_events`` events are held in memory. Events that don't fit,
+    or that can't be written because the database is unavailable, are
+    appended to ``spool_file`` if one is given and written to the database
+    on a later flush, otherwise they are dropped. Events that the database
+    rejects are dropped one by one, without the rest of their batch.
+
+    '''
+
+    def __init__(self, engine, max_events=10000, flush_events=500,
+                 flush_interval=1000, spool_file=None):
+        self.engine = engine
+        self.max_events = max_events
+        self.flush_events = flush_events
+        self.flush_interval = flush_interval / 1000.0
+        self.spool_file = spool_file
+
+        self.flushed = 0
+        self.dropped = 0
+        self.spooled = 0
+
+        self._events = collections.deque()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._closed = False
+        atexit.register(self.close)
+
+    def add(self, user_key, url, tracking_type):
+        '''Queue a tracking event to be written to the database.
+
+        Events without a url or a type are dropped.
+
+        '''
+        if not url or not tracking_type:
+            with self._lock:
+                self.dropped += 1
+            return
+        event = (user_key, url, tracking_type[:MAX_TRACKING_TYPE_LENGTH],
+                 datetime.datetime.now())
+        with self._lock:
+            if len(self._events) < self.max_events:
+                self._events.append(event)
+                pending = len(self._events)
+                event = None
+        if event is not None:
+            self._spool([event])
+            return
+        self._ensure_thread()
+        if pending >= self.flush_events:
+            self._wakeup.set()
+
+    def stats(self):
+        '''Return the buffer's counters.'''
+        with self._lock:
+            pending = len(self._events)
+        return {'pending': pending, 'flushed': self.flushed,
+                'dropped': self.dropped, 'spooled': self.spooled}
+
+    def flush(self):
+        '''Write all the queued events, and any spooled ones, to the
+        database.'''
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    count = min(len(self._events), self.flush_events)
+                    events = [self._events.popleft() for i in range(count)]
+                if not events:
+                    break
+                unwritten = self._write(events)
+                if unwritten:
+                    self._spool(unwritten)
+                    return
+            self._replay_spool()
+
+    def close(self):
+        '''Stop the background thread and write out the queued events.'''
+        self._closed = True
+        self._wakeup.set()
+        self.flush()
+
+    def _ensure_thread(self):
+        # The buffer may have been created before the server forked its
+        # worker processes, which don't inherit the parent's threads.
+        if (self._thread is not None and self._thread.is_alive()
+                and self._pid == os.getpid()):
+            return
+        with self._lock:
+            if (self._thread is not None and self._thread.is_alive()
+                    and self._pid == os.getpid()):
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run,
+                                            name='TrackingBuffer')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _run(self):
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception, e:
+                log.exception(e)
+
+    def _write(self, events):
+        '''Write the events to the database, and return the ones that
+        couldn't be written but should be retried later.
+
+        If the database rejects the batch the events are written one by one,
+        and only the ones that it rejects are dropped.
+
+        '''
+        try:
+            self._insert(events)
+        except Exception, e:
+            if len(events) == 1 and _rejected(e):
+                self._drop_rejected(events[0], e)
+                return []
+            log.error('Could not write %i tracking events: %s',
+                      len(events), e)
+            if not _rejected(e):
+                return events
+            for index, event in enumerate(events):
+                try:
+                    self._insert([event])
+                except Exception, e:
+                    if not _rejected(e):
+                        return events[index:]
+                    self._drop_rejected(event, e)
+                else:
+                    self.flushed += 1
+            return []
+        self.flushed += len(events)
+        return []
+
+    def _insert(self, events):
+        values = ', '.join(['(%s, %s, %s, %s)'] * len(events))
+        params = [value for event in events for value in event]
+        self.engine.execute(INSERT_SQL + values, *params)
+
+    def _drop_rejected(self, event, error):
+        with self._lock:
+            self.dropped += 1
+        log.warning('Dropped the tracking event %r: %s', event, error)
+
+    def _spool(self, events):
+        with self._lock:
+            if not self.spool_file:
+                self.dropped += len(events)
+                log.warning('Dropped %i tracking events', len(events))
+                return
+            try:
+                with open(self.spool_file, 'a') as spool:
+                    for user_key, url, tracking_type, timestamp in events:
+                        spool.write(json.dumps(
+                            [user_key, url, tracking_type,
+                             timestamp.isoformat()]) + '\n')
+                self.spooled += len(events)
+            except (IOError, OSError), e:
+                self.dropped += len(events)
+                log.error('Dropped %i tracking events, could not write to '
+                          'the spool file %s: %s', len(events),
+                          self.spool_file, e)
+
+    def _replay_spool(self):
+        if not self.spool_file or not os.path.exists(self.spool_file):
+            return
+        with self._lock:
+            # Move the file aside so new overflow goes to a fresh one. Other
+            # worker processes may share the spool file.
+            replay_file = '%s.%i.replay' % (self.spool_file, os.getpid())
+            try:
+                os.rename(self.spool_file, replay_file)
+            except OSError:
+                return
+        with open(replay_file) as spool:
+            events = [tuple(json.loads(line)) for line in spool
+                      if line.strip()]
+        for start in range(0, len(events), self.flush_events):
+            end = start + self.flush_events
+            unwritten = self._write(events[start:end])
+            if unwritten:
+                # Put back what is left, it'll be retried on the next flush
+                with self._lock:
+                    with open(self.spool_file, 'a') as spool:
+                        for event in unwritten + events[end:]:
+                            spool.write(json.dumps(list(event)) + '\n')
+                break
+        os.remove(replay_file)
+
+
+def _rejected(error):
+    '''Return True if the database rejected the data, rather than being
+    unavailable.'''
+    return isinstance(error, (sqlalchemy.exc.DataError,
+                              sqlalchemy.exc.IntegrityError))
@@ -8,6 +8,7 @@ import formencode.validators
 import ckan.model as model
 import ckan.new_authz as new_authz
 import ckan.lib.navl.dictization_functions as df
+import ckan.lib.instrumentation as instrumentation
 import ckan.plugins as p
 
 from ckan.common import _, c
@@ -421,7 +422,8 @@ def get_action(action):
                 context['__auth_audit'].append((action_name, id(_action)))
 
                 # check_access(action_name, context, data_dict=None)
-                result = _action(context, data_dict, **kw)
+                with instrumentation.record_action(action_name):
+                    result = _action(context, data_dict, **kw)
                 try:
                     audit = context['__auth_audit'][-1]
                     if audit[0] == action_name and audit[1] == id(_action):
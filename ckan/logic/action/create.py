@@ -25,7 +25,10 @@ import ckan.lib.datapreview
 from ckan.common import _
 
 # FIXME this looks nasty and should be shared better
-from ckan.logic.action.update import _update_package_relationship
+from ckan.logic.action.update import (_update_package_relationship,
+                                      _fast_resource_writes, _save_resource,
+                                      _add_default_views_to_resource,
+                                      _package_save_many)
 
 log = logging.getLogger(__name__)
 
@@ -127,6 +130,38 @@ def package_create(context, data_dict):
     model = context['model']
     user = context['user']
 
+    data, errors = _package_create_validate(context, data_dict)
+
+    if errors:
+        model.Session.rollback()
+        raise ValidationError(errors)
+
+    rev = model.repo.new_revision()
+    rev.author = user
+    if 'message' in context:
+        rev.message = context['message']
+    else:
+        rev.message = _(u'REST API: Create object %s') % data.get("name")
+
+    _package_create_save(context, data)
+
+    # Make sure that a user provided schema is not used on package_show
+    context.pop('schema', None)
+
+    return_id_only = context.get('return_id_only', False)
+
+    output = context['id'] if return_id_only \
+        else _get_action('package_show')(context, {'id': context['id']})
+
+    return output
+
+
+def _package_create_validate(context, data_dict):
+    '''Check that the user may create the dataset and validate it.
+
+    Returns the validated data and the validation errors.
+
+    '''
     if 'type' not in data_dict:
         package_plugin = lib_plugins.lookup_package_plugin()
         try:
@@ -166,16 +201,14 @@ def package_create(context, data_dict):
               errors, context.get('user'),
               data.get('name'), data_dict)
 
-    if errors:
-        model.Session.rollback()
-        raise ValidationError(errors)
+    return data, errors
 
-    rev = model.repo.new_revision()
-    rev.author = user
-    if 'message' in context:
-        rev.message = context['message']
-    else:
-        rev.message = _(u'REST API: Create object %s') % data.get("name")
+
+def _package_create_save(context, data):
+    '''Save the new dataset from the validated ``data`` in the current
+    revision, and return it.'''
+    model = context['model']
+    user = context['user']
 
     admins = []
     if user:
@@ -220,15 +253,35 @@ def package_create(context, data_dict):
     context["id"] = pkg.id
     log.debug('Created object %s' % pkg.name)
 
-    # Make sure that a user provided schema is not used on package_show
-    context.pop('schema', None)
+    return pkg
 
-    return_id_only = context.get('return_id_only', False)
 
-    output = context['id'] if return_id_only \
-        else _get_action('package_show')(context, {'id': context['id']})
+def package_create_many(context, data_dict):
+    '''Create many datasets at once.
 
-    return output
+    All the datasets are validated first. The valid ones are then saved,
+    ``chunk_size`` of them in each database transaction, and sent to the
+    search index together at the end, which is much faster than calling
+    :py:func:`package_create` for each of them, e.g. when harvesting.
+
+    :param datasets: the datasets to create, see :py:func:`package_create`
+        for the format of each one
+    :type datasets: list of dictionaries
+    :param chunk_size: the number of datasets saved in each transaction
+        (optional, default: all of them are saved in a single transaction)
+    :type chunk_size: int
+
+    :returns: one dictionary for each dataset, in the same order, with a
+        ``success`` key and either a ``result`` with the ``id`` and ``name``
+        of the new dataset or an ``error`` like the ones the action API
+        returns
+    :rtype: list of dictionaries
+
+    '''
+    _check_access('package_create_many', context, data_dict)
+    return _package_save_many(context, data_dict, _package_create_validate,
+                              _package_create_save,
+                              _(u'REST API: Create objects'))
 
 
 def resource_create(context, data_dict):
@@ -282,6 +335,9 @@ def resource_create(context, data_dict):
     package_id = _get_or_bust(data_dict, 'package_id')
     _get_or_bust(data_dict, 'url')
 
+    if _fast_resource_writes():
+        return _resource_create_fast(context, data_dict, package_id)
+
     pkg_dict = _get_action('package_show')(context, {'id': package_id})
 
     _check_access('resource_create', context, data_dict)
@@ -321,6 +377,34 @@ def resource_create(context, data_dict):
     return resource
 
 
+def _resource_create_fast(context, data_dict, package_id):
+    model = context['model']
+
+    package = model.Package.get(package_id)
+    if package is None:
+        raise NotFound(_('Dataset was not found.'))
+
+    _check_access('resource_create', context, data_dict)
+
+    for plugin in plugins.PluginImplementations(plugins.IResourceController):
+        plugin.before_create(context, data_dict)
+
+    upload = uploader.ResourceUpload(data_dict)
+
+    resource_id = _save_resource(context, data_dict, package).id
+
+    upload.upload(resource_id, uploader.get_max_resource_size())
+    model.repo.commit()
+
+    _add_default_views_to_resource(context, resource_id)
+    resource = _get_action('resource_show')(context, {'id': resource_id})
+
+    for plugin in plugins.PluginImplementations(plugins.IResourceController):
+        plugin.after_create(context, resource)
+
+    return resource
+
+
 def resource_view_create(context, data_dict):
     '''Creates a new resource view.
 
@@ -5,6 +5,7 @@ from sqlalchemy import or_
 import ckan.logic
 import ckan.logic.action
 import ckan.plugins as plugins
+import ckan.lib.identity_cache as identity_cache
 import ckan.lib.dictization.model_dictize as model_dictize
 
 from ckan.common import _
@@ -41,6 +42,7 @@ def user_delete(context, data_dict):
 
     user.delete()
     model.repo.commit()
+    identity_cache.invalidate_user(user.id)
 
 
 def package_delete(context, data_dict):
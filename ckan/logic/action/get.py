@@ -23,6 +23,7 @@ import ckan.lib.search as search
 import ckan.lib.plugins as lib_plugins
 import ckan.lib.activity_streams as activity_streams
 import ckan.lib.datapreview as datapreview
+import ckan.lib.instrumentation as instrumentation
 import ckan.new_authz as new_authz
 
 from ckan.common import _
@@ -83,6 +84,17 @@ def _activity_stream_get_filtered_users():
     return model.User.user_ids_for_name_or_id(users_list)
 
 
+def _activity_list_before(context, data_dict):
+    '''Return the (timestamp, id) cursor for the ``before`` parameter of the
+    activity list actions, or None.'''
+    activity_id = data_dict.get('before')
+    if not activity_id:
+        return None
+    activity = context['session'].query(context['model'].Activity).get(
+        activity_id)
+    return (activity.timestamp, activity.id)
+
+
 def _package_list_with_resources(context, package_revision_list):
     package_list = []
     for package in package_revision_list:
@@ -91,6 +103,80 @@ def _package_list_with_resources(context, package_revision_list):
     return package_list
 
 
+# Dataset fields that are stored as-is in the search index, so package_search
+# can return them without loading the full dataset dicts. The metadata_*
+# dates aren't, as Solr keeps them to the millisecond.
+_SOLR_STORED_PACKAGE_FIELDS = frozenset([
+    'id', 'name', 'title', 'version', 'url', 'notes', 'author',
+    'author_email', 'maintainer', 'maintainer_email', 'license_id', 'state',
+    'revision_id',
+])
+
+
+def _parse_fields(fields):
+    '''Parse the ``fields`` parameter of package_show and package_search.
+
+    ``fields`` is a list of, or comma-separated string of, dataset keys.
+    ``resources.url`` style keys select keys of the dicts in a list.
+
+    Returns a dict mapping each requested key to ``None`` if the whole
+    value was requested or to the set of requested sub-keys, or ``None`` if
+    no fields were given.
+
+    '''
+    if not fields:
+        return None
+    if isinstance(fields, basestring):
+        fields = [fields]
+    parsed = {}
+    for field in fields:
+        if not isinstance(field, basestring):
+            raise ValidationError(
+                {'fields': ['%s: %s' % (_('Not a string'), field)]})
+        for name in field.split(','):
+            name = name.strip()
+            if not name:
+                continue
+            key, sep, sub_key = name.partition('.')
+            if not sub_key:
+                parsed[key] = None
+            elif parsed.get(key, set()) is not None:
+                parsed.setdefault(key, set()).add(sub_key)
+    return parsed or None
+
+
+def _field_requested(fields, key, sub_key=None):
+    '''Return True if ``key`` (or ``key.sub_key``) is part of the parsed
+    ``fields``, or if no projection was requested.'''
+    if fields is None:
+        return True
+    if key not in fields:
+        return False
+    return sub_key is None or fields[key] is None or sub_key in fields[key]
+
+
+def _project_dict(data_dict, fields):
+    '''Return a copy of ``data_dict`` with only the parsed ``fields``.'''
+    if fields is None:
+        return data_dict
+    projected = {}
+    for key, sub_keys in fields.iteritems():
+        if key not in data_dict:
+            continue
+        value = data_dict[key]
+        if sub_keys is not None:
+            if isinstance(value, list):
+                value = [dict((k, v) for k, v in item.iteritems()
+                              if k in sub_keys)
+                         if isinstance(item, dict) else item
+                         for item in value]
+            elif isinstance(value, dict):
+                value = dict((k, v) for k, v in value.iteritems()
+                             if k in sub_keys)
+        projected[key] = value
+    return projected
+
+
 def site_read(context, data_dict=None):
     '''Return ``True``.
 
@@ -897,6 +983,11 @@ def package_show(context, data_dict):
     :param use_default_schema: use default package schema instead of
         a custom schema defined with an IDatasetForm plugin (default: False)
     :type use_default_schema: bool
+    :param fields: if given, only these keys of the dataset are returned,
+        e.g. ``['id', 'name', 'resources.url']``. Keys of the dicts in a list
+        like ``resources`` can be selected with a dot. Tracking summaries are
+        only looked up if they are requested (optional)
+    :type fields: list of strings, or a comma-separated string
 
     :rtype: dictionary
 
@@ -904,6 +995,7 @@ def package_show(context, data_dict):
     model = context['model']
     context['session'] = model.Session
     name_or_id = data_dict.get("id") or _get_or_bust(data_dict, 'name_or_id')
+    fields = _parse_fields(data_dict.get('fields'))
 
     pkg = model.Package.get(name_or_id)
 
@@ -949,15 +1041,17 @@ def package_show(context, data_dict):
     # If the package_dict came from the Solr cache then it will already have a
     # potentially outdated tracking_summary, this will overwrite it with a
     # current one.
-    package_dict['tracking_summary'] = model.TrackingSummary.get_for_package(
-        package_dict['id'])
+    if _field_requested(fields, 'tracking_summary'):
+        package_dict['tracking_summary'] = (
+            model.TrackingSummary.get_for_package(package_dict['id']))
 
     # Add page-view tracking summary data to the package's resource dicts.
     # If the package_dict came from the Solr cache then each resource dict will
     # already have a potentially outdated tracking_summary, this will overwrite
     # it with a current one.
-    for resource_dict in package_dict['resources']:
-        _add_tracking_summary_to_resource_dict(resource_dict, model)
+    if _field_requested(fields, 'resources', 'tracking_summary'):
+        _add_tracking_summary_to_resource_dicts(package_dict['resources'],
+                                                model)
 
     if context.get('for_view'):
         for item in plugins.PluginImplementations(plugins.IPackageController):
@@ -966,9 +1060,11 @@ def package_show(context, data_dict):
     for item in plugins.PluginImplementations(plugins.IPackageController):
         item.read(pkg)
 
-    for resource_dict in package_dict['resources']:
-        for item in plugins.PluginImplementations(plugins.IResourceController):
-            resource_dict = item.before_show(resource_dict)
+    if _field_requested(fields, 'resources'):
+        for resource_dict in package_dict['resources']:
+            for item in plugins.PluginImplementations(
+                    plugins.IResourceController):
+                resource_dict = item.before_show(resource_dict)
 
     if not package_dict_validated:
         package_plugin = lib_plugins.lookup_package_plugin(
@@ -985,16 +1081,42 @@ def package_show(context, data_dict):
     for item in plugins.PluginImplementations(plugins.IPackageController):
         item.after_show(context, package_dict)
 
-    return package_dict
+    return _project_dict(package_dict, fields)
+
+
+def _add_tracking_summary_to_resource_dicts(resource_dicts, model):
+    '''Add page-view tracking summary data to the given resource dicts,
+    looking up the summaries of all of them with one query.
+
+    '''
+    summaries = model.TrackingSummary.get_for_resources(
+        set(resource_dict['url'] for resource_dict in resource_dicts))
+    for resource_dict in resource_dicts:
+        resource_dict['tracking_summary'] = summaries[resource_dict['url']]
 
 
-def _add_tracking_summary_to_resource_dict(resource_dict, model):
-    '''Add page-view tracking summary data to the given resource dict.
+def _refresh_tracking_summaries(package_dicts, model):
+    '''Replace the tracking summaries in the given package dicts, and in
+    their resource dicts, with current ones.
+
+    Dicts without a ``tracking_summary`` key are left alone. All the
+    summaries are looked up with two queries.
 
     '''
-    tracking_summary = model.TrackingSummary.get_for_resource(
-        resource_dict['url'])
-    resource_dict['tracking_summary'] = tracking_summary
+    package_dicts = [package_dict for package_dict in package_dicts
+                     if 'id' in package_dict]
+    summaries = model.TrackingSummary.get_for_packages(
+        [package_dict['id'] for package_dict in package_dicts
+         if 'tracking_summary' in package_dict])
+    resource_dicts = []
+    for package_dict in package_dicts:
+        if package_dict['id'] in summaries:
+            package_dict['tracking_summary'] = summaries[package_dict['id']]
+        resource_dicts.extend(
+            resource_dict for resource_dict
+            in package_dict.get('resources', [])
+            if 'tracking_summary' in resource_dict and 'url' in resource_dict)
+    _add_tracking_summary_to_resource_dicts(resource_dicts, model)
 
 
 def resource_show(context, data_dict):
@@ -1597,6 +1719,13 @@ def package_search(context, data_dict):
     :param use_default_schema: use default package schema instead of
         a custom schema defined with an IDatasetForm plugin (default: False)
     :type use_default_schema: bool
+    :param fields: if given, only these keys of each dataset are returned,
+        e.g. ``['id', 'name', 'metadata_modified']``. Keys of the dicts in
+        a list like ``resources`` can be selected with a dot, e.g.
+        ``resources.url``. If only simple fields stored in the search index
+        are requested they are read directly from it, without loading the
+        full datasets (optional)
+    :type fields: list of strings, or a comma-separated string
 
     An example result: ::
 
@@ -1620,7 +1749,8 @@ def package_search(context, data_dict):
     fl
         The parameter that controls which fields are returned in the solr
         query cannot be changed.  CKAN always returns the matched datasets as
-        dictionary objects.
+        dictionary objects. Use the ``fields`` parameter to return only some
+        of their keys.
     '''
     # sometimes context['schema'] is None
     schema = (context.get('schema') or
@@ -1638,6 +1768,13 @@ def package_search(context, data_dict):
 
     _check_access('package_search', context, data_dict)
 
+    fields = _parse_fields(data_dict.pop('fields', None))
+    # If only stored fields are requested, read them straight from Solr
+    # rather than loading the whole dataset dicts.
+    solr_fields = (fields is not None and
+                   all(sub_keys is None for sub_keys in fields.values()) and
+                   set(fields) <= _SOLR_STORED_PACKAGE_FIELDS)
+
     # Move ext_ params to extras and remove them from the root of the search
     # params, so they don't cause and error
     data_dict['extras'] = data_dict.get('extras', {})
@@ -1658,8 +1795,13 @@ def package_search(context, data_dict):
     results = []
     if not abort:
         data_source = 'data_dict' if data_dict.get('use_default_schema') else 'validated_data_dict'
-        # return a list of package ids
-        data_dict['fl'] = 'id {0}'.format(data_source)
+        if solr_fields:
+            # always ask for more than one field, as query.run() returns a
+            # list of strings rather than dicts for just 'id' or 'name'
+            data_dict['fl'] = ' '.join(set(['id', 'name']) | set(fields))
+        else:
+            # return a list of package ids
+            data_dict['fl'] = 'id {0}'.format(data_source)
 
         # If this query hasn't come from a controller that has set this flag
         # then we should remove any mention of capacity from the fq and
@@ -1679,9 +1821,10 @@ def package_search(context, data_dict):
         # Add them back so extensions can use them on after_search
         data_dict['extras'] = extras
 
-        for package in query.results:
+        for package_solr_dict in query.results:
             # get the package object
-            package, package_dict = package['id'], package.get(data_source)
+            package = package_solr_dict['id']
+            package_dict = package_solr_dict.get(data_source)
             pkg_query = session.query(model.Package)\
                 .filter(model.Package.id == package)\
                 .filter(model.Package.state == u'active')
@@ -1693,6 +1836,12 @@ def package_search(context, data_dict):
                 log.warning('package %s in index but not in database'
                             % package)
                 continue
+            if solr_fields:
+                # Solr leaves out the fields that aren't set
+                result = dict((key, package_solr_dict.get(key))
+                              for key in fields)
+                results.append(result)
+                continue
             ## use data in search index if there
             if package_dict:
                 ## the package_dict still needs translating when being viewed
@@ -1701,9 +1850,16 @@ def package_search(context, data_dict):
                     for item in plugins.PluginImplementations(
                             plugins.IPackageController):
                         package_dict = item.before_view(package_dict)
-                results.append(package_dict)
+                results.append(_project_dict(package_dict, fields))
             else:
-                results.append(model_dictize.package_dictize(pkg, context))
+                results.append(_project_dict(
+                    model_dictize.package_dictize(pkg, context), fields))
+
+        # The tracking summaries stored in the index are only as recent as
+        # the last time each dataset was indexed
+        if (asbool(config.get('ckan.tracking_enabled', False)) and
+                not solr_fields):
+            _refresh_tracking_summaries(results, model)
 
         count = query.count
         facets = query.facets
@@ -2270,6 +2426,30 @@ def status_show(context, data_dict):
     }
 
 
+def action_instrumentation_show(context, data_dict):
+    '''Return timing statistics for the site's action functions.
+
+    Statistics are only collected when the
+    :ref:`ckan.instrumentation.enabled` config option is set. Only sysadmins
+    can call this action.
+
+    The result is a dictionary with the keys ``enabled``, ``since`` (the
+    time the statistics were last reset, in seconds since the epoch),
+    ``actions`` and ``slow_calls``. ``actions`` is keyed by action name and
+    holds the number of calls, total, mean and maximum latency (in
+    milliseconds), a latency histogram, the number of SQL statements and
+    Solr requests issued and the actions called from and by the action.
+    ``slow_calls`` lists the call trees of the most recent top-level calls
+    that took longer than :ref:`ckan.instrumentation.slow_threshold`.
+
+    :rtype: dictionary
+
+    '''
+    _check_access('action_instrumentation_show', context, data_dict)
+
+    return instrumentation.get_stats()
+
+
 def vocabulary_list(context, data_dict):
     '''Return a list of all the site's tag vocabularies.
 
@@ -2321,6 +2501,11 @@ def user_activity_list(context, data_dict):
         (optional, default: 31, the default value is configurable via the
         ckan.activity_list_limit setting)
     :type limit: int
+    :param before: the id of an activity, to get the activities that come
+        after it in the activity stream (optional). Pass the id of the last
+        activity of a page to get the next page, which unlike ``offset``
+        takes the same time however far into the activity stream it is
+    :type before: string
 
     :rtype: list of dictionaries
 
@@ -2340,10 +2525,11 @@ def user_activity_list(context, data_dict):
     limit = int(
         data_dict.get('limit', config.get('ckan.activity_list_limit', 31)))
 
-    _activity_objects = model.activity.user_activity_list(user.id, limit=limit,
-            offset=offset)
-    activity_objects = _filter_activity_by_user(_activity_objects,
-            _activity_stream_get_filtered_users())
+    _activity_objects = model.activity.user_activity_list(
+        user.id, limit=limit, offset=offset,
+        before=_activity_list_before(context, data_dict))
+    activity_objects = _filter_activity_by_user(
+        _activity_objects, _activity_stream_get_filtered_users())
 
     return model_dictize.activity_list_dictize(activity_objects, context)
 
@@ -2363,6 +2549,11 @@ def package_activity_list(context, data_dict):
         (optional, default: 31, the default value is configurable via the
         ckan.activity_list_limit setting)
     :type limit: int
+    :param before: the id of an activity, to get the activities that come
+        after it in the activity stream (optional). Pass the id of the last
+        activity of a page to get the next page, which unlike ``offset``
+        takes the same time however far into the activity stream it is
+    :type before: string
 
     :rtype: list of dictionaries
 
@@ -2382,10 +2573,11 @@ def package_activity_list(context, data_dict):
     limit = int(
         data_dict.get('limit', config.get('ckan.activity_list_limit', 31)))
 
-    _activity_objects = model.activity.package_activity_list(package.id,
-            limit=limit, offset=offset)
-    activity_objects = _filter_activity_by_user(_activity_objects,
-            _activity_stream_get_filtered_users())
+    _activity_objects = model.activity.package_activity_list(
+        package.id, limit=limit, offset=offset,
+        before=_activity_list_before(context, data_dict))
+    activity_objects = _filter_activity_by_user(
+        _activity_objects, _activity_stream_get_filtered_users())
 
     return model_dictize.activity_list_dictize(activity_objects, context)
 
@@ -2405,6 +2597,11 @@ def group_activity_list(context, data_dict):
         (optional, default: 31, the default value is configurable via the
         ckan.activity_list_limit setting)
     :type limit: int
+    :param before: the id of an activity, to get the activities that come
+        after it in the activity stream (optional). Pass the id of the last
+        activity of a page to get the next page, which unlike ``offset``
+        takes the same time however far into the activity stream it is
+    :type before: string
 
     :rtype: list of dictionaries
 
@@ -2423,10 +2620,11 @@ def group_activity_list(context, data_dict):
     group_show = logic.get_action('group_show')
     group_id = group_show(context, {'id': group_id})['id']
 
-    _activity_objects = model.activity.group_activity_list(group_id,
-            limit=limit, offset=offset)
-    activity_objects = _filter_activity_by_user(_activity_objects,
-            _activity_stream_get_filtered_users())
+    _activity_objects = model.activity.group_activity_list(
+        group_id, limit=limit, offset=offset,
+        before=_activity_list_before(context, data_dict))
+    activity_objects = _filter_activity_by_user(
+        _activity_objects, _activity_stream_get_filtered_users())
 
     return model_dictize.activity_list_dictize(activity_objects, context)
 
@@ -2437,6 +2635,11 @@ def organization_activity_list(context, data_dict):
 
     :param id: the id or name of the organization
     :type id: string
+    :param before: the id of an activity, to get the activities that come
+        after it in the activity stream (optional). Pass the id of the last
+        activity of a page to get the next page, which unlike ``offset``
+        takes the same time however far into the activity stream it is
+    :type before: string
 
     :rtype: list of dictionaries
 
@@ -2455,15 +2658,16 @@ def organization_activity_list(context, data_dict):
     org_show = logic.get_action('organization_show')
     org_id = org_show(context, {'id': org_id})['id']
 
-    _activity_objects = model.activity.group_activity_list(org_id,
-            limit=limit, offset=offset)
-    activity_objects = _filter_activity_by_user(_activity_objects,
-            _activity_stream_get_filtered_users())
+    _activity_objects = model.activity.group_activity_list(
+        org_id, limit=limit, offset=offset,
+        before=_activity_list_before(context, data_dict))
+    activity_objects = _filter_activity_by_user(
+        _activity_objects, _activity_stream_get_filtered_users())
 
     return model_dictize.activity_list_dictize(activity_objects, context)
 
 
-@logic.validate(logic.schema.default_pagination_schema)
+@logic.validate(logic.schema.default_activity_pagination_schema)
 def recently_changed_packages_activity_list(context, data_dict):
     '''Return the activity stream of all recently added or changed packages.
 
@@ -2474,6 +2678,11 @@ def recently_changed_packages_activity_list(context, data_dict):
         (optional, default: 31, the default value is configurable via the
         ckan.activity_list_limit setting)
     :type limit: int
+    :param before: the id of an activity, to get the activities that come
+        after it in the activity stream (optional). Pass the id of the last
+        activity of a page to get the next page, which unlike ``offset``
+        takes the same time however far into the activity stream it is
+    :type before: string
 
     :rtype: list of dictionaries
 
@@ -2486,7 +2695,8 @@ def recently_changed_packages_activity_list(context, data_dict):
         data_dict.get('limit', config.get('ckan.activity_list_limit', 31)))
 
     _activity_objects = model.activity.recently_changed_packages_activity_list(
-            limit=limit, offset=offset)
+            limit=limit, offset=offset,
+            before=_activity_list_before(context, data_dict))
     activity_objects = _filter_activity_by_user(_activity_objects,
             _activity_stream_get_filtered_users())
 
@@ -2510,6 +2720,28 @@ def activity_detail_list(context, data_dict):
         activity_detail_objects, context)
 
 
+def activity_data_show(context, data_dict):
+    '''Return the full data of an activity.
+
+    When :ref:`ckan.activity_streams_compact_data` is set, package
+    activities store only the few dataset fields that activity streams show.
+    This returns their data with the dataset as it was at the time of the
+    activity, rebuilt from its revision.
+
+    :param id: the id of the activity
+    :type id: string
+    :rtype: dictionary
+
+    '''
+    model = context['model']
+    activity_id = _get_or_bust(data_dict, 'id')
+    activity = model.Session.query(model.Activity).get(activity_id)
+    if activity is None:
+        raise NotFound
+    _check_access('activity_data_show', context, data_dict)
+    return model.activity.expand_data(activity.data)
+
+
 def user_activity_list_html(context, data_dict):
     '''Return a user's public activity stream as HTML.
 
@@ -3131,7 +3363,7 @@ def _group_or_org_followee_list(context, data_dict, is_org=False):
     return [model_dictize.group_dictize(group, context) for group in groups]
 
 
-@logic.validate(logic.schema.default_pagination_schema)
+@logic.validate(logic.schema.default_activity_pagination_schema)
 def dashboard_activity_list(context, data_dict):
     '''Return the authorized user's dashboard activity stream.
 
@@ -3148,6 +3380,11 @@ def dashboard_activity_list(context, data_dict):
     :param limit: the maximum number of activities to return
         (optional, default: 31, the default value is configurable via the
         :ref:`ckan.activity_list_limit` setting)
+    :param before: the id of an activity, to get the activities that come
+        after it in the activity stream (optional). Pass the id of the last
+        activity of a page to get the next page, which unlike ``offset``
+        takes the same time however far into the activity stream it is
+    :type before: string
 
     :rtype: list of activity dictionaries
 
@@ -3162,8 +3399,9 @@ def dashboard_activity_list(context, data_dict):
 
     # FIXME: Filter out activities whose subject or object the user is not
     # authorized to read.
-    _activity_objects = model.activity.dashboard_activity_list(user_id,
-            limit=limit, offset=offset)
+    _activity_objects = model.activity.dashboard_activity_list(
+        user_id, limit=limit, offset=offset,
+        before=_activity_list_before(context, data_dict))
 
     activity_objects = _filter_activity_by_user(_activity_objects,
             _activity_stream_get_filtered_users())
@@ -3231,9 +3469,13 @@ def dashboard_new_activities_count(context, data_dict):
 
     '''
     _check_access('dashboard_new_activities_count', context, data_dict)
-    activities = logic.get_action('dashboard_activity_list')(
-        context, data_dict)
-    return len([activity for activity in activities if activity['is_new']])
+    model = context['model']
+    user_id = model.User.get(context['user']).id
+    limit = int(
+        data_dict.get('limit', config.get('ckan.activity_list_limit', 31)))
+    last_viewed = model.Dashboard.get(user_id).activity_stream_last_viewed
+    return model.activity.dashboard_new_activities_count(
+        user_id, last_viewed, limit, _activity_stream_get_filtered_users())
 
 
 def _unpick_search(sort, allowed_fields=None, total=None):
@@ -1,12 +1,29 @@
 '''API functions for partial updates of existing data in CKAN'''
 
+import datetime as _datetime
+
+from pylons import config as _config
+import paste.deploy.converters as _converters
+
+import ckan.lib.plugins as _lib_plugins
+import ckan.lib.dictization.model_save as _model_save
+import ckan.lib.navl.dictization_functions as _df
 import ckan.logic.action.update as _update
+from ckan.common import _
 from ckan.logic import (
     get_action as _get_action,
     check_access as _check_access,
     get_or_bust as _get_or_bust,
+    ValidationError as _ValidationError,
 )
 
+# The dataset fields package_patch can validate and save on their own, when
+# ckan.fast_package_patch is enabled
+_FAST_PATCH_FIELDS = frozenset([
+    'name', 'title', 'author', 'author_email', 'maintainer',
+    'maintainer_email', 'license_id', 'notes', 'url', 'version', 'private',
+    'extras'])
+
 
 def package_patch(context, data_dict):
     '''Patch a dataset (package).
@@ -21,9 +38,22 @@ def package_patch(context, data_dict):
 
     You must be authorized to edit the dataset and the groups that it belongs
     to.
+
+    If :ref:`ckan.fast_package_patch` is enabled and only the dataset's own
+    fields or its extras are patched, only those are validated and saved,
+    instead of the whole dataset.
     '''
     _check_access('package_patch', context, data_dict)
 
+    if _fast_package_patch():
+        package = context['model'].Package.get(_get_or_bust(data_dict, 'id'))
+        patch = dict((key, value) for key, value in data_dict.items()
+                     if key != 'id')
+        if package and set(patch) <= _FAST_PATCH_FIELDS:
+            schema = _fast_patch_schema(context, package, patch)
+            if schema:
+                return _package_patch_fast(context, package, patch, schema)
+
     show_context = {
         'model': context['model'],
         'session': context['session'],
@@ -41,6 +71,77 @@ def package_patch(context, data_dict):
     return _update.package_update(context, patched)
 
 
+def _fast_package_patch():
+    return _converters.asbool(_config.get('ckan.fast_package_patch', False))
+
+
+def _fast_patch_schema(context, package, patch):
+    '''Return the schema that validates only the patched fields of
+    ``package``, or None if the dataset's schema doesn't have them all.'''
+    if 'schema' in context:
+        full_schema = context['schema']
+    else:
+        package_plugin = _lib_plugins.lookup_package_plugin(package.type)
+        full_schema = package_plugin.update_package_schema()
+
+    if not set(patch) <= set(full_schema):
+        return None
+
+    # The fields that aren't patched are validated as they are, since some
+    # validators look at them, e.g. private at owner_org
+    schema = dict((key, []) for key in
+                  context['model'].package_table.c.keys())
+    schema.update((key, value) for key, value in full_schema.items()
+                  if key in patch or key.startswith('__'))
+    return schema
+
+
+def _package_patch_fast(context, package, patch, schema):
+    model = context['model']
+    user = context['user']
+    context['package'] = package
+
+    data = dict((key, getattr(package, key))
+                for key in model.package_table.c.keys())
+    data.update(patch)
+    data, errors = _df.validate(data, schema, context)
+    if errors:
+        model.Session.rollback()
+        raise _ValidationError(errors)
+
+    rev = model.repo.new_revision()
+    rev.author = user
+    if 'message' in context:
+        rev.message = context['message']
+    else:
+        rev.message = _(u'REST API: Update object %s') % package.name
+
+    #avoid revisioning by updating directly
+    model.Session.query(model.Package).filter_by(id=package.id).update(
+        {"metadata_modified": _datetime.datetime.utcnow()})
+    model.Session.refresh(package)
+
+    # only the patched fields are written, and only if they change
+    for key in patch:
+        if key == 'extras':
+            _model_save.package_extras_save(data.get('extras'), package,
+                                            context)
+        elif key in data and getattr(package, key) != data[key]:
+            setattr(package, key, data[key])
+
+    # the dataset is reindexed once, when this is committed
+    model.repo.commit()
+
+    # Make sure that a user provided schema is not used on package_show
+    context.pop('schema', None)
+
+    # we could update the dataset so we should still be able to read it.
+    context['ignore_auth'] = True
+    if context.get('return_id_only', False):
+        return package.id
+    return _get_action('package_show')(context, {'id': package.id})
+
+
 def resource_patch(context, data_dict):
     '''Patch a resource
 
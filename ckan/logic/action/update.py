@@ -2,10 +2,10 @@
 
 import logging
 import datetime
-import json
 
 from pylons import config
 import paste.deploy.converters as converters
+import sqlalchemy.exc
 
 import ckan.plugins as plugins
 import ckan.logic as logic
@@ -17,6 +17,7 @@ import ckan.lib.navl.dictization_functions
 import ckan.lib.navl.validators as validators
 import ckan.lib.plugins as lib_plugins
 import ckan.lib.email_notifications as email_notifications
+import ckan.lib.identity_cache as identity_cache
 import ckan.lib.search as search
 import ckan.lib.uploader as uploader
 import ckan.lib.datapreview
@@ -102,6 +103,81 @@ def related_update(context, data_dict):
     return model_dictize.related_dictize(related, context)
 
 
+def _fast_resource_writes():
+    '''Whether resource_create and resource_update save just the resource,
+    see _save_resource().'''
+    return converters.asbool(config.get('ckan.fast_resource_writes', False))
+
+
+def _save_resource(context, data_dict, package, resource=None):
+    '''Validate and save ``resource``, one of the resources of ``package``,
+    or a new resource of ``package`` if it is None.
+
+    Unlike package_update, which resource_create and resource_update use
+    otherwise, this validates and saves only the resource's own row, against
+    the resources part of the dataset type's update schema, and bumps the
+    dataset's metadata_modified. Committing then creates one revision and
+    reindexes the dataset once. The IPackageController hooks are not called.
+
+    Returns the saved resource object.
+
+    '''
+    model = context['model']
+    session = context['session']
+
+    if 'schema' in context:
+        schema = context['schema']
+    else:
+        package_plugin = lib_plugins.lookup_package_plugin(package.type)
+        schema = package_plugin.update_package_schema()
+    data, errors = _validate(data_dict, schema['resources'], context)
+    # resource_dict_save would overwrite any resource with the given id,
+    # even one of another dataset
+    if (resource is None and data.get('id') and
+            session.query(model.Resource).get(data['id'])):
+        errors['id'] = [_('Resource id already exists')]
+    if errors:
+        session.rollback()
+        raise ValidationError(errors)
+
+    rev = model.repo.new_revision()
+    rev.author = context['user']
+    if 'message' in context:
+        rev.message = context['message']
+    else:
+        rev.message = _(u'REST API: Update object %s') % package.name
+
+    #avoid revisioning by updating directly. This also locks the dataset's
+    #row until the commit, so that concurrent creates in the same dataset
+    #count its resources one after the other
+    session.query(model.Package).filter_by(id=package.id).update(
+        {"metadata_modified": datetime.datetime.utcnow()})
+
+    if resource is None:
+        # A new resource goes at the end of the dataset's resources, which
+        # aren't loaded
+        position = session.query(model.Resource).filter_by(
+            package_id=package.id).count()
+        resource = model_save.resource_dict_save(data, context)
+        resource.package_id = package.id
+        resource.position = position
+    else:
+        data['id'] = resource.id
+        resource = model_save.resource_dict_save(data, context)
+    session.flush()
+    # Its metadata_modified and resources have changed behind its back
+    session.expire(package)
+    return resource
+
+
+def _add_default_views_to_resource(context, resource_id):
+    if ckan.lib.datapreview.get_default_view_plugins():
+        resource_dict = _get_action('resource_show')(context,
+                                                     {'id': resource_id})
+        ckan.lib.datapreview.add_default_views_to_resource(context,
+                                                           resource_dict)
+
+
 def resource_update(context, data_dict):
     '''Update a resource.
 
@@ -132,6 +208,9 @@ def resource_update(context, data_dict):
     _check_access('resource_update', context, data_dict)
     del context["resource"]
 
+    if _fast_resource_writes():
+        return _resource_update_fast(context, data_dict, resource)
+
     package_id = resource.package.id
     pkg_dict = _get_action('package_show')(context, {'id': package_id})
 
@@ -169,6 +248,30 @@ def resource_update(context, data_dict):
     return resource
 
 
+def _resource_update_fast(context, data_dict, resource):
+    model = context['model']
+    id = resource.id
+
+    current = _get_action('resource_show')(context, {'id': id})
+    for plugin in plugins.PluginImplementations(plugins.IResourceController):
+        plugin.before_update(context, current, data_dict)
+
+    upload = uploader.ResourceUpload(data_dict)
+
+    _save_resource(context, data_dict, resource.package, resource)
+
+    upload.upload(id, uploader.get_max_resource_size())
+    model.repo.commit()
+
+    _add_default_views_to_resource(context, id)
+    resource = _get_action('resource_show')(context, {'id': id})
+
+    for plugin in plugins.PluginImplementations(plugins.IResourceController):
+        plugin.after_update(context, resource)
+
+    return resource
+
+
 def resource_view_update(context, data_dict):
     '''Update a resource view.
 
@@ -286,7 +389,44 @@ def package_update(context, data_dict):
     '''
     model = context['model']
     user = context['user']
-    name_or_id = data_dict.get("id") or data_dict['name']
+
+    data, errors = _package_update_validate(context, data_dict)
+
+    if errors:
+        model.Session.rollback()
+        raise ValidationError(errors)
+
+    rev = model.repo.new_revision()
+    rev.author = user
+    if 'message' in context:
+        rev.message = context['message']
+    else:
+        rev.message = _(u'REST API: Update object %s') % data.get("name")
+
+    _package_update_save(context, data)
+
+    return_id_only = context.get('return_id_only', False)
+
+    # Make sure that a user provided schema is not used on package_show
+    context.pop('schema', None)
+
+    # we could update the dataset so we should still be able to read it.
+    context['ignore_auth'] = True
+    output = data_dict['id'] if return_id_only \
+            else _get_action('package_show')(context, {'id': data_dict['id']})
+
+    return output
+
+
+def _package_update_validate(context, data_dict):
+    '''Check that the user may update the dataset and validate it.
+
+    Sets ``context['package']`` and returns the validated data and the
+    validation errors.
+
+    '''
+    model = context['model']
+    name_or_id = data_dict.get("id") or _get_or_bust(data_dict, 'name')
 
     pkg = model.Package.get(name_or_id)
     if pkg is None:
@@ -324,16 +464,14 @@ def package_update(context, data_dict):
               context.get('package').name if context.get('package') else '',
               data)
 
-    if errors:
-        model.Session.rollback()
-        raise ValidationError(errors)
+    return data, errors
 
-    rev = model.repo.new_revision()
-    rev.author = user
-    if 'message' in context:
-        rev.message = context['message']
-    else:
-        rev.message = _(u'REST API: Update object %s') % data.get("name")
+
+def _package_update_save(context, data):
+    '''Save the validated ``data`` to ``context['package']`` in the current
+    revision, and return the dataset.'''
+    model = context['model']
+    pkg = context['package']
 
     #avoid revisioning by updating directly
     model.Session.query(model.Package).filter_by(id=pkg.id).update(
@@ -370,17 +508,134 @@ def package_update(context, data_dict):
 
     log.debug('Updated object %s' % pkg.name)
 
-    return_id_only = context.get('return_id_only', False)
+    return pkg
 
-    # Make sure that a user provided schema is not used on package_show
-    context.pop('schema', None)
 
-    # we could update the dataset so we should still be able to read it.
-    context['ignore_auth'] = True
-    output = data_dict['id'] if return_id_only \
-            else _get_action('package_show')(context, {'id': data_dict['id']})
+def package_update_many(context, data_dict):
+    '''Update many datasets at once.
 
-    return output
+    All the datasets are validated first. The valid ones are then saved,
+    ``chunk_size`` of them in each database transaction, and sent to the
+    search index together at the end, which is much faster than calling
+    :py:func:`package_update` for each of them, e.g. when harvesting.
+
+    :param datasets: the datasets to update, see :py:func:`package_update`
+        for the format of each one
+    :type datasets: list of dictionaries
+    :param chunk_size: the number of datasets saved in each transaction
+        (optional, default: all of them are saved in a single transaction)
+    :type chunk_size: int
+
+    :returns: one dictionary for each dataset, in the same order, with a
+        ``success`` key and either a ``result`` with the ``id`` and ``name``
+        of the dataset or an ``error`` like the ones the action API returns
+    :rtype: list of dictionaries
+
+    '''
+    _check_access('package_update_many', context, data_dict)
+    return _package_save_many(context, data_dict, _package_update_validate,
+                              _package_update_save,
+                              _(u'REST API: Update objects'))
+
+
+def _package_save_many(context, data_dict, validate, save, message):
+    '''Validate and save many datasets with the ``validate`` and ``save``
+    halves of :py:func:`package_update` or
+    :py:func:`~ckan.logic.action.create.package_create`.
+
+    See :py:func:`package_update_many`.
+
+    '''
+    model = context['model']
+    user = context['user']
+
+    datasets = _get_or_bust(data_dict, 'datasets')
+    if not isinstance(datasets, list) or not all(
+            isinstance(dataset, dict) for dataset in datasets):
+        raise ValidationError(
+            {'datasets': [_('Must be a list of dictionaries')]})
+    try:
+        chunk_size = int(data_dict.get('chunk_size') or len(datasets) or 1)
+    except (TypeError, ValueError):
+        chunk_size = 0
+    if chunk_size < 1:
+        raise ValidationError(
+            {'chunk_size': [_('Must be a positive integer')]})
+
+    results = [None] * len(datasets)
+    valid = []
+    names = set()
+    for index, dataset in enumerate(datasets):
+        item_context = context.copy()
+        item_context['defer_commit'] = True
+        try:
+            data, errors = validate(item_context, dataset)
+        except logic.NotAuthorized, e:
+            error = {'__type': 'Authorization Error',
+                     'message': _('Access denied')}
+            if unicode(e):
+                error['message'] += u': %s' % e
+            results[index] = {'success': False, 'error': error}
+            continue
+        except NotFound, e:
+            error = {'__type': 'Not Found Error', 'message': _('Not found')}
+            if unicode(e):
+                error['message'] += u': %s' % e
+            results[index] = {'success': False, 'error': error}
+            continue
+        except ValidationError, e:
+            data, errors = None, dict(e.error_dict)
+        except ckan.lib.navl.dictization_functions.DataError, e:
+            data, errors = None, {'message': e.error}
+
+        # Datasets in the same batch can't see each other's names
+        if not errors and data.get('name') in names:
+            errors = {'name': [_('That URL is already in use.')]}
+        if errors:
+            errors['__type'] = 'Validation Error'
+            results[index] = {'success': False, 'error': errors}
+            continue
+        names.add(data.get('name'))
+        valid.append((index, item_context, data))
+
+    search.defer_indexing()
+    try:
+        for start in range(0, len(valid), chunk_size):
+            chunk = valid[start:start + chunk_size]
+            rev = model.repo.new_revision()
+            rev.author = user
+            rev.message = context.get('message', message)
+            try:
+                packages = [save(item_context, data)
+                            for index, item_context, data in chunk]
+                model.repo.commit()
+            except Exception, e:
+                # e.g. a database error, a resource view that doesn't
+                # validate or a failing plugin hook. The rest of the chunk
+                # goes too, but the other chunks are still saved.
+                model.Session.rollback()
+                log.exception('Could not save datasets')
+                if isinstance(e, sqlalchemy.exc.DBAPIError):
+                    error_type, reason = 'Integrity Error', e.orig
+                elif isinstance(e, ValidationError):
+                    error_type = 'Validation Error'
+                    reason = ', '.join('%s: %s' % item for item in
+                                       e.error_summary.items())
+                else:
+                    error_type, reason = 'Internal Error', e
+                for index, item_context, data in chunk:
+                    results[index] = {'success': False, 'error': {
+                        '__type': error_type,
+                        'message': _('The datasets saved with this one '
+                                     'could not be saved: %s') % reason}}
+                continue
+            for (index, item_context, data), pkg in zip(chunk, packages):
+                results[index] = {'success': True,
+                                  'result': {'id': pkg.id, 'name': pkg.name}}
+    finally:
+        search.index_deferred()
+
+    return results
 
 def package_resource_reorder(context, data_dict):
     '''Reorder resources against datasets.  If only partial resource ids are
@@ -711,6 +966,8 @@ def user_update(context, data_dict):
 
     if not context.get('defer_commit'):
         model.repo.commit()
+    # This also covers user_generate_apikey, which calls user_update
+    identity_cache.invalidate_user(user.id)
     return model_dictize.user_dictize(user, context)
 
 
@@ -1220,54 +1477,27 @@ def _bulk_update_dataset(context, data_dict, update_dict):
 
     model = context['model']
 
-    model.Session.query(model.package_table) \
-        .filter(model.Package.id.in_(datasets)) \
-        .filter(model.Package.owner_org == org_id) \
-        .update(update_dict, synchronize_session=False)
+    if not datasets:
+        return
 
-    # revisions
-    model.Session.query(model.package_table) \
-        .filter(model.Package.id.in_(datasets)) \
-        .filter(model.Package.owner_org == org_id) \
-        .update(update_dict, synchronize_session=False)
+    package_table = model.package_table
+    result = model.Session.execute(
+        package_table.update()
+        .where(sqlalchemy.and_(package_table.c.id.in_(datasets),
+                               package_table.c.owner_org == org_id))
+        .values(**update_dict)
+        .returning(package_table.c.id))
+    package_ids = [row[0] for row in result]
 
     model.Session.commit()
 
-    # solr update here
+    # update the solr index in a single request, with a single commit
     psi = search.PackageSearchIndex()
-
-    # update the solr index in batches
-    BATCH_SIZE = 50
-
-    def process_solr(q):
-        # update the solr index for the query
-        query = search.PackageSearchQuery()
-        q = {
-            'q': q,
-            'fl': 'data_dict',
-            'wt': 'json',
-            'fq': 'site_id:"%s"' % config.get('ckan.site_id'),
-            'rows': BATCH_SIZE
-        }
-
-        for result in query.run(q)['results']:
-            data_dict = json.loads(result['data_dict'])
-            if data_dict['owner_org'] == org_id:
-                data_dict.update(update_dict)
-                psi.index_package(data_dict, defer_commit=True)
-
-    count = 0
-    q = []
-    for id in datasets:
-        q.append('id:"%s"' % (id))
-        count += 1
-        if count % BATCH_SIZE == 0:
-            process_solr(' OR '.join(q))
-            q = []
-    if len(q):
-        process_solr(' OR '.join(q))
-    # finally commit the changes
-    psi.commit()
+    if update_dict.get('state', 'active') != 'active':
+        # only active datasets are indexed
+        psi.delete_packages(package_ids)
+    else:
+        psi.update_fields(package_ids, update_dict)
 
 
 def bulk_update_private(context, data_dict):
@@ -220,10 +220,27 @@ def get_site_user(context, data_dict):
             'msg': 'Only internal services allowed to use this action'}
 
 
+def action_instrumentation_show(context, data_dict):
+    # sysadmins only
+    return {'success': False}
+
+
 def member_roles_list(context, data_dict):
     return {'success': True}
 
 
+def activity_data_show(context, data_dict):
+    # The data of a dataset's activities is as private as the dataset
+    model = context['model']
+    activity = model.Session.query(model.Activity).get(data_dict['id'])
+    if activity is None:
+        raise logic.NotFound(_('Activity not found'))
+    if 'package' in activity.activity_type:
+        return new_authz.is_authorized('package_show', context,
+                                       {'id': activity.object_id})
+    return {'success': True}
+
+
 def dashboard_activity_list(context, data_dict):
     # FIXME: context['user'] could be an IP address but that case is not
     # handled here. Maybe add an auth helper function like is_logged_in().
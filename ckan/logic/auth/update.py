@@ -45,6 +45,12 @@ def package_update(context, data_dict):
 
     return {'success': True}
 
+
+@logic.auth_allow_anonymous_access
+def package_update_many(context, data_dict):
+    # Each dataset is checked with package_update
+    return {'success': True}
+
 def package_resource_reorder(context, data_dict):
     ## the action function runs package update so no need to run it twice
     return {'success': True}
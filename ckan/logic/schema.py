@@ -42,6 +42,7 @@ from ckan.logic.validators import (package_id_not_changed,
                                    user_id_or_name_exists,
                                    object_id_validator,
                                    activity_type_exists,
+                                   activity_id_exists,
                                    resource_id_exists,
                                    tag_not_in_vocabulary,
                                    group_id_exists,
@@ -571,14 +572,20 @@ def default_pagination_schema():
     return schema
 
 
-def default_dashboard_activity_list_schema():
+def default_activity_pagination_schema():
     schema = default_pagination_schema()
+    schema['before'] = [ignore_missing, unicode, activity_id_exists]
+    return schema
+
+
+def default_dashboard_activity_list_schema():
+    schema = default_activity_pagination_schema()
     schema['id'] = [unicode]
     return schema
 
 
 def default_activity_list_schema():
-    schema = default_pagination_schema()
+    schema = default_activity_pagination_schema()
     schema['id'] = [not_missing, unicode]
     return schema
 
@@ -604,6 +611,8 @@ def default_package_search_schema():
         'facet.limit': [ignore_missing, int_validator],
         'facet.field': [ignore_missing, convert_to_json_if_string,
             list_of_strings],
+        'fields': [ignore_missing, convert_to_list_if_string,
+                   list_of_strings],
         'extras': [ignore_missing]  # Not used by Solr, but useful for extensions
     }
     return schema
@@ -260,6 +260,15 @@ def group_id_or_name_exists(reference, context):
         raise Invalid(_('That group name or ID does not exist.'))
     return reference
 
+
+def activity_id_exists(activity_id, context):
+    '''Raises Invalid if there is no activity with the given id.'''
+    model = context['model']
+    session = context['session']
+    if not session.query(model.Activity).get(activity_id):
+        raise Invalid('%s: %s' % (_('Not found'), _('Activity')))
+    return activity_id
+
 def activity_type_exists(activity_type):
     '''Raises Invalid if there is no registered activity renderer for the
     given activity_type. Otherwise returns the given activity_type.
@@ -0,0 +1,28 @@
+def upgrade(migrate_engine):
+    migrate_engine.execute(
+        '''
+        BEGIN;
+        CREATE TABLE tracking_latest (
+            url text NOT NULL,
+            package_id text,
+            tracking_type character varying(10) NOT NULL,
+            running_total int NOT NULL DEFAULT 0,
+            recent_views int NOT NULL DEFAULT 0,
+            tracking_date date,
+            CONSTRAINT tracking_latest_pkey PRIMARY KEY (url)
+        );
+        CREATE INDEX tracking_latest_package_id
+            ON tracking_latest(package_id);
+
+        INSERT INTO tracking_latest
+            (url, package_id, tracking_type, running_total, recent_views,
+             tracking_date)
+        SELECT DISTINCT ON (url)
+            url, package_id, tracking_type, running_total, recent_views,
+            tracking_date
+        FROM tracking_summary
+        ORDER BY url, tracking_date DESC;
+
+        COMMIT;
+        '''
+    )
@@ -0,0 +1,23 @@
+def upgrade(migrate_engine):
+    migrate_engine.execute(
+        '''
+        BEGIN;
+        CREATE TABLE dashboard_activity (
+            user_id text NOT NULL,
+            activity_id text NOT NULL,
+            "timestamp" timestamp without time zone NOT NULL,
+            CONSTRAINT dashboard_activity_pkey
+                PRIMARY KEY (user_id, activity_id),
+            CONSTRAINT dashboard_activity_user_id_fkey FOREIGN KEY (user_id)
+                REFERENCES "user" (id) ON UPDATE CASCADE ON DELETE CASCADE,
+            CONSTRAINT dashboard_activity_activity_id_fkey
+                FOREIGN KEY (activity_id) REFERENCES activity (id)
+                ON UPDATE CASCADE ON DELETE CASCADE
+        );
+        CREATE INDEX idx_dashboard_activity_user_id_timestamp
+            ON dashboard_activity (user_id, "timestamp" DESC);
+        CREATE INDEX idx_dashboard_activity_activity_id
+            ON dashboard_activity (activity_id);
+        COMMIT;
+        '''
+    )
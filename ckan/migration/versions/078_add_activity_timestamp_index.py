@@ -0,0 +1,8 @@
+def upgrade(migrate_engine):
+    migrate_engine.execute(
+        '''
+        BEGIN;
+        CREATE INDEX idx_activity_timestamp ON activity ("timestamp");
+        COMMIT;
+        '''
+    )
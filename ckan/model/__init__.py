@@ -101,7 +101,8 @@ from resource_view import (
 from tracking import (
     tracking_summary_table,
     TrackingSummary,
-    tracking_raw_table
+    tracking_raw_table,
+    tracking_latest_table,
 )
 from rating import (
     Rating,
@@ -133,6 +134,7 @@ from activity import (
     ActivityDetail,
     activity_table,
     activity_detail_table,
+    dashboard_activity_table,
 )
 from term_translation import (
     term_translation_table,
@@ -1,7 +1,10 @@
 import datetime
 
 from sqlalchemy import (
-    orm, types, Column, Table, ForeignKey, desc, or_, union_all)
+    orm, types, Column, Table, ForeignKey, desc, or_, and_, union_all, event,
+    text, func)
+from pylons import config
+from paste.deploy.converters import asbool
 
 import ckan.model
 import meta
@@ -10,6 +13,7 @@ import domain_object
 
 __all__ = ['Activity', 'activity_table',
            'ActivityDetail', 'activity_detail_table',
+           'dashboard_activity_table',
            ]
 
 activity_table = Table(
@@ -33,6 +37,21 @@ activity_detail_table = Table(
     Column('data', _types.JsonDictType),
     )
 
+# Each user's dashboard activity stream, filled in when activities are
+# created if ckan.activity_streams_dashboard_feed is set. The timestamp is a
+# copy of the activity's, so that a page of a dashboard is a single range
+# scan of the (user_id, timestamp) index.
+dashboard_activity_table = Table(
+    'dashboard_activity', meta.metadata,
+    Column('user_id', types.UnicodeText,
+           ForeignKey('user.id', onupdate='CASCADE', ondelete='CASCADE'),
+           primary_key=True, nullable=False),
+    Column('activity_id', types.UnicodeText,
+           ForeignKey('activity.id', onupdate='CASCADE', ondelete='CASCADE'),
+           primary_key=True, nullable=False),
+    Column('timestamp', types.DateTime, nullable=False),
+    )
+
 class Activity(domain_object.DomainObject):
 
     def __init__(self, user_id, object_id, revision_id, activity_type,
@@ -51,6 +70,118 @@ class Activity(domain_object.DomainObject):
 meta.mapper(Activity, activity_table)
 
 
+# The fields of the package and resource dicts that are kept in activity data
+# when ckan.activity_streams_compact_data is set: those the activity streams
+# are rendered from, and the revision_id to rebuild the rest from.
+COMPACT_FIELDS = {
+    'package': ('id', 'name', 'title', 'type', 'state', 'private',
+                'owner_org', 'revision_id'),
+    'resource': ('id', 'name', 'package_id', 'url', 'format', 'state',
+                 'revision_id'),
+}
+
+
+def compact_data_enabled():
+    '''Whether new package activities store compact data.'''
+    return asbool(config.get('ckan.activity_streams_compact_data', False))
+
+
+def compact_data(data):
+    '''Return a copy of some activity data with its package and resource
+    dicts cut down to their COMPACT_FIELDS.
+
+    Returns ``data`` itself if it is compact already or has nothing that
+    could be rebuilt by :py:func:`expand_data`.
+
+    '''
+    if data.get('compact'):
+        return data
+    compact = dict(data)
+    for key, fields in COMPACT_FIELDS.iteritems():
+        object_dict = data.get(key)
+        if isinstance(object_dict, dict) and object_dict.get('revision_id'):
+            compact[key] = dict((field, object_dict.get(field))
+                                for field in fields)
+            compact['compact'] = True
+    if not compact.get('compact'):
+        return data
+    return compact
+
+
+def _revision_dict(key, object_dict):
+    import ckan.lib.dictization as dictization
+    revision_class = {'package': ckan.model.PackageRevision,
+                      'resource': ckan.model.ResourceRevision}[key]
+    revision = meta.Session.query(revision_class).filter_by(
+        id=object_dict['id'],
+        revision_id=object_dict['revision_id']).first()
+    if revision is None:
+        return None
+    return dictization.table_dictize(revision, {'model': ckan.model})
+
+
+def expand_data(data):
+    '''Return a copy of some activity data made by :py:func:`compact_data`
+    with the full package and resource dicts rebuilt from their revisions.
+
+    Returns ``data`` itself if it isn't compact. Dicts whose revisions have
+    been purged are left compact.
+
+    '''
+    if not data.get('compact'):
+        return data
+    full = dict(data)
+    del full['compact']
+    for key in COMPACT_FIELDS:
+        if isinstance(data.get(key), dict):
+            full[key] = _revision_dict(key, data[key]) or data[key]
+    return full
+
+
+# The users whose dashboard shows an activity: its user and, if it is about
+# a user, that user, plus the followers of its user, of its object and of
+# the groups its object belongs to. See _dashboard_activity_query().
+_FAN_OUT_SQL = text('''
+    INSERT INTO dashboard_activity (user_id, activity_id, "timestamp")
+    SELECT recipient, :activity_id, :timestamp FROM (
+        SELECT id AS recipient FROM "user"
+        WHERE id IN (:user_id, :object_id)
+        UNION
+        SELECT follower_id FROM user_following_user
+        WHERE object_id IN (:user_id, :object_id)
+        UNION
+        SELECT follower_id FROM user_following_dataset
+        WHERE object_id = :object_id
+        UNION
+        SELECT follower_id FROM user_following_group
+        WHERE object_id = :object_id
+        UNION
+        SELECT following.follower_id
+        FROM user_following_group following
+        JOIN member ON member.group_id = following.object_id
+        WHERE member.table_name = 'package'
+            AND member.table_id = :object_id
+            AND member.state = 'active'
+    ) AS recipients
+''')
+
+
+def dashboard_feed_enabled():
+    '''Whether dashboards are read from, and new activities are copied to,
+    the dashboard_activity table.'''
+    return asbool(config.get('ckan.activity_streams_dashboard_feed', False))
+
+
+@event.listens_for(Activity, 'after_insert')
+def _fan_out_activity(mapper, connection, activity):
+    if not dashboard_feed_enabled():
+        return
+    connection.execute(_FAN_OUT_SQL, activity_id=activity.id,
+                       timestamp=activity.timestamp,
+                       user_id=activity.user_id,
+                       object_id=activity.object_id)
+
+
 class ActivityDetail(domain_object.DomainObject):
 
     def __init__(self, activity_id, object_id, object_type, activity_type,
@@ -75,12 +206,30 @@ meta.mapper(ActivityDetail, activity_detail_table, properties = {
     })
 
 
-def _activities_limit(q, limit, offset=None):
+def _activities_before(q, before):
+    '''Return q filtered to the activities that come after ``before``, a
+    (timestamp, id) pair, in an activity stream sorted most recent first.
+
+    Using the activity table's timestamp indexes, this is as fast for the
+    last page of an activity stream as for the first, unlike an offset.
+
+    '''
+    import ckan.model as model
+    timestamp, activity_id = before
+    return q.filter(or_(
+        model.Activity.timestamp < timestamp,
+        and_(model.Activity.timestamp == timestamp,
+             model.Activity.id < activity_id)))
+
+
+def _activities_limit(q, limit, offset=None, before=None):
     '''
     Return an SQLAlchemy query for all activities at an offset with a limit.
     '''
     import ckan.model as model
-    q = q.order_by(desc(model.Activity.timestamp))
+    if before:
+        q = _activities_before(q, before)
+    q = q.order_by(desc(model.Activity.timestamp), desc(model.Activity.id))
     if offset:
         q = q.offset(offset)
     if limit:
@@ -97,11 +246,12 @@ def _activities_union_all(*qlist):
         union_all(*[q.subquery().select() for q in qlist])
         ).distinct(model.Activity.timestamp)
 
-def _activities_at_offset(q, limit, offset):
+
+def _activities_at_offset(q, limit, offset, before=None):
     '''
     Return a list of all activities at an offset with a limit.
     '''
-    return _activities_limit(q, limit, offset).all()
+    return _activities_limit(q, limit, offset, before).all()
 
 def _activities_from_user_query(user_id):
     '''Return an SQLAlchemy query for all activities from user_id.'''
@@ -119,14 +269,16 @@ def _activities_about_user_query(user_id):
     return q
 
 
-def _user_activity_query(user_id, limit):
+def _user_activity_query(user_id, limit, before=None):
     '''Return an SQLAlchemy query for all activities from or about user_id.'''
-    q1 = _activities_limit(_activities_from_user_query(user_id), limit)
-    q2 = _activities_limit(_activities_about_user_query(user_id), limit)
+    q1 = _activities_limit(_activities_from_user_query(user_id), limit,
+                           before=before)
+    q2 = _activities_limit(_activities_about_user_query(user_id), limit,
+                           before=before)
     return _activities_union_all(q1, q2)
 
 
-def user_activity_list(user_id, limit, offset):
+def user_activity_list(user_id, limit, offset, before=None):
     '''Return user_id's public activity stream.
 
     Return a list of all activities from or about the given user, i.e. where
@@ -136,8 +288,11 @@ def user_activity_list(user_id, limit, offset):
     "{OTHER_USER} started following {USER}"
     etc.
 
+    If ``before``, a (timestamp, id) pair, is given only the activities
+    after that point of the activity stream are returned.
+
     '''
-    q = _user_activity_query(user_id, limit + offset)
+    q = _user_activity_query(user_id, limit + offset, before)
     return _activities_at_offset(q, limit, offset)
 
 
@@ -151,7 +306,7 @@ def _package_activity_query(package_id):
     return q
 
 
-def package_activity_list(package_id, limit, offset):
+def package_activity_list(package_id, limit, offset, before=None):
     '''Return the given dataset (package)'s public activity stream.
 
     Returns all activities  about the given dataset, i.e. where the given
@@ -163,7 +318,7 @@ def package_activity_list(package_id, limit, offset):
 
     '''
     q = _package_activity_query(package_id)
-    return _activities_at_offset(q, limit, offset)
+    return _activities_at_offset(q, limit, offset, before)
 
 
 def _group_activity_query(group_id):
@@ -191,7 +346,7 @@ def _group_activity_query(group_id):
     return q
 
 
-def group_activity_list(group_id, limit, offset):
+def group_activity_list(group_id, limit, offset, before=None):
     '''Return the given group's public activity stream.
 
     Returns all activities where the given group or one of its datasets is the
@@ -203,10 +358,11 @@ def group_activity_list(group_id, limit, offset):
 
     '''
     q = _group_activity_query(group_id)
-    return _activities_at_offset(q, limit, offset)
+    return _activities_at_offset(q, limit, offset, before)
 
 
-def _activites_from_users_followed_by_user_query(user_id, limit):
+def _activites_from_users_followed_by_user_query(user_id, limit,
+                                                 before=None):
     '''Return a query for all activities from users that user_id follows.'''
     import ckan.model as model
 
@@ -217,11 +373,12 @@ def _activites_from_users_followed_by_user_query(user_id, limit):
         return model.Session.query(model.Activity).filter("0=1")
 
     return _activities_union_all(*[
-        _user_activity_query(follower.object_id, limit)
+        _user_activity_query(follower.object_id, limit, before)
         for follower in follower_objects])
 
 
-def _activities_from_datasets_followed_by_user_query(user_id, limit):
+def _activities_from_datasets_followed_by_user_query(user_id, limit,
+                                                     before=None):
     '''Return a query for all activities from datasets that user_id follows.'''
     import ckan.model as model
 
@@ -232,11 +389,13 @@ def _activities_from_datasets_followed_by_user_query(user_id, limit):
         return model.Session.query(model.Activity).filter("0=1")
 
     return _activities_union_all(*[
-        _activities_limit(_package_activity_query(follower.object_id), limit)
+        _activities_limit(_package_activity_query(follower.object_id), limit,
+                          before=before)
         for follower in follower_objects])
 
 
-def _activities_from_groups_followed_by_user_query(user_id, limit):
+def _activities_from_groups_followed_by_user_query(user_id, limit,
+                                                   before=None):
     '''Return a query for all activities about groups the given user follows.
 
     Return a query for all activities about the groups the given user follows,
@@ -253,15 +412,19 @@ def _activities_from_groups_followed_by_user_query(user_id, limit):
         return model.Session.query(model.Activity).filter("0=1")
 
     return _activities_union_all(*[
-        _activities_limit(_group_activity_query(follower.object_id), limit)
+        _activities_limit(_group_activity_query(follower.object_id), limit,
+                          before=before)
         for follower in follower_objects])
 
 
-def _activities_from_everything_followed_by_user_query(user_id, limit):
+def _activities_from_everything_followed_by_user_query(user_id, limit,
+                                                       before=None):
     '''Return a query for all activities from everything user_id follows.'''
-    q1 = _activites_from_users_followed_by_user_query(user_id, limit)
-    q2 = _activities_from_datasets_followed_by_user_query(user_id, limit)
-    q3 = _activities_from_groups_followed_by_user_query(user_id, limit)
+    q1 = _activites_from_users_followed_by_user_query(user_id, limit, before)
+    q2 = _activities_from_datasets_followed_by_user_query(user_id, limit,
+                                                          before)
+    q3 = _activities_from_groups_followed_by_user_query(user_id, limit,
+                                                        before)
     return _activities_union_all(q1, q2, q3)
 
 
@@ -278,14 +441,31 @@ def activities_from_everything_followed_by_user(user_id, limit, offset):
     return _activities_at_offset(q, limit, offset)
 
 
-def _dashboard_activity_query(user_id, limit):
+def _dashboard_activity_query(user_id, limit, before=None):
     '''Return an SQLAlchemy query for user_id's dashboard activity stream.'''
-    q1 = _user_activity_query(user_id, limit)
-    q2 = _activities_from_everything_followed_by_user_query(user_id, limit)
+    q1 = _user_activity_query(user_id, limit, before)
+    q2 = _activities_from_everything_followed_by_user_query(user_id, limit,
+                                                            before)
     return _activities_union_all(q1, q2)
 
 
-def dashboard_activity_list(user_id, limit, offset):
+def _dashboard_feed_query(user_id, before=None):
+    '''Return an SQLAlchemy query for user_id's dashboard activity stream
+    from the dashboard_activity table, most recent first.'''
+    import ckan.model as model
+    feed = dashboard_activity_table
+    q = model.Session.query(model.Activity)
+    q = q.join(feed, feed.c.activity_id == model.Activity.id)
+    q = q.filter(feed.c.user_id == user_id)
+    if before:
+        timestamp, activity_id = before
+        q = q.filter(or_(feed.c.timestamp < timestamp,
+                         and_(feed.c.timestamp == timestamp,
+                              feed.c.activity_id < activity_id)))
+    return q.order_by(desc(feed.c.timestamp), desc(feed.c.activity_id))
+
+
+def dashboard_activity_list(user_id, limit, offset, before=None):
     '''Return the given user's dashboard activity stream.
 
     Returns activities from the user's public activity stream, plus
@@ -294,10 +474,165 @@ def dashboard_activity_list(user_id, limit, offset):
     This is the union of user_activity_list(user_id) and
     activities_from_everything_followed_by_user(user_id).
 
+    When ckan.activity_streams_dashboard_feed is set it is read from the
+    dashboard_activity table instead. That has the activities that were
+    created, or backfilled, while the user followed their users, datasets
+    or groups.
+
     '''
-    q = _dashboard_activity_query(user_id, limit + offset)
+    if dashboard_feed_enabled():
+        q = _dashboard_feed_query(user_id, before)
+        if offset:
+            q = q.offset(offset)
+        return q.limit(limit).all()
+    q = _dashboard_activity_query(user_id, limit + offset, before)
     return _activities_at_offset(q, limit, offset)
 
+
+def dashboard_new_activities_count(user_id, since, limit,
+                                   hidden_user_ids=None):
+    '''Return the number of activities newer than ``since`` among the
+    latest ``limit`` activities of user_id's dashboard activity stream.
+
+    The user's own activities and the ones from users in hidden_user_ids
+    are not counted. The activities are counted in the database rather than
+    loaded.
+
+    '''
+    import ckan.model as model
+    if dashboard_feed_enabled():
+        q = _dashboard_feed_query(user_id)
+    else:
+        q = _activities_limit(_dashboard_activity_query(user_id, limit),
+                              limit)
+    # Not labelled 'timestamp', the union query adds that column itself
+    page = q.with_entities(
+        model.Activity.user_id.label('user_id'),
+        model.Activity.timestamp.label('activity_timestamp')).limit(
+            limit).subquery()
+    count = model.Session.query(func.count()).select_from(page)
+    count = count.filter(page.c.activity_timestamp > since)
+    count = count.filter(or_(page.c.user_id.is_(None),
+                             page.c.user_id != user_id))
+    if hidden_user_ids:
+        count = count.filter(or_(page.c.user_id.is_(None),
+                                 ~page.c.user_id.in_(hidden_user_ids)))
+    return count.scalar()
+
+
+# The users who want email notifications and have activities on their
+# dashboards since they last viewed them or were last emailed, and since
+# :cutoff, in id order from after :after. Their dashboard activity streams
+# come from the dashboard_activity table, when
+# ckan.activity_streams_dashboard_feed is set, or are those of
+# _dashboard_activity_query() otherwise.
+_USERS_WITH_NEW_DASHBOARD_ACTIVITIES_SQL = '''
+    SELECT "user".id, GREATEST(dashboard.email_last_sent,
+                               dashboard.activity_stream_last_viewed,
+                               :cutoff) AS since
+    FROM "user" JOIN dashboard ON dashboard.user_id = "user".id
+    WHERE "user".id > :after
+        AND "user".state <> 'deleted'
+        AND "user".activity_streams_email_notifications
+        AND "user".email <> ''
+        AND EXISTS (%s)
+    ORDER BY "user".id
+    LIMIT :limit
+'''
+
+_NEW_ACTIVITY_CONDITIONS = '''
+        activity."timestamp" > GREATEST(dashboard.email_last_sent,
+                                        dashboard.activity_stream_last_viewed,
+                                        :cutoff)
+        AND (activity.user_id IS NULL OR (activity.user_id <> "user".id %s))
+'''
+
+_NEW_DASHBOARD_ACTIVITY_SQL = '''
+    SELECT 1 FROM activity
+    WHERE %s AND (
+        activity.object_id = "user".id
+        OR activity.user_id IN (
+            SELECT object_id FROM user_following_user
+            WHERE follower_id = "user".id)
+        OR activity.object_id IN (
+            SELECT object_id FROM user_following_user
+            WHERE follower_id = "user".id
+            UNION
+            SELECT object_id FROM user_following_dataset
+            WHERE follower_id = "user".id
+            UNION
+            SELECT object_id FROM user_following_group
+            WHERE follower_id = "user".id
+            UNION
+            SELECT member.table_id
+            FROM member JOIN user_following_group following
+                ON following.object_id = member.group_id
+            WHERE following.follower_id = "user".id
+                AND member.table_name = 'package'
+                AND member.state = 'active'))
+'''
+
+_NEW_DASHBOARD_FEED_ACTIVITY_SQL = '''
+    SELECT 1 FROM dashboard_activity
+    JOIN activity ON activity.id = dashboard_activity.activity_id
+    WHERE dashboard_activity.user_id = "user".id AND %s
+'''
+
+
+def users_with_new_dashboard_activities(after, limit, cutoff,
+                                        hidden_user_ids=None):
+    '''Return the ids of the next ``limit`` users, in id order after the id
+    ``after``, who want email notifications and may have some.
+
+    Those are the users with activities on their dashboards by other users
+    (not in hidden_user_ids) that are newer than when the user last viewed
+    the dashboard, was last emailed, and ``cutoff``. They are all found in
+    one query rather than by loading each user's dashboard.
+
+    Returns a list of (user id, since) pairs, where since is the time after
+    which the user's activities are new.
+
+    '''
+    import ckan.model as model
+    params = {'after': after, 'limit': limit, 'cutoff': cutoff}
+    hidden = ''
+    if hidden_user_ids:
+        hidden = 'AND activity.user_id NOT IN :hidden_user_ids'
+        params['hidden_user_ids'] = tuple(hidden_user_ids)
+    conditions = _NEW_ACTIVITY_CONDITIONS % hidden
+    if dashboard_feed_enabled():
+        exists = _NEW_DASHBOARD_FEED_ACTIVITY_SQL % conditions
+    else:
+        exists = _NEW_DASHBOARD_ACTIVITY_SQL % conditions
+    sql = text(_USERS_WITH_NEW_DASHBOARD_ACTIVITIES_SQL % exists)
+    return [(row[0], row[1])
+            for row in model.Session.execute(sql, params)]
+
+
+def backfill_dashboard_activity(user_id, limit):
+    '''Copy the latest ``limit`` activities of user_id's dashboard activity
+    stream that aren't there yet into the dashboard_activity table.
+
+    Returns the number of activities added.
+
+    '''
+    import ckan.model as model
+    q = _dashboard_activity_query(user_id, limit)
+    activities = _activities_at_offset(q, limit, 0)
+    if not activities:
+        return 0
+    feed = dashboard_activity_table
+    existing = set(row[0] for row in model.Session.execute(
+        feed.select().with_only_columns([feed.c.activity_id]).where(
+            feed.c.user_id == user_id).where(
+            feed.c.activity_id.in_([a.id for a in activities]))))
+    rows = [{'user_id': user_id, 'activity_id': activity.id,
+             'timestamp': activity.timestamp}
+            for activity in activities if activity.id not in existing]
+    if rows:
+        model.Session.execute(feed.insert(), rows)
+    return len(rows)
+
 def _changed_packages_activity_query():
     '''Return an SQLAlchemyu query for all changed package activities.
 
@@ -311,7 +646,7 @@ def _changed_packages_activity_query():
     return q
 
 
-def recently_changed_packages_activity_list(limit, offset):
+def recently_changed_packages_activity_list(limit, offset, before=None):
     '''Return the site-wide stream of recently changed package activities.
 
     This activity stream includes recent 'new package', 'changed package' and
@@ -319,4 +654,39 @@ def recently_changed_packages_activity_list(limit, offset):
 
     '''
     q = _changed_packages_activity_query()
-    return _activities_at_offset(q, limit, offset)
+    return _activities_at_offset(q, limit, offset, before)
+
+
+def _compact_rows(query, cls, batch_size):
+    changed = 0
+    last_id = None
+    while True:
+        q = query
+        if last_id is not None:
+            q = q.filter(cls.id > last_id)
+        rows = q.order_by(cls.id).limit(batch_size).all()
+        if not rows:
+            return changed
+        for row in rows:
+            data = compact_data(row.data)
+            if data is not row.data:
+                row.data = data
+                changed += 1
+        last_id = rows[-1].id
+        meta.Session.commit()
+        meta.Session.expunge_all()
+
+
+def compact_activity_data(batch_size=1000):
+    '''Compact the data of the existing package activities and of their
+    package and resource details, committing every ``batch_size`` rows.
+
+    Returns the number of activities and activity details changed.
+
+    '''
+    activities = meta.Session.query(Activity).filter(
+        Activity.activity_type.endswith('package'))
+    details = meta.Session.query(ActivityDetail).filter(
+        ActivityDetail.object_type.in_([u'Package', u'Resource']))
+    return (_compact_rows(activities, Activity, batch_size) +
+            _compact_rows(details, ActivityDetail, batch_size))
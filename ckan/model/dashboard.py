@@ -40,4 +40,19 @@ class Dashboard(object):
             meta.Session.commit()
         return row
 
+    @classmethod
+    def create_missing(cls):
+        '''Create a fresh Dashboard row, like get() does, for each user who
+        wants email notifications and has none yet.'''
+        now = datetime.datetime.now()
+        meta.Session.execute(sqlalchemy.text('''
+            INSERT INTO dashboard
+                (user_id, activity_stream_last_viewed, email_last_sent)
+            SELECT id, :now, :now FROM "user"
+            WHERE activity_streams_email_notifications
+                AND NOT EXISTS (SELECT 1 FROM dashboard
+                                WHERE dashboard.user_id = "user".id)
+        '''), {'now': now})
+        meta.Session.commit()
+
 meta.mapper(Dashboard, dashboard_table)
@@ -19,37 +19,21 @@ class CkanCacheExtension(SessionExtension):
     used by the page cache to flush the cache when data in the database
     is altered. '''
 
-    def __init__(self, *args, **kw):
-        super(CkanCacheExtension, self).__init__(*args, **kw)
-        # Setup Redis support if needed.
-        self.use_redis = asbool(config.get('ckan.page_cache_enabled'))
-        if self.use_redis:
-            import redis
-            self.redis = redis
-            self.redis_connection is None
-            self.redis_exception = redis.exceptions.ConnectionError
-
     def after_commit(self, session):
-        if hasattr(session, '_object_cache'):
-            oc = session._object_cache
-            oc_list = oc['new']
-            oc_list.update(oc['changed'])
-            oc_list.update(oc['deleted'])
-            objs = set()
-            for item in oc_list:
-                objs.add(item.__class__.__name__)
-
-        # Flush Redis
-        if self.use_redis:
-            if self.redis_connection is None:
-                try:
-                    self.redis_connection = self.redis.StrictRedis()
-                except self.redis_exception:
-                    pass
-            try:
-                self.redis_connection.flushdb()
-            except self.redis_exception:
-                pass
+        if not asbool(config.get('ckan.page_cache_enabled')):
+            return
+        oc = getattr(session, '_object_cache', None)
+        if not oc or not (oc['new'] or oc['changed'] or oc['deleted']):
+            return
+
+        # Purge the pages that show what changed
+        import ckan.lib.page_cache as page_cache
+        page_cache.purge_changes(oc['new'] | oc['changed'] | oc['deleted'])
+
+    def after_rollback(self, session):
+        if asbool(config.get('ckan.page_cache_enabled')):
+            import ckan.lib.page_cache as page_cache
+            page_cache.discard_pending_purges()
 
 class CkanSessionExtension(SessionExtension):
 
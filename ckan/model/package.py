@@ -534,6 +534,8 @@ class Package(vdm.sqlalchemy.RevisionedObjectMixin,
         try:
             d = {'package': dictization.table_dictize(self,
                 context={'model': ckan.model})}
+            if activity.compact_data_enabled():
+                d = activity.compact_data(d)
             return activity.Activity(user_id, self.id, revision.id,
                     "%s package" % activity_type, d)
         except ckan.logic.NotFound:
@@ -555,8 +557,11 @@ class Package(vdm.sqlalchemy.RevisionedObjectMixin,
 
         package_dict = dictization.table_dictize(self,
                 context={'model':ckan.model})
+        data = {'package': package_dict}
+        if activity.compact_data_enabled():
+            data = activity.compact_data(data)
         return activity.ActivityDetail(activity_id, self.id, u"Package", activity_type,
-            {'package': package_dict })
+            data)
 
     def set_rating(self, user_or_ip, rating):
         '''Record a user's rating of this package.
@@ -168,9 +168,11 @@ class Resource(vdm.sqlalchemy.RevisionedObjectMixin,
 
         res_dict = ckan.lib.dictization.table_dictize(self,
                                                       context={'model': model})
+        data = {'resource': res_dict}
+        if activity.compact_data_enabled():
+            data = activity.compact_data(data)
         return activity.ActivityDetail(activity_id, self.id, u"Resource",
-                                       activity_type,
-                                       {'resource': res_dict})
+                                       activity_type, data)
 
 
 
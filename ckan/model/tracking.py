@@ -1,9 +1,10 @@
-from sqlalchemy import types, Column, Table
+from sqlalchemy import types, Column, Table, select
 
 import meta
 import domain_object
 
-__all__ = ['tracking_summary_table', 'TrackingSummary', 'tracking_raw_table']
+__all__ = ['tracking_summary_table', 'TrackingSummary', 'tracking_raw_table',
+           'tracking_latest_table']
 
 tracking_raw_table = Table('tracking_raw', meta.metadata,
         Column('user_key', types.Unicode(100), nullable=False),
@@ -23,28 +24,68 @@ tracking_summary_table = Table('tracking_summary', meta.metadata,
         Column('tracking_date', types.DateTime),
     )
 
+# The most recent tracking_summary row of each url, kept up to date by the
+# `paster tracking update` command so that reads don't need to sort the
+# whole history.
+tracking_latest_table = Table('tracking_latest', meta.metadata,
+        Column('url', types.UnicodeText, primary_key=True, nullable=False),
+        Column('package_id', types.UnicodeText),
+        Column('tracking_type', types.Unicode(10), nullable=False),
+        Column('running_total', types.Integer, nullable=False),
+        Column('recent_views', types.Integer, nullable=False),
+        Column('tracking_date', types.DateTime),
+    )
+
 class TrackingSummary(domain_object.DomainObject):
 
     @classmethod
     def get_for_package(cls, package_id):
-        obj = meta.Session.query(cls).autoflush(False)
-        obj = obj.filter_by(package_id=package_id)
-        data = obj.order_by('tracking_date desc').first()
-        if data:
-            return {'total' : data.running_total,
-                    'recent': data.recent_views}
+        data = cls._get_latest(tracking_latest_table.c.package_id,
+                               [package_id])
+        return data[package_id]
 
-        return {'total' : 0, 'recent' : 0}
+    @classmethod
+    def get_for_resource(cls, url):
+        data = cls._get_latest(tracking_latest_table.c.url, [url])
+        return data[url]
+
+    @classmethod
+    def get_for_packages(cls, package_ids):
+        '''Return the latest tracking summaries of several packages.
+
+        Does a single query and returns a dict mapping each of the given
+        package ids to its summary.
 
+        '''
+        return cls._get_latest(tracking_latest_table.c.package_id,
+                               package_ids)
 
     @classmethod
-    def get_for_resource(cls, url):
-        obj = meta.Session.query(cls).autoflush(False)
-        data = obj.filter_by(url=url).order_by('tracking_date desc').first()
-        if data:
-            return {'total' : data.running_total,
-                    'recent': data.recent_views}
+    def get_for_resources(cls, urls):
+        '''Return the latest tracking summaries of several resource urls.
+
+        Does a single query and returns a dict mapping each of the given
+        urls to its summary.
 
-        return {'total' : 0, 'recent' : 0}
+        '''
+        return cls._get_latest(tracking_latest_table.c.url, urls)
+
+    @classmethod
+    def _get_latest(cls, column, values):
+        summaries = dict((value, {'total': 0, 'recent': 0})
+                         for value in values)
+        if not summaries:
+            return summaries
+        table = tracking_latest_table
+        query = select([column, table.c.running_total, table.c.recent_views])
+        query = query.where(column.in_(summaries.keys()))
+        # A package has a row for each of its tracked urls, e.g. its name,
+        # its id and any old names, so take the one with the latest date
+        query = query.distinct(column).order_by(column,
+                                                table.c.tracking_date.desc())
+        for value, running_total, recent_views in meta.Session.execute(query):
+            summaries[value] = {'total': running_total,
+                                'recent': recent_views}
+        return summaries
 
 meta.mapper(TrackingSummary, tracking_summary_table)
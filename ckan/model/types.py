@@ -2,7 +2,7 @@
 import datetime
 import copy
 import uuid
-import simplejson as json
+import ckan.lib.json_codec as json_codec
 
 from sqlalchemy import types
 
@@ -47,13 +47,13 @@ class JsonType(types.TypeDecorator):
             return None
         else:
             # ensure_ascii=False => allow unicode but still need to convert
-            return unicode(json.dumps(value, ensure_ascii=False))
+            return unicode(json_codec.dumps(value, ensure_ascii=False))
 
     def process_result_value(self, value, engine):
         if value is None:
             return {}
         else:
-            return json.loads(value)
+            return json_codec.loads(value)
 
     def copy(self):
         return JsonType(self.impl.length)
@@ -75,7 +75,7 @@ class JsonDictType(JsonType):
             if isinstance(value, basestring):
                 return unicode(value)
             else:
-                return unicode(json.dumps(value, ensure_ascii=False))
+                return unicode(json_codec.dumps(value, ensure_ascii=False))
 
     def copy(self):
         return JsonDictType(self.impl.length)
@@ -2,9 +2,13 @@
 NB Don't test logic functions here. This is just for the mechanics of the API
 controller itself.
 '''
+import gzip
+import hashlib
 import json
+import StringIO
 
 import ckan.new_tests.helpers as helpers
+import ckan.new_tests.factories as factories
 
 
 class TestApiController(helpers.FunctionalTestBase):
@@ -19,3 +23,195 @@ class TestApiController(helpers.FunctionalTestBase):
         # The unicode is backslash encoded (because that is the default when
         # you do str(exception) )
         assert 'Delta symbol: \\u0394' in response.body
+
+
+class TestBatchApi(helpers.FunctionalTestBase):
+
+    def _post_batch(self, data_dict, status=200):
+        app = self._get_test_app()
+        return app.post(url='/api/3/action/batch',
+                        params=json.dumps(data_dict), status=status)
+
+    def test_batch_returns_one_result_per_call(self):
+        dataset = factories.Dataset()
+
+        response = self._post_batch({'calls': [
+            {'action': 'package_show', 'data_dict': {'id': dataset['id']}},
+            {'action': 'site_read'},
+        ]})
+
+        result = json.loads(response.body)['result']
+        assert len(result) == 2
+        assert result[0]['success']
+        assert result[0]['result']['name'] == dataset['name']
+        assert result[1] == {'success': True, 'result': True}
+
+    def test_batch_reports_errors_per_call(self):
+        dataset = factories.Dataset()
+
+        response = self._post_batch({'calls': [
+            {'action': 'package_show', 'data_dict': {'id': 'missing'}},
+            {'action': 'not_an_action'},
+            {'action': 'package_show', 'data_dict': {'id': dataset['id']}},
+        ]})
+
+        result = json.loads(response.body)['result']
+        assert not result[0]['success']
+        assert result[0]['error']['__type'] == 'Not Found Error'
+        assert not result[1]['success']
+        assert result[2]['success']
+
+    def test_batch_parallel(self):
+        datasets = [factories.Dataset() for i in range(3)]
+
+        response = self._post_batch({'parallel': True, 'calls': [
+            {'action': 'package_show', 'data_dict': {'id': dataset['id']}}
+            for dataset in datasets]})
+
+        result = json.loads(response.body)['result']
+        assert ([r['result']['name'] for r in result] ==
+                [dataset['name'] for dataset in datasets])
+
+    def test_batch_parallel_as_a_user(self):
+        user = factories.User()
+        org = factories.Organization(user=user)
+        datasets = [factories.Dataset(owner_org=org['id'], private=True)
+                    for i in range(3)]
+
+        app = self._get_test_app()
+        response = app.post(
+            url='/api/3/action/batch',
+            params=json.dumps({'parallel': True, 'calls': [
+                {'action': 'package_show', 'data_dict': {'id': dataset['id']}}
+                for dataset in datasets]}),
+            extra_environ={'REMOTE_USER': user['name'].encode('ascii')})
+
+        result = json.loads(response.body)['result']
+        assert ([r['result']['name'] for r in result] ==
+                [dataset['name'] for dataset in datasets])
+
+    def test_batch_requires_a_list_of_calls(self):
+        self._post_batch({'calls': {'action': 'site_read'}}, status=400)
+
+    @helpers.change_config('ckan.api.batch.max_calls', 1)
+    def test_batch_max_calls(self):
+        self._post_batch({'calls': [{'action': 'site_read'},
+                                    {'action': 'site_read'}]}, status=400)
+
+
+class TestConditionalGet(helpers.FunctionalTestBase):
+
+    def _get_package_show(self, dataset, headers=None, status=200):
+        app = self._get_test_app()
+        return app.get(url='/api/3/action/package_show',
+                       params={'id': dataset['id']},
+                       headers=headers or {}, status=status)
+
+    def test_get_sets_validators(self):
+        dataset = factories.Dataset()
+
+        response = self._get_package_show(dataset)
+
+        assert response.headers['ETag'].startswith('"')
+        assert 'Last-Modified' not in response.headers
+        assert response.headers['Cache-Control'].startswith('public')
+        assert 'Pragma' not in response.headers
+
+    def test_matching_etag_returns_304(self):
+        dataset = factories.Dataset()
+        etag = self._get_package_show(dataset).headers['ETag']
+
+        response = self._get_package_show(
+            dataset, headers={'If-None-Match': etag}, status=304)
+
+        assert response.body == ''
+        assert response.headers['ETag'] == etag
+
+    def test_changed_dataset_returns_200(self):
+        dataset = factories.Dataset()
+        etag = self._get_package_show(dataset).headers['ETag']
+        helpers.call_action('package_patch', id=dataset['id'],
+                            title='Changed')
+
+        response = self._get_package_show(
+            dataset, headers={'If-None-Match': etag})
+
+        assert response.headers['ETag'] != etag
+        assert json.loads(response.body)['result']['title'] == 'Changed'
+
+    def test_if_modified_since_is_ignored(self):
+        dataset = factories.Dataset()
+
+        self._get_package_show(
+            dataset, headers={'If-Modified-Since':
+                              'Fri, 01 Jan 2100 00:00:00 GMT'},
+            status=200)
+
+    def test_post_is_not_cacheable(self):
+        dataset = factories.Dataset()
+        app = self._get_test_app()
+
+        response = app.post(url='/api/3/action/package_show',
+                            params=json.dumps({'id': dataset['id']}))
+
+        assert 'ETag' not in response.headers
+
+
+class TestStreamedResponses(helpers.FunctionalTestBase):
+
+    def _get_package_show(self, dataset, params=None, headers=None,
+                          status=200):
+        app = self._get_test_app()
+        params = dict(params or {}, id=dataset['id'])
+        return app.get(url='/api/3/action/package_show', params=params,
+                       headers=headers or {}, status=status)
+
+    @helpers.change_config('ckan.api.stream_responses', True)
+    def test_streamed_response(self):
+        dataset = factories.Dataset()
+
+        response = self._get_package_show(dataset)
+
+        assert json.loads(response.body)['result']['id'] == dataset['id']
+
+    @helpers.change_config('ckan.api.stream_responses', True)
+    def test_streamed_jsonp(self):
+        dataset = factories.Dataset()
+
+        response = self._get_package_show(dataset, {'callback': 'cb'})
+
+        assert response.body.startswith('cb({')
+        assert response.body.endswith('});')
+
+    @helpers.change_config('ckan.api.stream_responses', True)
+    def test_streamed_response_etag(self):
+        dataset = factories.Dataset()
+
+        response = self._get_package_show(dataset)
+        etag = response.headers['ETag']
+
+        assert etag == '"%s"' % hashlib.md5(response.body).hexdigest()
+        self._get_package_show(
+            dataset, headers={'If-None-Match': etag}, status=304)
+
+    @helpers.change_config('ckan.api.gzip_responses', True)
+    def test_gzip(self):
+        dataset = factories.Dataset()
+
+        response = self._get_package_show(
+            dataset, headers={'Accept-Encoding': 'gzip'})
+
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert 'Accept-Encoding' in response.headers['Vary']
+        assert response.headers['ETag'].endswith('-gzip"')
+        body = gzip.GzipFile(fileobj=StringIO.StringIO(response.body)).read()
+        assert json.loads(body)['result']['id'] == dataset['id']
+
+    @helpers.change_config('ckan.api.gzip_responses', True)
+    def test_no_gzip_unless_accepted(self):
+        dataset = factories.Dataset()
+
+        response = self._get_package_show(dataset)
+
+        assert 'Content-Encoding' not in response.headers
+        assert json.loads(response.body)['result']['id'] == dataset['id']
@@ -0,0 +1,93 @@
+from nose.tools import assert_equal
+
+from ckan import model
+from ckan.lib import search
+
+from ckan.new_tests import helpers, factories
+
+
+def _revision_count(revision_class, id):
+    return model.Session.query(revision_class).filter_by(id=id).count()
+
+
+def _latest_activity_details(dataset_id):
+    activity = model.activity.package_activity_list(dataset_id, 1, 0)[0]
+    return model.ActivityDetail.by_activity_id(activity.id)
+
+
+class TestPackageDictSave:
+
+    def setup(self):
+        helpers.reset_db()
+        search.clear()
+
+    def _dataset(self):
+        dataset = factories.Dataset(
+            tags=[{'name': 'tag1'}, {'name': 'tag2'}],
+            extras=[{'key': 'extra1', 'value': 'value1'}])
+        factories.Resource(package_id=dataset['id'], some_extra='a')
+        factories.Resource(package_id=dataset['id'], some_extra='b')
+        return helpers.call_action('package_show', id=dataset['id'])
+
+    def test_unchanged_child_rows_are_not_written(self):
+        dataset = self._dataset()
+        resource_revisions = [
+            _revision_count(model.ResourceRevision, resource['id'])
+            for resource in dataset['resources']]
+
+        dataset['title'] = 'Changed'
+        helpers.call_action('package_update', **dataset)
+
+        assert_equal([_revision_count(model.ResourceRevision, resource['id'])
+                      for resource in dataset['resources']],
+                     resource_revisions)
+        details = _latest_activity_details(dataset['id'])
+        assert_equal([detail.object_type for detail in details],
+                     [u'Package'])
+
+    def test_only_the_changed_resource_is_written(self):
+        dataset = self._dataset()
+        first, second = dataset['resources']
+        first_revisions = _revision_count(model.ResourceRevision, first['id'])
+        second_revisions = _revision_count(model.ResourceRevision,
+                                           second['id'])
+
+        second['some_extra'] = 'changed'
+        helpers.call_action('package_update', **dataset)
+
+        assert_equal(_revision_count(model.ResourceRevision, first['id']),
+                     first_revisions)
+        assert_equal(_revision_count(model.ResourceRevision, second['id']),
+                     second_revisions + 1)
+        resource = helpers.call_action('resource_show', id=second['id'])
+        assert_equal(resource['some_extra'], 'changed')
+
+    def test_removed_resources_and_tags_are_deleted(self):
+        dataset = self._dataset()
+        first, second = dataset['resources']
+
+        dataset['resources'] = [second]
+        dataset['tags'] = [{'name': 'tag2'}, {'name': 'tag3'}]
+        helpers.call_action('package_update', **dataset)
+
+        dataset = helpers.call_action('package_show', id=dataset['id'])
+        assert_equal([resource['id'] for resource in dataset['resources']],
+                     [second['id']])
+        assert_equal(dataset['resources'][0]['position'], 0)
+        assert_equal(model.Resource.get(first['id']).state, 'deleted')
+        assert_equal(sorted(tag['name'] for tag in dataset['tags']),
+                     ['tag2', 'tag3'])
+
+    def test_deleted_resources_are_not_written_again(self):
+        dataset = self._dataset()
+        deleted_ids = [resource['id'] for resource in dataset['resources']]
+        dataset['resources'] = []
+        helpers.call_action('package_update', **dataset)
+        deleted_revisions = [_revision_count(model.ResourceRevision, id)
+                             for id in deleted_ids]
+
+        dataset['title'] = 'Changed'
+        helpers.call_action('package_update', **dataset)
+
+        assert_equal([_revision_count(model.ResourceRevision, id)
+                      for id in deleted_ids], deleted_revisions)
@@ -1,6 +1,7 @@
 import datetime
 import hashlib
 import json
+import mock
 import nose.tools
 import nose
 
@@ -283,3 +284,92 @@ class TestPackageSearchIndex:
 
         # Resource types are indexed
         assert_equal(indexed_pkg['res_type'], ['doc', 'file'])
+
+
+class TestUpdateTracking(object):
+
+    @mock.patch('ckan.lib.search.index.make_connection')
+    def test_update_tracking_sends_an_atomic_update(self, make_connection):
+        conn = make_connection.return_value
+        index = search.index.PackageSearchIndex()
+
+        index.update_tracking({'pkg-id': {'total': 7, 'recent': 3}},
+                              defer_commit=True)
+
+        request, query = conn._update.call_args[0]
+        index_id = hashlib.md5(
+            'pkg-id{0}'.format(config['ckan.site_id'])).hexdigest()
+        assert_in('<field name="index_id">{0}</field>'.format(index_id),
+                  request)
+        assert_in('<field name="views_total" update="set">7</field>',
+                  request)
+        assert_in('<field name="views_recent" update="set">3</field>',
+                  request)
+        assert_equal(query, None)
+
+    @mock.patch('ckan.lib.search.index.make_connection')
+    def test_update_tracking_with_no_summaries(self, make_connection):
+        index = search.index.PackageSearchIndex()
+
+        index.update_tracking({})
+
+        assert not make_connection.called
+
+
+class TestBulkUpdates(object):
+
+    def _stored_doc(self, package_id):
+        data_dict = {'id': package_id, 'name': package_id, 'private': False}
+        return {'index_id': package_id + '-index',
+                'data_dict': json.dumps(data_dict),
+                'validated_data_dict': json.dumps(data_dict)}
+
+    @mock.patch('ckan.lib.search.index.make_connection')
+    def test_delete_packages_sends_a_single_request(self, make_connection):
+        conn = make_connection.return_value
+        index = search.index.PackageSearchIndex()
+
+        index.delete_packages(['pkg-1', 'pkg-2'])
+
+        assert_equal(conn._update.call_count, 1)
+        request, query = conn._update.call_args[0]
+        for package_id in ('pkg-1', 'pkg-2'):
+            index_id = hashlib.md5('{0}{1}'.format(
+                package_id, config['ckan.site_id'])).hexdigest()
+            assert_in('<id>{0}</id>'.format(index_id), request)
+        assert_equal(query, {'commit': 'true'})
+
+    @helpers.change_config('ckan.search.atomic_updates', True)
+    @mock.patch('ckan.lib.search.index.make_connection')
+    def test_update_fields_sends_an_atomic_update(self, make_connection):
+        conn = make_connection.return_value
+        conn.raw_query.return_value = json.dumps({'response': {'docs': [
+            self._stored_doc('pkg-1'), self._stored_doc('pkg-2')]}})
+        index = search.index.PackageSearchIndex()
+
+        index.update_fields(['pkg-1', 'pkg-2'], {'private': True})
+
+        assert_equal(conn.raw_query.call_count, 1)
+        assert_equal(conn._update.call_count, 1)
+        request, query = conn._update.call_args[0]
+        assert_equal(request.count(
+            '<field name="capacity" update="set">private</field>'), 2)
+        assert_in('&quot;private&quot;: true', request)
+        assert_not_in('&quot;private&quot;: false', request)
+        assert_equal(query, {'commit': 'true'})
+
+    @mock.patch('ckan.lib.search.index.PackageSearchIndex.index_packages')
+    @mock.patch('ckan.lib.search.index.make_connection')
+    def test_update_fields_reindexes_the_stored_data_dicts(
+            self, make_connection, index_packages):
+        conn = make_connection.return_value
+        conn.raw_query.return_value = json.dumps({'response': {'docs': [
+            self._stored_doc('pkg-1'), self._stored_doc('pkg-2')]}})
+        index = search.index.PackageSearchIndex()
+
+        index.update_fields(['pkg-1', 'pkg-2'], {'private': True})
+
+        pkg_dicts, defer_commit = index_packages.call_args[0]
+        assert_equal([pkg_dict['private'] for pkg_dict in pkg_dicts],
+                     [True, True])
+        assert not conn._update.called
@@ -0,0 +1,37 @@
+import mock
+import nose.tools
+
+import ckan.lib.app_globals as app_globals
+import ckan.new_tests.helpers as helpers
+
+eq = nose.tools.eq_
+
+
+class TestCheckUptodate(object):
+
+    def setup(self):
+        self.globals = app_globals.app_globals
+        self.globals._config_update = None
+        self.globals._last_uptodate_check = 0
+
+    @helpers.change_config('ckan.config_update_interval', '60')
+    @mock.patch('ckan.lib.app_globals.reset')
+    @mock.patch('ckan.model.get_system_info', return_value='1')
+    def test_database_is_checked_once_per_interval(self, get_system_info,
+                                                   reset):
+        for i in range(3):
+            self.globals._check_uptodate()
+
+        eq(get_system_info.call_count, 1)
+        eq(reset.call_count, 1)
+
+    @helpers.change_config('ckan.config_update_interval', '0')
+    @mock.patch('ckan.lib.app_globals.reset')
+    @mock.patch('ckan.model.get_system_info', return_value='1')
+    def test_zero_interval_checks_every_time(self, get_system_info, reset):
+        for i in range(3):
+            self.globals._check_uptodate()
+
+        eq(get_system_info.call_count, 3)
+        # the config only changed once
+        eq(reset.call_count, 1)
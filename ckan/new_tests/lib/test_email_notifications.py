@@ -0,0 +1,197 @@
+import datetime
+import smtplib
+
+import mock
+import nose.tools
+
+import ckan.model as model
+import ckan.lib.email_notifications as email_notifications
+
+import ckan.new_tests.helpers as helpers
+import ckan.new_tests.factories as factories
+
+eq = nose.tools.eq_
+
+
+def _notifications_for_activities(activities, user_dict):
+    # Instead of rendering the email template
+    if not activities:
+        return []
+    return [{'subject': 'New activities',
+             'body': '%i new activities' % len(activities)}]
+
+
+def _follower(dataset, **kwargs):
+    kwargs.setdefault('activity_streams_email_notifications', True)
+    user = factories.User(**kwargs)
+    # Sets the time the user last viewed the dashboard and was last emailed
+    model.Dashboard.get(user['id'])
+    helpers.call_action('follow_dataset', context={'user': user['name']},
+                        id=dataset['id'])
+    return user
+
+
+class TestUsersWithNewDashboardActivities(object):
+
+    def setup(self):
+        helpers.reset_db()
+
+    def _user_ids(self, after=u'', limit=100):
+        cutoff = datetime.datetime.now() - datetime.timedelta(days=2)
+        return [user_id for user_id, since in
+                model.activity.users_with_new_dashboard_activities(
+                    after, limit, cutoff)]
+
+    def test_only_users_with_new_activities(self):
+        dataset = factories.Dataset()
+        follower = _follower(dataset)
+        _follower(dataset, activity_streams_email_notifications=False)
+        factories.User(activity_streams_email_notifications=True)
+        eq(self._user_ids(), [])
+
+        helpers.call_action('package_patch', id=dataset['id'],
+                            title='Changed')
+
+        eq(self._user_ids(), [follower['id']])
+
+    def test_batches(self):
+        dataset = factories.Dataset()
+        followers = sorted(_follower(dataset)['id'] for i in range(3))
+        helpers.call_action('package_patch', id=dataset['id'],
+                            title='Changed')
+
+        eq(self._user_ids(limit=2), followers[:2])
+        eq(self._user_ids(after=followers[1], limit=2), followers[2:])
+
+    @helpers.change_config('ckan.activity_streams_dashboard_feed', True)
+    def test_from_the_dashboard_feed(self):
+        dataset = factories.Dataset()
+        follower = _follower(dataset)
+
+        helpers.call_action('package_patch', id=dataset['id'],
+                            title='Changed')
+
+        eq(self._user_ids(), [follower['id']])
+
+
+@mock.patch('ckan.lib.email_notifications._notifications_for_activities',
+            _notifications_for_activities)
+class TestGetAndSendNotificationsForAllUsers(object):
+
+    def setup(self):
+        helpers.reset_db()
+
+    @helpers.change_config('ckan.email_notifications_batch_size', 2)
+    @mock.patch('ckan.lib.mailer.mail_recipient')
+    @mock.patch('ckan.lib.mailer.open_smtp_connection')
+    def test_one_smtp_connection_per_batch(self, mock_open, mock_mail):
+        dataset = factories.Dataset()
+        for i in range(3):
+            _follower(dataset)
+        helpers.call_action('package_patch', id=dataset['id'],
+                            title='Changed')
+
+        email_notifications.get_and_send_notifications_for_all_users()
+
+        eq(mock_open.call_count, 2)
+        eq(mock_open.return_value.quit.call_count, 2)
+        eq(mock_mail.call_count, 3)
+        for call in mock_mail.call_args_list:
+            eq(call[1]['smtp_connection'], mock_open.return_value)
+
+    @mock.patch('ckan.lib.mailer.mail_recipient')
+    @mock.patch('ckan.lib.mailer.open_smtp_connection')
+    def test_users_are_not_notified_twice(self, mock_open, mock_mail):
+        dataset = factories.Dataset()
+        follower = _follower(dataset)
+        helpers.call_action('package_patch', id=dataset['id'],
+                            title='Changed')
+
+        email_notifications.get_and_send_notifications_for_all_users()
+        email_notifications.get_and_send_notifications_for_all_users()
+
+        eq(mock_mail.call_count, 1)
+        dashboard = model.Dashboard.get(follower['id'])
+        assert (dashboard.email_last_sent >
+                dashboard.activity_stream_last_viewed)
+
+    @mock.patch('ckan.lib.mailer.mail_recipient')
+    @mock.patch('ckan.lib.mailer.open_smtp_connection')
+    def test_failed_users_are_notified_next_time(self, mock_open, mock_mail):
+        import ckan.lib.mailer
+        dataset = factories.Dataset()
+        followers = [_follower(dataset) for i in range(2)]
+        helpers.call_action('package_patch', id=dataset['id'],
+                            title='Changed')
+        failing_email = followers[0]['email']
+
+        def mail_recipient(name, email, subject, body, **kwargs):
+            if email == failing_email:
+                raise ckan.lib.mailer.MailerException('Failed')
+        mock_mail.side_effect = mail_recipient
+
+        email_notifications.get_and_send_notifications_for_all_users()
+        mock_mail.reset_mock()
+        mock_mail.side_effect = None
+        email_notifications.get_and_send_notifications_for_all_users()
+
+        eq([call[0][1] for call in mock_mail.call_args_list], [failing_email])
+
+    @mock.patch('ckan.lib.mailer.mail_recipient')
+    @mock.patch('ckan.lib.mailer.open_smtp_connection')
+    def test_users_are_recorded_when_quit_fails(self, mock_open, mock_mail):
+        dataset = factories.Dataset()
+        _follower(dataset)
+        helpers.call_action('package_patch', id=dataset['id'],
+                            title='Changed')
+        mock_open.return_value.quit.side_effect = (
+            smtplib.SMTPServerDisconnected('Connection unexpectedly closed'))
+
+        email_notifications.get_and_send_notifications_for_all_users()
+        email_notifications.get_and_send_notifications_for_all_users()
+
+        eq(mock_mail.call_count, 1)
+
+    @mock.patch('ckan.lib.mailer.mail_recipient')
+    @mock.patch('ckan.lib.mailer.open_smtp_connection')
+    def test_dropped_connections_are_reopened_once(self, mock_open,
+                                                   mock_mail):
+        import ckan.lib.mailer
+        dataset = factories.Dataset()
+        for i in range(3):
+            _follower(dataset)
+        helpers.call_action('package_patch', id=dataset['id'],
+                            title='Changed')
+        dropped = mock.Mock()
+        dropped.noop.side_effect = smtplib.SMTPServerDisconnected()
+        mock_open.side_effect = [dropped, mock.Mock()]
+
+        def mail_recipient(name, email, subject, body, **kwargs):
+            if kwargs['smtp_connection'] is dropped:
+                raise ckan.lib.mailer.MailerException('Disconnected')
+        mock_mail.side_effect = mail_recipient
+
+        email_notifications.get_and_send_notifications_for_all_users()
+
+        eq(mock_open.call_count, 2)
+        eq(mock_mail.call_count, 4)
+        mock_mail.reset_mock()
+        email_notifications.get_and_send_notifications_for_all_users()
+        eq(mock_mail.call_count, 0)
+
+    @mock.patch('ckan.lib.mailer.mail_recipient')
+    @mock.patch('ckan.lib.mailer.open_smtp_connection')
+    def test_users_without_a_dashboard(self, mock_open, mock_mail):
+        dataset = factories.Dataset()
+        user = factories.User(activity_streams_email_notifications=True)
+        helpers.call_action('follow_dataset', context={'user': user['name']},
+                            id=dataset['id'])
+
+        # Creates the user's dashboard
+        email_notifications.get_and_send_notifications_for_all_users()
+        eq(mock_mail.call_count, 0)
+        helpers.call_action('package_patch', id=dataset['id'],
+                            title='Changed')
+        email_notifications.get_and_send_notifications_for_all_users()
+
+        eq(mock_mail.call_count, 1)
@@ -0,0 +1,93 @@
+import nose.tools
+
+import ckan.model as model
+import ckan.lib.identity_cache as identity_cache
+
+import ckan.new_tests.helpers as helpers
+import ckan.new_tests.factories as factories
+
+eq = nose.tools.eq_
+
+
+class TestIdentityCache(object):
+
+    def setup(self):
+        helpers.reset_db()
+        identity_cache.configure({'ckan.identity_cache.expires': '60',
+                                  'ckan.identity_cache.max_size': '2'})
+
+    def teardown(self):
+        identity_cache.configure({})
+
+    def _cache(self, name):
+        user = model.User.by_name(name)
+        identity_cache.set_user(identity_cache.NAME, name, user)
+        model.Session.remove()
+
+    def test_cached_users_are_attached_to_the_session(self):
+        user = factories.User(name='alice')
+        self._cache(u'alice')
+
+        cached = identity_cache.get_user(identity_cache.NAME, u'alice')
+
+        eq(cached.id, user['id'])
+        eq(cached.apikey, user['apikey'])
+        assert cached in model.Session
+
+    def test_disabled_by_default(self):
+        factories.User(name='alice')
+        identity_cache.configure({})
+        self._cache(u'alice')
+
+        eq(identity_cache.get_user(identity_cache.NAME, u'alice'), None)
+
+    def test_expired_entries_are_not_returned(self):
+        factories.User(name='alice')
+        self._cache(u'alice')
+        key = (identity_cache.NAME, u'alice')
+        values, expires = identity_cache._entries[key]
+        identity_cache._entries[key] = (values, expires - 120)
+
+        eq(identity_cache.get_user(identity_cache.NAME, u'alice'), None)
+
+    def test_least_recently_used_entries_are_dropped(self):
+        for name in (u'alice', u'bob', u'carol'):
+            factories.User(name=name)
+        self._cache(u'alice')
+        self._cache(u'bob')
+        identity_cache.get_user(identity_cache.NAME, u'alice')
+
+        self._cache(u'carol')
+
+        assert identity_cache.get_user(identity_cache.NAME, u'alice')
+        eq(identity_cache.get_user(identity_cache.NAME, u'bob'), None)
+
+    def test_user_update_invalidates_the_user(self):
+        user = factories.User(name='alice')
+        self._cache(u'alice')
+
+        helpers.call_action('user_update', context={'user': user['name']},
+                            id=user['id'], email='alice@example.com',
+                            fullname='Alice')
+
+        eq(identity_cache.get_user(identity_cache.NAME, u'alice'), None)
+
+    def test_user_generate_apikey_invalidates_the_user(self):
+        user = factories.User()
+        model_user = model.User.get(user['id'])
+        identity_cache.set_user(identity_cache.APIKEY, user['apikey'],
+                                model_user)
+
+        helpers.call_action('user_generate_apikey',
+                            context={'user': user['name']}, id=user['id'])
+
+        eq(identity_cache.get_user(identity_cache.APIKEY, user['apikey']),
+           None)
+
+    def test_user_delete_invalidates_the_user(self):
+        user = factories.User(name='alice')
+        self._cache(u'alice')
+
+        helpers.call_action('user_delete', id=user['id'])
+
+        eq(identity_cache.get_user(identity_cache.NAME, u'alice'), None)
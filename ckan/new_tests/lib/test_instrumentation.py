@@ -0,0 +1,83 @@
+import nose.tools
+
+import ckan.lib.instrumentation as instrumentation
+
+eq = nose.tools.eq_
+
+
+class TestRecordAction(object):
+
+    def setup(self):
+        instrumentation.configure({'ckan.instrumentation.enabled': 'true',
+                                   'ckan.instrumentation.log_interval': '0',
+                                   'ckan.instrumentation.slow_threshold': '0'})
+        instrumentation.reset()
+
+    def teardown(self):
+        instrumentation.configure({})
+        instrumentation.reset()
+
+    def test_disabled_records_nothing(self):
+        instrumentation.configure({})
+
+        with instrumentation.record_action('package_show'):
+            instrumentation.record_solr_call()
+
+        eq(instrumentation.get_stats()['actions'], {})
+
+    def test_counts_calls(self):
+        for i in range(3):
+            with instrumentation.record_action('package_show'):
+                pass
+
+        stats = instrumentation.get_stats()['actions']['package_show']
+        eq(stats['count'], 3)
+        eq(stats['nested_count'], 0)
+        eq(sum(stats['histogram'].values()), 3)
+
+    def test_nested_actions_are_recorded_in_the_tree(self):
+        with instrumentation.record_action('resource_show'):
+            with instrumentation.record_action('package_show'):
+                instrumentation.record_solr_call()
+
+        actions = instrumentation.get_stats()['actions']
+        eq(actions['resource_show']['children'], {'package_show': 1})
+        eq(actions['package_show']['callers'], {'resource_show': 1})
+        eq(actions['package_show']['nested_count'], 1)
+
+    def test_solr_calls_are_counted_inclusively(self):
+        with instrumentation.record_action('resource_show'):
+            instrumentation.record_solr_call()
+            with instrumentation.record_action('package_show'):
+                instrumentation.record_solr_call()
+
+        actions = instrumentation.get_stats()['actions']
+        eq(actions['package_show']['solr_calls'], 1)
+        eq(actions['resource_show']['solr_calls'], 2)
+
+    def test_slow_calls_keep_the_call_tree(self):
+        with instrumentation.record_action('resource_show'):
+            with instrumentation.record_action('package_show'):
+                pass
+
+        slow_calls = instrumentation.get_stats()['slow_calls']
+        eq(len(slow_calls), 1)
+        eq(slow_calls[0]['action'], 'resource_show')
+        eq([child['action'] for child in slow_calls[0]['children']],
+           ['package_show'])
+
+    def test_exceptions_are_recorded_and_reraised(self):
+        with nose.tools.assert_raises(ValueError):
+            with instrumentation.record_action('package_show'):
+                raise ValueError()
+
+        stats = instrumentation.get_stats()['actions']['package_show']
+        eq(stats['count'], 1)
+
+    def test_reset(self):
+        with instrumentation.record_action('package_show'):
+            pass
+
+        instrumentation.reset()
+
+        eq(instrumentation.get_stats()['actions'], {})
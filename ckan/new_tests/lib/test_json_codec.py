@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+import datetime
+import json
+
+import nose.tools
+
+import ckan.lib.json_codec as json_codec
+
+eq = nose.tools.eq_
+
+DATA = {'name': u'd\xe9j\xe0/vu', 'tags': ['a', 'b'], 'count': 3,
+        'private': False, 'extra': None, 'ratio': 1.0 / 3}
+
+
+class Missing(object):
+    pass
+
+
+class MissingEncoder(json.JSONEncoder):
+
+    def default(self, obj):
+        if isinstance(obj, Missing):
+            return None
+        return json.JSONEncoder.default(self, obj)
+
+
+class TestJsonCodec(object):
+
+    def test_roundtrip(self):
+        eq(json_codec.loads(json_codec.dumps(DATA)), DATA)
+
+    def test_unicode_output(self):
+        result = json_codec.dumps(DATA, ensure_ascii=False)
+
+        assert isinstance(result, unicode)
+        assert u'd\xe9j\xe0/vu' in result
+        eq(json_codec.loads(result), DATA)
+
+    def test_encoder_class(self):
+        eq(json_codec.dumps({'a': Missing()}, cls=MissingEncoder),
+           '{"a": null}')
+
+    def test_objects_json_cant_represent_are_rejected(self):
+        for data in ({'a': datetime.datetime.now()}, [Missing()]):
+            nose.tools.assert_raises(TypeError, json_codec.dumps, data,
+                                     ensure_ascii=False)
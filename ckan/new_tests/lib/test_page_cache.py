@@ -0,0 +1,225 @@
+import cPickle as pickle
+import os
+import shutil
+import tempfile
+import time
+
+import nose.tools
+from nose.plugins.skip import SkipTest
+
+import ckan.lib.page_cache as page_cache
+
+eq = nose.tools.eq_
+
+
+def _page(body='<html>hello</html>'):
+    return page_cache.make_page('200 OK',
+                                [('Content-Type', 'text/html'),
+                                 ('Content-Length', str(len(body)))],
+                                body)
+
+
+class TestMakePage(object):
+
+    def test_body_is_compressed(self):
+        page = _page('x' * 1000)
+
+        assert len(page.body) < 1000
+        eq(page.uncompressed_body(), 'x' * 1000)
+
+    def test_content_length_is_not_stored(self):
+        eq(_page().headers, [('Content-Type', 'text/html')])
+
+    def test_etag_depends_on_the_body(self):
+        eq(_page('a').etag, _page('a').etag)
+        assert _page('a').etag != _page('b').etag
+
+
+class TestMemoryBackend(object):
+
+    def test_get_and_set(self):
+        cache = page_cache.MemoryBackend()
+        page = _page()
+
+        cache.set('page:/dataset?', page)
+
+        eq(cache.get('page:/dataset?'), page)
+        eq(cache.get('page:/group?'), None)
+
+    def test_least_recently_used_pages_are_dropped(self):
+        size = len(_page().body)
+        cache = page_cache.MemoryBackend(max_size=size * 2)
+        cache.set('a', _page())
+        cache.set('b', _page())
+        cache.get('a')
+
+        cache.set('c', _page())
+
+        assert cache.get('a')
+        eq(cache.get('b'), None)
+        assert cache.get('c')
+        eq(cache.size, size * 2)
+
+    def test_expired_pages_are_not_returned(self):
+        cache = page_cache.MemoryBackend(expires=10)
+        cache.set('a', _page()._replace(created=time.time() - 20))
+
+        eq(cache.get('a'), None)
+        eq(cache.size, 0)
+
+    def test_delete_and_clear(self):
+        cache = page_cache.MemoryBackend()
+        for key in ('a', 'b', 'c'):
+            cache.set(key, _page())
+
+        cache.delete(['a', 'missing'])
+        eq(cache.get('a'), None)
+        assert cache.get('b')
+
+        cache.clear()
+        eq(cache.get('b'), None)
+        eq(cache.size, 0)
+
+    def test_purge_removes_the_pages_that_depend_on_it(self):
+        cache = page_cache.MemoryBackend()
+        cache.set('a', _page(), ['package:a-id', 'group:g-id'])
+        cache.set('b', _page(), ['package:b-id', 'group:g-id'])
+        cache.set('c', _page(), ['package:c-id'])
+
+        cache.purge(['group:g-id'])
+
+        eq(cache.get('a'), None)
+        eq(cache.get('b'), None)
+        assert cache.get('c')
+        eq(cache.size, len(_page().body))
+
+    def test_evicted_pages_are_forgotten_by_their_dependencies(self):
+        size = len(_page().body)
+        cache = page_cache.MemoryBackend(max_size=size)
+        cache.set('a', _page(), ['package:a-id'])
+        cache.set('b', _page(), ['package:b-id'])
+
+        eq(cache._dependents, {'package:b-id': set(['b'])})
+
+
+class TestFileBackend(object):
+
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+
+    def teardown(self):
+        shutil.rmtree(self.directory)
+
+    def test_pages_are_shared_between_instances(self):
+        page = _page()
+        page_cache.FileBackend(self.directory).set('a', page)
+
+        eq(page_cache.FileBackend(self.directory).get('a'), page)
+
+    def test_expired_pages_are_not_returned(self):
+        cache = page_cache.FileBackend(self.directory, expires=10)
+        cache.set('a', _page()._replace(created=time.time() - 20))
+
+        eq(cache.get('a'), None)
+
+    def test_delete_and_clear(self):
+        cache = page_cache.FileBackend(self.directory)
+        for key in ('a', 'b', 'c'):
+            cache.set(key, _page())
+
+        cache.delete(['a', 'missing'])
+        eq(cache.get('a'), None)
+        assert cache.get('b')
+
+        cache.clear()
+        eq(cache.get('b'), None)
+
+    def test_purge_removes_the_pages_that_depend_on_it(self):
+        cache = page_cache.FileBackend(self.directory)
+        cache.set('a', _page(), ['package:a-id', 'group:g-id'])
+        cache.set('b', _page(), ['package:b-id'])
+
+        cache.purge(['group:g-id', 'group:unknown'])
+
+        eq(cache.get('a'), None)
+        assert cache.get('b')
+
+    def test_pickled_pages_are_not_loaded(self):
+        cache = page_cache.FileBackend(self.directory)
+        with open(cache._path('a'), 'wb') as f:
+            f.write(pickle.dumps(tuple(_page())))
+
+        eq(cache.get('a'), None)
+        assert not os.path.exists(cache._path('a'))
+
+    @nose.tools.raises(ValueError)
+    def test_directory_writable_by_others(self):
+        os.chmod(self.directory, 0777)
+
+        page_cache.FileBackend(self.directory)
+
+    def test_prune_removes_expired_and_the_oldest_pages(self):
+        size = len(_page().dumps())
+        cache = page_cache.FileBackend(self.directory, expires=100,
+                                       max_size=2 * size)
+        for age, key in ((200, 'expired'), (50, 'old'), (20, 'a'), (10, 'b')):
+            cache.set(key, _page(), ['package:%s-id' % key])
+            created = time.time() - age
+            for path in (cache._path(key),
+                         cache._dependency_path('package:%s-id' % key)):
+                os.utime(path, (created, created))
+
+        cache.prune()
+
+        eq([key for key in ('expired', 'old', 'a', 'b') if cache.get(key)],
+           ['a', 'b'])
+        assert not os.path.exists(
+            cache._dependency_path('package:expired-id'))
+
+    def test_prune_shrinks_large_dependency_files(self):
+        cache = page_cache.FileBackend(self.directory)
+        cache.max_dependencies_size = 4
+        for key in ('a', 'b', 'a', 'a'):
+            cache.set(key, _page(), ['group:g-id'])
+        cache.delete(['b'])
+
+        cache.prune()
+
+        with open(cache._dependency_path('group:g-id')) as f:
+            eq(f.read(), 'a\n')
+
+
+class TestCachedPage(object):
+
+    def test_dumps_and_loads(self):
+        page = _page()
+
+        eq(page_cache.CachedPage.loads(page.dumps()), page)
+
+    @nose.tools.raises(ValueError)
+    def test_loads_rejects_other_data(self):
+        page_cache.CachedPage.loads(pickle.dumps(tuple(_page())))
+
+
+class TestMakeBackend(object):
+
+    def test_default_is_redis(self):
+        try:
+            import redis
+        except ImportError:
+            raise SkipTest('redis is not installed')
+
+        cache = page_cache.make_backend({})
+
+        assert isinstance(cache, page_cache.RedisBackend)
+        eq(cache.expires, 3600)
+
+    def test_memory(self):
+        cache = page_cache.make_backend({'ckan.page_cache.backend': 'memory'})
+
+        assert isinstance(cache, page_cache.MemoryBackend)
+        eq(cache.expires, 3600)
+
+    @nose.tools.raises(ValueError)
+    def test_unknown_backend(self):
+        page_cache.make_backend({'ckan.page_cache.backend': 'nonsense'})
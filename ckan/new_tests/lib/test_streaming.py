@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+import gzip
+import StringIO
+
+import nose.tools
+
+import ckan.lib.streaming as streaming
+from ckan.common import json
+
+eq = nose.tools.eq_
+
+
+class TestJSONStream(object):
+
+    def test_matches_dumps(self):
+        data = {'result': [{'name': u'd\xe9j\xe0 vu', 'num': i}
+                           for i in range(100)]}
+
+        eq(''.join(streaming.JSONStream(data)), json.dumps(data))
+
+    def test_chunks(self):
+        data = ['x' * 10] * 100
+
+        chunks = list(streaming.JSONStream(data, chunk_size=100))
+
+        assert len(chunks) > 1
+        assert all(len(chunk) < 200 for chunk in chunks)
+        eq(json.loads(''.join(chunks)), data)
+
+    def test_callback(self):
+        eq(''.join(streaming.JSONStream({'a': 1}, callback='cb')),
+           'cb({"a": 1});')
+
+    def test_can_be_iterated_more_than_once(self):
+        stream = streaming.JSONStream({'a': 1})
+
+        eq(list(stream), list(stream))
+
+
+class TestGzip(object):
+
+    def _gunzip(self, data):
+        return gzip.GzipFile(fileobj=StringIO.StringIO(data)).read()
+
+    def test_gzip(self):
+        eq(self._gunzip(streaming.gzip('hello' * 100)), 'hello' * 100)
+
+    def test_gzip_stream(self):
+        stream = streaming.JSONStream(range(1000), chunk_size=100)
+
+        compressed = ''.join(streaming.GzipStream(stream))
+
+        eq(json.loads(self._gunzip(compressed)), range(1000))
@@ -0,0 +1,123 @@
+import os
+import tempfile
+
+import mock
+import nose.tools
+import sqlalchemy.exc
+
+import ckan.lib.tracking_buffer as tracking_buffer
+
+eq = nose.tools.eq_
+
+
+class TestTrackingBuffer(object):
+
+    def setup(self):
+        self.engine = mock.Mock()
+        fd, self.spool_file = tempfile.mkstemp()
+        os.close(fd)
+        os.remove(self.spool_file)
+
+    def teardown(self):
+        if os.path.exists(self.spool_file):
+            os.remove(self.spool_file)
+
+    def _buffer(self, **kwargs):
+        buf = tracking_buffer.TrackingBuffer(self.engine, **kwargs)
+        # don't let the background thread flush behind the test's back
+        buf._ensure_thread = lambda: None
+        return buf
+
+    def test_flush_writes_one_multi_row_insert(self):
+        buf = self._buffer()
+        buf.add('key-a', '/dataset/a', 'page')
+        buf.add('key-b', '/dataset/b', 'page')
+
+        buf.flush()
+
+        eq(self.engine.execute.call_count, 1)
+        args = self.engine.execute.call_args[0]
+        eq(args[0].count('(%s, %s, %s, %s)'), 2)
+        eq(args[1:4], ('key-a', '/dataset/a', 'page'))
+        eq(args[5:8], ('key-b', '/dataset/b', 'page'))
+        eq(buf.stats(), {'pending': 0, 'flushed': 2, 'dropped': 0,
+                         'spooled': 0})
+
+    def test_flush_writes_in_batches_of_flush_events(self):
+        buf = self._buffer(flush_events=2)
+        for i in range(5):
+            buf.add('key', '/dataset/%i' % i, 'page')
+
+        buf.flush()
+
+        eq(self.engine.execute.call_count, 3)
+        eq(buf.stats()['flushed'], 5)
+
+    def test_overflow_is_dropped_without_a_spool_file(self):
+        buf = self._buffer(max_events=1)
+        buf.add('key', '/dataset/a', 'page')
+        buf.add('key', '/dataset/b', 'page')
+
+        eq(buf.stats(), {'pending': 1, 'flushed': 0, 'dropped': 1,
+                         'spooled': 0})
+
+    def test_overflow_is_spooled_and_replayed(self):
+        buf = self._buffer(max_events=1, spool_file=self.spool_file)
+        buf.add('key', '/dataset/a', 'page')
+        buf.add('key', '/dataset/b', 'page')
+        eq(buf.stats()['spooled'], 1)
+
+        buf.flush()
+
+        eq(self.engine.execute.call_count, 2)
+        eq(self.engine.execute.call_args[0][1:4],
+           ('key', '/dataset/b', 'page'))
+        eq(buf.stats()['flushed'], 2)
+        assert not os.path.exists(self.spool_file)
+
+    def test_failed_writes_are_spooled_and_retried(self):
+        buf = self._buffer(spool_file=self.spool_file)
+        buf.add('key', '/dataset/a', 'page')
+        self.engine.execute.side_effect = Exception('database is down')
+
+        buf.flush()
+
+        eq(buf.stats(), {'pending': 0, 'flushed': 0, 'dropped': 0,
+                         'spooled': 1})
+
+        self.engine.execute.side_effect = None
+        buf.flush()
+
+        eq(buf.stats()['flushed'], 1)
+        assert not os.path.exists(self.spool_file)
+
+    def test_events_without_a_url_or_type_are_dropped(self):
+        buf = self._buffer()
+        buf.add('key', None, 'page')
+        buf.add('key', '/dataset/a', None)
+        buf.add('key', '/dataset/a', 'a-very-long-type')
+
+        buf.flush()
+
+        eq(self.engine.execute.call_count, 1)
+        eq(self.engine.execute.call_args[0][1:4],
+           ('key', '/dataset/a', 'a-very-lon'))
+        eq(buf.stats()['dropped'], 2)
+
+    def test_only_rejected_events_are_dropped(self):
+        buf = self._buffer(spool_file=self.spool_file)
+        for url in ('/dataset/a', '/dataset/bad', '/dataset/c'):
+            buf.add('key', url, 'page')
+
+        def execute(sql, *params):
+            if '/dataset/bad' in params:
+                raise sqlalchemy.exc.DataError(sql, params,
+                                               Exception('bad data'))
+        self.engine.execute.side_effect = execute
+
+        buf.flush()
+
+        eq(self.engine.execute.call_count, 4)
+        eq(buf.stats(), {'pending': 0, 'flushed': 2, 'dropped': 1,
+                         'spooled': 0})
+        assert not os.path.exists(self.spool_file)
@@ -288,6 +288,102 @@ class TestResourceCreate(object):
                       'resource_create', **data_dict)
 
 
+class TestFastResourceCreate(object):
+
+    def setup(self):
+        helpers.reset_db()
+
+    @helpers.change_config('ckan.fast_resource_writes', True)
+    def test_resource_create(self):
+        dataset = factories.Dataset(
+            resources=[{'url': 'http://data/1'}, {'url': 'http://data/2'}])
+
+        result = helpers.call_action('resource_create',
+                                     package_id=dataset['id'],
+                                     url='http://data/3', name='Third',
+                                     custom_field='value')
+
+        assert_equals(result['position'], 2)
+        assert_equals(result['custom_field'], 'value')
+        dataset_dict = helpers.call_action('package_show', id=dataset['id'])
+        assert_equals([r['url'] for r in dataset_dict['resources']],
+                      ['http://data/1', 'http://data/2', 'http://data/3'])
+        assert (dataset_dict['metadata_modified'] >
+                dataset['metadata_modified'])
+
+    @helpers.change_config('ckan.fast_resource_writes', True)
+    def test_it_requires_url(self):
+        dataset = factories.Dataset()
+
+        assert_raises(logic.ValidationError, helpers.call_action,
+                      'resource_create', package_id=dataset['id'], url='')
+
+    @helpers.change_config('ckan.fast_resource_writes', True)
+    def test_existing_resource_ids_are_rejected(self):
+        other_resource = factories.Resource(url='http://data/other')
+        dataset = factories.Dataset()
+
+        assert_raises(logic.ValidationError, helpers.call_action,
+                      'resource_create', package_id=dataset['id'],
+                      id=other_resource['id'], url='http://data/changed')
+
+        resource = helpers.call_action('resource_show',
+                                       id=other_resource['id'])
+        assert_equals(resource['url'], 'http://data/other')
+        assert_equals(resource['package_id'], other_resource['package_id'])
+
+    @helpers.change_config('ckan.fast_resource_writes', True)
+    def test_the_dataset_is_reindexed(self):
+        dataset = factories.Dataset()
+
+        helpers.call_action('resource_create', package_id=dataset['id'],
+                            url='http://data', format='CSV')
+
+        result = helpers.call_action('package_search', fq='res_format:CSV')
+        assert_equals([d['id'] for d in result['results']], [dataset['id']])
+
+
+class TestPackageCreateMany(object):
+
+    def setup(self):
+        helpers.reset_db()
+
+    def test_datasets_are_created_and_indexed(self):
+        results = helpers.call_action('package_create_many', datasets=[
+            {'name': 'first', 'tags': [{'name': 'harvested'}]},
+            {'name': 'second', 'tags': [{'name': 'harvested'}]}],
+            chunk_size=1)
+
+        assert_equals([r['success'] for r in results], [True, True])
+        assert_equals([r['result']['name'] for r in results],
+                      ['first', 'second'])
+        dataset = helpers.call_action('package_show', id='second')
+        assert_equals(dataset['id'], results[1]['result']['id'])
+        search = helpers.call_action('package_search', fq='tags:harvested')
+        assert_equals(search['count'], 2)
+
+    def test_errors_are_reported_per_dataset(self):
+        factories.Dataset(name='existing')
+
+        results = helpers.call_action('package_create_many', datasets=[
+            {'name': 'existing'},
+            {'name': 'new'},
+            {'name': 'new'},
+            {'name': ''}])
+
+        assert_equals([r['success'] for r in results],
+                      [False, True, False, False])
+        assert_equals(results[0]['error']['__type'], 'Validation Error')
+        assert 'name' in results[0]['error']
+        assert 'name' in results[2]['error']
+        assert_equals(helpers.call_action('package_list'),
+                      ['existing', 'new'])
+
+    def test_datasets_must_be_a_list(self):
+        assert_raises(logic.ValidationError, helpers.call_action,
+                      'package_create_many', datasets={'name': 'dataset'})
+
+
 class TestMemberCreate(object):
     @classmethod
     def setup_class(cls):
@@ -614,6 +614,64 @@ class TestGet(object):
         search_result = helpers.call_action('package_search', q='resource_abc')
         eq(search_result['results'][0]['resources'][0]['name'], resource_name)
 
+    def test_package_show_fields(self):
+        dataset = factories.Dataset()
+        resource = factories.Resource(package_id=dataset['id'])
+
+        dataset_dict = helpers.call_action(
+            'package_show', id=dataset['id'],
+            fields=['id', 'name', 'resources.url'])
+
+        eq(dataset_dict, {'id': dataset['id'], 'name': dataset['name'],
+                          'resources': [{'url': resource['url']}]})
+
+    def test_package_show_fields_comma_separated(self):
+        dataset = factories.Dataset()
+
+        dataset_dict = helpers.call_action(
+            'package_show', id=dataset['id'], fields='id,tracking_summary')
+
+        eq(sorted(dataset_dict.keys()), ['id', 'tracking_summary'])
+        eq(dataset_dict['tracking_summary'], {'total': 0, 'recent': 0})
+
+    @nose.tools.raises(logic.ValidationError)
+    def test_package_show_fields_that_are_not_strings(self):
+        dataset = factories.Dataset()
+
+        helpers.call_action('package_show', id=dataset['id'],
+                            fields=['id', {'name': 1}])
+
+    def test_package_search_fields_from_the_index(self):
+        dataset = factories.Dataset(notes='Some notes')
+        fields = ['id', 'notes', 'url']
+
+        search_result = helpers.call_action('package_search', fields=fields)
+
+        eq(search_result['results'],
+           [helpers.call_action('package_show', id=dataset['id'],
+                                fields=fields)])
+        # url isn't set, so Solr leaves it out
+        eq(sorted(search_result['results'][0]), fields)
+
+    def test_package_search_dates_match_package_show(self):
+        dataset = factories.Dataset()
+        fields = ['id', 'metadata_created', 'metadata_modified']
+
+        search_result = helpers.call_action('package_search', fields=fields)
+
+        eq(search_result['results'],
+           [helpers.call_action('package_show', id=dataset['id'],
+                                fields=fields)])
+
+    def test_package_search_fields_of_resources(self):
+        resource = factories.Resource()
+
+        search_result = helpers.call_action(
+            'package_search', fields=['name', 'resources.url'])
+
+        eq(search_result['results'][0]['resources'],
+           [{'url': resource['url']}])
+
 
 class TestBadLimitQueryParameters(object):
     '''test class for #1258 non-int query parameters cause 500 errors
@@ -644,6 +702,19 @@ class TestBadLimitQueryParameters(object):
                 logic.ValidationError, helpers.call_action, action,
                 id='test_user', limit=-1, offset=-1)
 
+    def test_activity_list_actions_unknown_before(self):
+        actions = [
+            'user_activity_list',
+            'package_activity_list',
+            'group_activity_list',
+            'organization_activity_list',
+            'recently_changed_packages_activity_list',
+        ]
+        for action in actions:
+            nose.tools.assert_raises(
+                logic.ValidationError, helpers.call_action, action,
+                id='test_user', before='not_an_activity')
+
     def test_package_search_facet_field_is_json(self):
         kwargs = {'facet.field': 'notjson'}
         nose.tools.assert_raises(
@@ -5,6 +5,8 @@ from nose.tools import assert_equals, assert_raises
 import mock
 import pylons.config as config
 
+import ckan.logic as logic
+import ckan.logic.action.update as update
 from ckan.new_tests import helpers, factories
 
 
@@ -95,3 +97,64 @@ class TestPatch(helpers.FunctionalTestBase):
 
         assert_equals(organization2['name'], 'economy')
         assert_equals(organization2['description'], 'somethingnew')
+
+
+class TestFastPackagePatch(helpers.FunctionalTestBase):
+
+    @helpers.change_config('ckan.fast_package_patch', True)
+    def test_patching_fields_and_extras(self):
+        dataset = factories.Dataset(
+            notes='some test now',
+            tags=[{'name': 'tag1'}],
+            extras=[{'key': 'extra1', 'value': 'value1'}])
+
+        patched = helpers.call_action(
+            'package_patch', id=dataset['id'], title='Changed',
+            extras=[{'key': 'extra2', 'value': 'value2'}])
+
+        dataset2 = helpers.call_action('package_show', id=dataset['id'])
+        assert_equals(patched, dataset2)
+        assert_equals(dataset2['title'], 'Changed')
+        assert_equals(dataset2['notes'], 'some test now')
+        assert_equals(dataset2['extras'],
+                      [{'key': 'extra2', 'value': 'value2'}])
+        assert_equals([tag['name'] for tag in dataset2['tags']], ['tag1'])
+
+    @helpers.change_config('ckan.fast_package_patch', True)
+    def test_only_the_patched_fields_are_validated(self):
+        dataset = factories.Dataset()
+        factories.Dataset(name='taken')
+
+        assert_raises(
+            logic.ValidationError, helpers.call_action, 'package_patch',
+            id=dataset['id'], name='taken')
+        assert_raises(
+            logic.ValidationError, helpers.call_action, 'package_patch',
+            id=dataset['id'], private=True)
+
+    @helpers.change_config('ckan.fast_package_patch', True)
+    def test_other_keys_use_package_update(self):
+        dataset = factories.Dataset(tags=[{'name': 'tag1'}])
+
+        with mock.patch('ckan.logic.action.update.package_update',
+                        wraps=update.package_update) as package_update:
+            helpers.call_action('package_patch', id=dataset['id'],
+                                tags=[{'name': 'tag2'}])
+            helpers.call_action('package_patch', id=dataset['id'],
+                                title='Changed')
+
+        assert_equals(package_update.call_count, 1)
+        dataset = helpers.call_action('package_show', id=dataset['id'])
+        assert_equals([tag['name'] for tag in dataset['tags']], ['tag2'])
+        assert_equals(dataset['title'], 'Changed')
+
+    @helpers.change_config('ckan.fast_package_patch', True)
+    def test_the_dataset_is_reindexed(self):
+        dataset = factories.Dataset()
+
+        helpers.call_action('package_patch', id=dataset['id'],
+                            title='Changed')
+
+        result = helpers.call_action('package_search',
+                                     fq='title:Changed')
+        assert_equals([d['id'] for d in result['results']], [dataset['id']])
@@ -6,6 +6,7 @@ import mock
 import pylons.config as config
 
 import ckan.logic as logic
+import ckan.logic.action.update as update
 import ckan.plugins as p
 import ckan.new_tests.helpers as helpers
 import ckan.new_tests.factories as factories
@@ -624,3 +625,119 @@ class TestResourceViewUpdate(object):
 
         result = helpers.call_action('resource_view_update', **params)
         assert_equals(result, resource_view)
+
+
+class TestFastResourceUpdate(object):
+
+    def setup(self):
+        helpers.reset_db()
+
+    @helpers.change_config('ckan.fast_resource_writes', True)
+    def test_resource_update(self):
+        dataset = factories.Dataset(
+            resources=[{'url': 'http://data/1', 'name': 'First'},
+                       {'url': 'http://data/2', 'name': 'Second'}])
+        resource = dataset['resources'][1]
+
+        result = helpers.call_action('resource_update', id=resource['id'],
+                                     url='http://data/new', name='Changed')
+
+        assert_equals(result['name'], 'Changed')
+        dataset_dict = helpers.call_action('package_show', id=dataset['id'])
+        assert_equals([r['name'] for r in dataset_dict['resources']],
+                      ['First', 'Changed'])
+        assert_equals(dataset_dict['resources'][1]['url'], 'http://data/new')
+
+    @helpers.change_config('ckan.fast_resource_writes', True)
+    def test_other_resources_are_not_saved(self):
+        dataset = factories.Dataset(
+            resources=[{'url': 'http://data/1'}, {'url': 'http://data/2'}])
+        first, second = dataset['resources']
+
+        helpers.call_action('resource_update', id=second['id'],
+                            url='http://data/new')
+
+        dataset_dict = helpers.call_action('package_show', id=dataset['id'])
+        assert_equals(dataset_dict['resources'][0]['revision_id'],
+                      first['revision_id'])
+        assert (dataset_dict['resources'][1]['revision_id'] !=
+                second['revision_id'])
+
+
+class TestPackageUpdateMany(object):
+
+    def setup(self):
+        helpers.reset_db()
+
+    def test_datasets_are_updated_and_indexed(self):
+        first = factories.Dataset()
+        second = factories.Dataset()
+
+        results = helpers.call_action('package_update_many', datasets=[
+            dict(first, notes='Harvested again'),
+            dict(second, notes='Harvested again')])
+
+        assert_equals([r['result']['id'] for r in results],
+                      [first['id'], second['id']])
+        for dataset in (first, second):
+            dataset = helpers.call_action('package_show', id=dataset['id'])
+            assert_equals(dataset['notes'], 'Harvested again')
+        search = helpers.call_action('package_search',
+                                     q='notes:"Harvested again"')
+        assert_equals(search['count'], 2)
+
+    def test_errors_are_reported_per_dataset(self):
+        dataset = factories.Dataset()
+
+        results = helpers.call_action('package_update_many', datasets=[
+            {'id': 'missing'},
+            dict(dataset, title='Changed')])
+
+        assert not results[0]['success']
+        assert_equals(results[0]['error']['__type'], 'Not Found Error')
+        assert results[1]['success']
+        assert_equals(
+            helpers.call_action('package_show', id=dataset['id'])['title'],
+            'Changed')
+
+    def test_badly_formed_datasets_are_reported_per_dataset(self):
+        dataset = factories.Dataset()
+
+        results = helpers.call_action('package_update_many', datasets=[
+            {'title': 'No id or name'},
+            dict(dataset, resources=['Not a dict']),
+            dict(dataset, title='Changed')])
+
+        for result in results[:2]:
+            assert not result['success']
+            assert_equals(result['error']['__type'], 'Validation Error')
+        assert 'name' in results[0]['error']
+        assert results[2]['success']
+        assert_equals(
+            helpers.call_action('package_show', id=dataset['id'])['title'],
+            'Changed')
+
+    def test_failed_chunks_do_not_stop_the_others(self):
+        first = factories.Dataset()
+        second = factories.Dataset()
+        save = update._package_update_save
+
+        def failing_save(context, data):
+            if data['id'] == first['id']:
+                raise Exception('Plugin failed')
+            return save(context, data)
+
+        with mock.patch('ckan.logic.action.update._package_update_save',
+                        failing_save):
+            results = helpers.call_action('package_update_many', datasets=[
+                dict(first, title='Changed'),
+                dict(second, title='Changed')], chunk_size=1)
+
+        assert not results[0]['success']
+        assert_equals(results[0]['error']['__type'], 'Internal Error')
+        assert 'Plugin failed' in results[0]['error']['message']
+        assert results[1]['success']
+        for dataset, title in ((first, first['title']), (second, 'Changed')):
+            assert_equals(helpers.call_action('package_show',
+                                              id=dataset['id'])['title'],
+                          title)
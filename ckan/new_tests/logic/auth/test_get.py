@@ -68,3 +68,29 @@ class TestGet(object):
         ret = helpers.call_auth('group_show', context=context,
                                 id=org['name'])
         assert ret
+
+    def _latest_activity_id(self, dataset):
+        return model.activity.package_activity_list(dataset['id'], 1,
+                                                    0)[0].id
+
+    def test_activity_data_show__private_dataset_is_hidden_to_public(self):
+        org = factories.Organization()
+        dataset = factories.Dataset(owner_org=org['id'])
+        activity_id = self._latest_activity_id(dataset)
+        # Private datasets get no new activities, but keep their old ones
+        helpers.call_action('package_patch', id=dataset['id'], private=True)
+        context = {'model': model}
+        context['user'] = ''
+
+        assert_raises(logic.NotAuthorized, helpers.call_auth,
+                      'activity_data_show', context=context,
+                      id=activity_id)
+
+    def test_activity_data_show__public_dataset_is_visible_to_public(self):
+        dataset = factories.Dataset()
+        context = {'model': model}
+        context['user'] = ''
+
+        ret = helpers.call_auth('activity_data_show', context=context,
+                                id=self._latest_activity_id(dataset))
+        assert ret
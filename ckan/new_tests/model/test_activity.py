@@ -0,0 +1,280 @@
+import nose.tools
+
+import ckan.model as model
+
+import ckan.new_tests.helpers as helpers
+import ckan.new_tests.factories as factories
+
+eq = nose.tools.eq_
+
+
+def _union_query_ids(user_id):
+    q = model.activity._dashboard_activity_query(user_id, 100)
+    return [activity.id for activity in
+            model.activity._activities_at_offset(q, 100, 0)]
+
+
+def _feed_ids(user_id):
+    return [activity.id for activity in
+            model.activity._dashboard_feed_query(user_id).all()]
+
+
+class TestDashboardFeed(object):
+
+    def setup(self):
+        helpers.reset_db()
+
+    def _make_activities(self):
+        user = factories.User()
+        followed_user = factories.User()
+        dataset = factories.Dataset()
+        group = factories.Group()
+        group_dataset = factories.Dataset(groups=[{'id': group['id']}])
+        context = {'user': user['name']}
+        helpers.call_action('follow_user', context=context,
+                            id=followed_user['id'])
+        helpers.call_action('follow_dataset', context=context,
+                            id=dataset['id'])
+        helpers.call_action('follow_group', context=context,
+                            id=group['id'])
+
+        helpers.call_action('package_patch', id=dataset['id'],
+                            title='Changed')
+        helpers.call_action('package_patch', id=group_dataset['id'],
+                            title='Changed')
+        helpers.call_action('user_update',
+                            context={'user': followed_user['name']},
+                            id=followed_user['id'], fullname='Changed',
+                            email=followed_user['email'])
+        # Nothing to do with the user
+        self.other_dataset = factories.Dataset()
+        return user
+
+    @helpers.change_config('ckan.activity_streams_dashboard_feed', True)
+    def test_feed_has_the_activities_of_everything_followed(self):
+        user = self._make_activities()
+
+        feed_ids = _feed_ids(user['id'])
+        union_ids = _union_query_ids(user['id'])
+
+        # Only the activities created before the follows are missing
+        assert set(feed_ids) < set(union_ids)
+        # the followed user's change and the two dataset changes
+        eq(feed_ids[:3], union_ids[:3])
+        other_activities = model.activity.package_activity_list(
+            self.other_dataset['id'], 10, 0)
+        assert other_activities
+        assert not set(a.id for a in other_activities) & set(feed_ids)
+
+    @helpers.change_config('ckan.activity_streams_dashboard_feed', True)
+    def test_dashboard_activity_list_reads_the_feed(self):
+        user = self._make_activities()
+
+        activities = helpers.call_action(
+            'dashboard_activity_list', context={'user': user['name']},
+            limit=2, offset=1)
+
+        eq([activity['id'] for activity in activities],
+           _feed_ids(user['id'])[1:3])
+
+    def test_nothing_is_copied_when_disabled(self):
+        user = self._make_activities()
+
+        eq(_feed_ids(user['id']), [])
+
+    def test_backfill(self):
+        user = self._make_activities()
+
+        added = model.activity.backfill_dashboard_activity(user['id'], 100)
+        model.Session.commit()
+
+        eq(added, len(_union_query_ids(user['id'])))
+        eq(_feed_ids(user['id']), _union_query_ids(user['id']))
+        # Running it again adds nothing
+        eq(model.activity.backfill_dashboard_activity(user['id'], 100), 0)
+
+
+class TestDashboardNewActivitiesCount(object):
+
+    def setup(self):
+        helpers.reset_db()
+
+    def _count(self, user, limit=31):
+        last_viewed = model.Dashboard.get(
+            user['id']).activity_stream_last_viewed
+        return model.activity.dashboard_new_activities_count(
+            user['id'], last_viewed, limit)
+
+    def _make_activities(self):
+        user = factories.User()
+        dataset = factories.Dataset()
+        # Sets the time the user last viewed the dashboard
+        model.Dashboard.get(user['id'])
+        helpers.call_action('follow_dataset', context={'user': user['name']},
+                            id=dataset['id'])
+        for i in range(3):
+            helpers.call_action('package_patch', id=dataset['id'],
+                                title='Changed %i' % i)
+        return user
+
+    def test_count(self):
+        user = self._make_activities()
+
+        # the user's own follow activity isn't counted
+        eq(self._count(user), 3)
+        eq(self._count(user, limit=2), 2)
+
+    def test_count_matches_dashboard_activity_list(self):
+        user = self._make_activities()
+        context = {'user': user['name']}
+
+        activities = helpers.call_action('dashboard_activity_list',
+                                         context=context)
+
+        eq(helpers.call_action('dashboard_new_activities_count',
+                               context=context),
+           len([a for a in activities if a['is_new']]))
+
+    @helpers.change_config('ckan.activity_streams_dashboard_feed', True)
+    def test_count_from_the_feed(self):
+        user = self._make_activities()
+
+        eq(self._count(user), 3)
+
+    def test_viewed_activities_are_not_counted(self):
+        user = self._make_activities()
+        helpers.call_action('dashboard_mark_activities_old',
+                            context={'user': user['name']})
+
+        eq(self._count(user), 0)
+
+
+class TestCompactData(object):
+
+    def setup(self):
+        helpers.reset_db()
+
+    def _latest_activity(self, dataset):
+        return model.activity.package_activity_list(dataset['id'], 1, 0)[0]
+
+    def _change_dataset(self):
+        dataset = factories.Dataset(notes='Some notes')
+        return helpers.call_action('package_patch', id=dataset['id'],
+                                   title='Changed')
+
+    @helpers.change_config('ckan.activity_streams_compact_data', True)
+    def test_new_activities_are_compact(self):
+        dataset = self._change_dataset()
+
+        data = self._latest_activity(dataset).data
+
+        eq(data['compact'], True)
+        eq(sorted(data['package']),
+           sorted(model.activity.COMPACT_FIELDS['package']))
+        eq(data['package']['title'], 'Changed')
+
+    @helpers.change_config('ckan.activity_streams_compact_data', True)
+    def test_activity_data_show_rebuilds_the_dataset(self):
+        dataset = self._change_dataset()
+        activity = self._latest_activity(dataset)
+
+        data = helpers.call_action('activity_data_show', id=activity.id)
+
+        assert 'compact' not in data
+        eq(data['package']['title'], 'Changed')
+        eq(data['package']['notes'], 'Some notes')
+
+    @helpers.change_config('ckan.activity_streams_compact_data', True)
+    def test_resource_details_are_compact(self):
+        dataset = factories.Dataset()
+        resource = factories.Resource(package_id=dataset['id'],
+                                      description='A resource')
+
+        details = model.ActivityDetail.by_activity_id(
+            self._latest_activity(dataset).id)
+        data = [detail.data for detail in details
+                if detail.object_type == u'Resource'][0]
+
+        eq(data['resource']['id'], resource['id'])
+        assert 'description' not in data['resource']
+        eq(model.activity.expand_data(data)['resource']['description'],
+           'A resource')
+
+    def test_compact_activity_data(self):
+        dataset = self._change_dataset()
+        full_data = self._latest_activity(dataset).data
+        model.Session.remove()
+
+        assert model.activity.compact_activity_data(batch_size=1) > 0
+
+        data = self._latest_activity(dataset).data
+        eq(data['compact'], True)
+        eq(model.activity.expand_data(data), full_data)
+        # Running it again changes nothing
+        eq(model.activity.compact_activity_data(), 0)
+
+
+class TestActivityListBefore(object):
+
+    def setup(self):
+        helpers.reset_db()
+
+    def _ids(self, activities):
+        return [activity['id'] for activity in activities]
+
+    def test_pages_match_offset_pages(self):
+        dataset = factories.Dataset()
+        for i in range(5):
+            helpers.call_action('package_patch', id=dataset['id'],
+                                title='Changed %i' % i)
+        everything = helpers.call_action('package_activity_list',
+                                         id=dataset['id'])
+        eq(len(everything), 6)
+
+        first_page = helpers.call_action('package_activity_list',
+                                         id=dataset['id'], limit=4)
+        second_page = helpers.call_action('package_activity_list',
+                                          id=dataset['id'], limit=4,
+                                          before=first_page[-1]['id'])
+
+        eq(self._ids(first_page) + self._ids(second_page),
+           self._ids(everything))
+
+    def test_activities_with_the_same_timestamp(self):
+        dataset = factories.Dataset()
+        activities = model.activity.package_activity_list(dataset['id'], 1, 0)
+        timestamp = activities[0].timestamp
+        for i in range(3):
+            activity = model.Activity(None, dataset['id'], None,
+                                      'changed package', {})
+            activity.timestamp = timestamp
+            model.Session.add(activity)
+        model.Session.commit()
+
+        pages = []
+        before = None
+        while True:
+            page = model.activity.package_activity_list(dataset['id'], 1, 0,
+                                                        before=before)
+            if not page:
+                break
+            pages.append(page[0].id)
+            before = (page[0].timestamp, page[0].id)
+
+        eq(pages, [activity.id for activity in
+                   model.activity.package_activity_list(dataset['id'], 10,
+                                                        0)])
+        eq(len(set(pages)), 4)
+
+    def test_user_activity_list(self):
+        user = factories.User()
+        context = {'user': user['name']}
+        for i in range(3):
+            factories.Dataset(user=user)
+        everything = helpers.call_action('user_activity_list', id=user['id'])
+
+        page = helpers.call_action('user_activity_list', context=context,
+                                   id=user['id'], limit=2,
+                                   before=everything[0]['id'])
+
+        eq(self._ids(page), self._ids(everything)[1:3])
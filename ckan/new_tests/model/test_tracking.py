@@ -0,0 +1,157 @@
+import datetime
+
+import nose.tools
+
+import ckan.model as model
+import ckan.lib.cli as cli
+
+import ckan.new_tests.helpers as helpers
+import ckan.new_tests.factories as factories
+
+eq = nose.tools.eq_
+
+
+def _add_summary(url, package_id, tracking_date, running_total,
+                 recent_views, tracking_type='resource'):
+    model.Session.execute(
+        model.tracking_summary_table.insert().values(
+            url=url, package_id=package_id, tracking_type=tracking_type,
+            count=1, running_total=running_total, recent_views=recent_views,
+            tracking_date=tracking_date))
+    model.Session.commit()
+
+
+def _update_tracking_latest(start_date):
+    cli.Tracking('Tracking').update_tracking_latest(model.meta.engine,
+                                                    start_date)
+
+
+class TestTrackingSummary(object):
+
+    def setup(self):
+        helpers.reset_db()
+        self.today = datetime.datetime.combine(datetime.date.today(),
+                                               datetime.time(0))
+        self.yesterday = self.today - datetime.timedelta(days=1)
+
+    def test_get_for_resources_returns_the_latest_summaries(self):
+        _add_summary(u'http://a', None, self.yesterday, 1, 1)
+        _add_summary(u'http://a', None, self.today, 3, 2)
+        _add_summary(u'http://b', None, self.today, 5, 5)
+        _update_tracking_latest(self.yesterday)
+
+        summaries = model.TrackingSummary.get_for_resources(
+            [u'http://a', u'http://b', u'http://c'])
+
+        eq(summaries, {u'http://a': {'total': 3, 'recent': 2},
+                       u'http://b': {'total': 5, 'recent': 5},
+                       u'http://c': {'total': 0, 'recent': 0}})
+
+    def test_get_for_resources_matches_get_for_resource(self):
+        _add_summary(u'http://a', None, self.today, 3, 2)
+        _update_tracking_latest(self.today)
+
+        summaries = model.TrackingSummary.get_for_resources([u'http://a'])
+
+        eq(summaries[u'http://a'],
+           model.TrackingSummary.get_for_resource(u'http://a'))
+
+    def test_get_for_packages(self):
+        _add_summary(u'/dataset/a', u'a-id', self.today, 7, 4, 'page')
+        _update_tracking_latest(self.today)
+
+        summaries = model.TrackingSummary.get_for_packages(
+            [u'a-id', u'b-id'])
+
+        eq(summaries, {u'a-id': {'total': 7, 'recent': 4},
+                       u'b-id': {'total': 0, 'recent': 0}})
+        eq(model.TrackingSummary.get_for_package(u'a-id'),
+           {'total': 7, 'recent': 4})
+
+    def test_get_for_packages_with_several_urls(self):
+        _add_summary(u'/dataset/old-name', u'a-id', self.yesterday, 2, 2,
+                     'page')
+        _add_summary(u'/dataset/a', u'a-id', self.today, 7, 4, 'page')
+        _add_summary(u'/dataset/a-id', u'a-id', self.yesterday, 5, 3, 'page')
+        _update_tracking_latest(self.yesterday)
+
+        eq(model.TrackingSummary.get_for_packages([u'a-id']),
+           {u'a-id': {'total': 7, 'recent': 4}})
+        eq(model.TrackingSummary.get_for_package(u'a-id'),
+           {'total': 7, 'recent': 4})
+
+    def test_get_for_packages_with_no_ids(self):
+        eq(model.TrackingSummary.get_for_packages([]), {})
+
+    def test_update_only_touches_urls_updated_since_the_start_date(self):
+        _add_summary(u'http://a', None, self.yesterday, 1, 1)
+        _add_summary(u'http://b', None, self.yesterday, 1, 1)
+        _update_tracking_latest(self.yesterday)
+        _add_summary(u'http://a', None, self.today, 2, 2)
+
+        _update_tracking_latest(self.today)
+
+        latest = model.Session.execute(
+            model.tracking_latest_table.select().order_by('url')).fetchall()
+        eq([(row['url'], row['running_total']) for row in latest],
+           [(u'http://a', 2), (u'http://b', 1)])
+
+
+def _add_raw(user_key, url, tracking_type, access_timestamp):
+    model.Session.execute(
+        '''INSERT INTO tracking_raw
+           (user_key, url, tracking_type, access_timestamp)
+           VALUES (:user_key, :url, :tracking_type, :access_timestamp)''',
+        {'user_key': user_key, 'url': url, 'tracking_type': tracking_type,
+         'access_timestamp': access_timestamp})
+    model.Session.commit()
+
+
+class TestUpdateTracking(object):
+
+    def setup(self):
+        helpers.reset_db()
+        self.start = datetime.datetime(2014, 1, 1)
+
+    def _day(self, days):
+        return self.start + datetime.timedelta(days=days, hours=12)
+
+    def _summaries(self):
+        rows = model.Session.execute(
+            model.tracking_summary_table.select().order_by(
+                'tracking_date', 'url')).fetchall()
+        return [(row['url'], row['tracking_date'].day, row['count'],
+                 row['running_total'], row['recent_views'])
+                for row in rows]
+
+    def test_running_totals_over_several_days(self):
+        _add_raw('a', u'http://a', 'resource', self._day(0))
+        _add_raw('b', u'http://a', 'resource', self._day(0))
+        _add_raw('a', u'http://a', 'resource', self._day(0))
+        _add_raw('a', u'http://a', 'resource', self._day(1))
+        _add_raw('a', u'http://a', 'resource', self._day(20))
+
+        cli.Tracking('Tracking').update_tracking(
+            model.meta.engine, self.start,
+            self.start + datetime.timedelta(days=21))
+
+        eq(self._summaries(), [(u'http://a', 1, 2, 2, 2),
+                               (u'http://a', 2, 1, 3, 3),
+                               (u'http://a', 21, 1, 4, 1)])
+
+    def test_page_views_are_counted_by_dataset(self):
+        dataset = factories.Dataset(name='my-dataset')
+        _add_raw('a', u'/dataset/my-dataset', 'page', self._day(0))
+        _add_raw('b', u'/de/dataset/my-dataset', 'page', self._day(0))
+        _add_raw('a', u'/dataset/missing', 'page', self._day(0))
+
+        cli.Tracking('Tracking').update_tracking(model.meta.engine,
+                                                 self.start)
+
+        rows = model.Session.execute(
+            model.tracking_summary_table.select().order_by('url')).fetchall()
+        eq([(row['url'], row['package_id'], row['running_total'])
+            for row in rows],
+           [(u'/dataset/missing', u'~~not~found~~', 0),
+            (u'/dataset/my-dataset', dataset['id'], 2),
+            (u'/de/dataset/my-dataset', dataset['id'], 2)])
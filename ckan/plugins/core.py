@@ -130,6 +130,10 @@ def load_all(config):
             asbool(config.get('ckan.search.automatic_indexing', True)):
         log.debug('Loading the synchronous search plugin')
         plugins.append('synchronous_search')
+    # Add the plugin that purges the page cache when datasets change
+    if 'page_cache' not in plugins and \
+            asbool(config.get('ckan.page_cache_enabled', False)):
+        plugins.append('page_cache')
 
     load(*plugins)
 
@@ -30,6 +30,7 @@ entry_points = {
         'celeryd = ckan.lib.cli:Celery',
         'rdf-export = ckan.lib.cli:RDFExport',
         'tracking = ckan.lib.cli:Tracking',
+        'activity = ckan.lib.cli:ActivityCmd',
         'plugin-info = ckan.lib.cli:PluginInfo',
         'profile = ckan.lib.cli:Profile',
         'color = ckan.lib.cli:CreateColorSchemeCommand',
@@ -61,6 +62,7 @@ entry_points = {
     ],
     'ckan.plugins': [
         'synchronous_search = ckan.lib.search:SynchronousSearchPlugin',
+        'page_cache = ckan.lib.page_cache:PageCachePlugin',
         'stats = ckanext.stats.plugin:StatsPlugin',
         'publisher_form = ckanext.publisher_form.forms:PublisherForm',
         'publisher_dataset_form = ckanext.publisher_form.forms:PublisherDatasetForm',